@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Admission Control
+Token-bucket rate limits per user and per chat, plus a bounded priority queue in
+front of the expensive commands. Short /faq questions are admitted ahead of heavy
+/analyze_support runs, and when the queue is full requests are shed immediately
+with a "busy" reply instead of piling up behind the OpenAI quota.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+
+# Queue settings
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', '8'))            # Commands running at once
+ADMISSION_MAX_QUEUED = int(os.getenv('ADMISSION_MAX_QUEUED', '32'))           # Commands waiting for a slot
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '30'))   # Seconds a command may wait
+ADMISSION_MAX_BUCKETS = 10000            # Rate limit buckets kept (least recently used are dropped)
+ADMISSION_NOTICE_INTERVAL = 30           # Min seconds between rate limit notices to one user
+
+# Per-command policy. Lower priority runs first; rates are tokens per second
+CommandPolicy = namedtuple('CommandPolicy', 'priority user_rate user_burst chat_rate chat_burst')
+COMMAND_POLICIES = {
+    'faq': CommandPolicy(priority=0, user_rate=1 / 6, user_burst=5, chat_rate=1.0, chat_burst=20),
+    'refresh_faq': CommandPolicy(priority=1, user_rate=1 / 60, user_burst=1, chat_rate=1 / 60, chat_burst=2),
+    'analyze_support': CommandPolicy(priority=2, user_rate=1 / 300, user_burst=8, chat_rate=1 / 150, chat_burst=12),
+}
+ANALYSIS_HOURS_PER_TOKEN = 6             # /analyze_support costs one token per 6 hours analysed
+
+
+def analysis_cost(hours):
+    """Token cost of an /analyze_support run over the given number of hours"""
+    return max(1, math.ceil(hours / ANALYSIS_HOURS_PER_TOKEN))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a command is rate limited or shed because the queue is full"""
+
+    def __init__(self, reason, retry_after=None, notify=True):
+        super().__init__(reason)
+        self.reason = reason            # 'user_rate', 'chat_rate', 'queue_full' or 'queue_timeout'
+        self.retry_after = retry_after
+        self.notify = notify            # False when the user was told recently; stay quiet
+
+    @property
+    def message(self):
+        if self.reason in ('user_rate', 'chat_rate'):
+            wait = f" in {math.ceil(self.retry_after)}s" if self.retry_after else " later"
+            return f"⏳ Slow down a little, please try again{wait}."
+        return "⏳ I'm busy answering other questions right now, please try again in a minute."
+
+
+class TokenBucket:
+    """Classic token bucket: `burst` tokens, refilled at `rate` tokens per second"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost=1, now=None):
+        """Seconds until `cost` tokens are available (0 if available now)"""
+        self._refill(time.monotonic() if now is None else now)
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost=1):
+        self.tokens -= min(cost, self.burst)
+
+    def give_back(self, cost=1):
+        self.tokens = min(self.burst, self.tokens + min(cost, self.burst))
+
+
+class AdmissionController:
+    """Rate limits and orders the bot's expensive commands"""
+
+    def __init__(self, max_active=ADMISSION_MAX_ACTIVE, max_queued=ADMISSION_MAX_QUEUED,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, policies=COMMAND_POLICIES):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.policies = policies
+        self._buckets = OrderedDict()   # (command, 'user'|'chat', id) -> TokenBucket
+        self._notified_at = {}          # user id -> monotonic time of the last rate limit notice
+        self._waiters = []              # heap of (priority, seq, future, command)
+        self._seq = itertools.count()
+        self._active = 0
+        self._queued = Counter()        # command -> commands waiting for a slot
+        self.admitted = Counter()
+        self.rejected = Counter()       # reason -> count
+
+    def _bucket(self, command, scope, key, rate, burst):
+        bucket_key = (command, scope, key)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = TokenBucket(rate, burst)
+            while len(self._buckets) > ADMISSION_MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(bucket_key)
+        return bucket
+
+    def _should_notify(self, user_id, now):
+        last = self._notified_at.get(user_id)
+        if last is not None and now - last < ADMISSION_NOTICE_INTERVAL:
+            return False
+        self._notified_at[user_id] = now
+        if len(self._notified_at) > ADMISSION_MAX_BUCKETS:
+            self._notified_at = {k: t for k, t in self._notified_at.items() if now - t < ADMISSION_NOTICE_INTERVAL}
+        return True
+
+    def _check_rate(self, command, policy, user_id, chat_id, cost):
+        now = time.monotonic()
+        user_bucket = self._bucket(command, 'user', user_id, policy.user_rate, policy.user_burst)
+        chat_bucket = self._bucket(command, 'chat', chat_id, policy.chat_rate, policy.chat_burst)
+        # Check both before taking from either, so a chat-level rejection doesn't cost the user
+        for reason, bucket in (('user_rate', user_bucket), ('chat_rate', chat_bucket)):
+            wait = bucket.wait_time(cost, now)
+            if wait > 0:
+                self.rejected[reason] += 1
+                logging.warning(f"Admission: /{command} from user {user_id} in chat {chat_id} "
+                                f"rejected ({reason}, retry in {wait:.0f}s)")
+                raise AdmissionRejected(reason, retry_after=wait, notify=self._should_notify(user_id, now))
+        user_bucket.take(cost)
+        chat_bucket.take(cost)
+        return user_bucket, chat_bucket
+
+    async def _acquire(self, command, priority):
+        queued = sum(self._queued.values())
+        if self._active < self.max_active and not queued:
+            self._active += 1
+            return
+
+        if queued >= self.max_queued:
+            self.rejected['queue_full'] += 1
+            logging.warning(f"Admission: queue full ({self.max_queued} waiting), shedding /{command}")
+            raise AdmissionRejected('queue_full')
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), waiter, command))
+        self._queued[command] += 1
+        try:
+            # Shield so a timeout leaves the future for _release to see as abandoned
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # The slot was handed over just as we gave up
+                if isinstance(e, asyncio.TimeoutError):
+                    return
+                self._release()
+                raise
+            waiter.cancel()
+            self._queued[command] -= 1
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected['queue_timeout'] += 1
+            logging.warning(f"Admission: /{command} waited {self.queue_timeout}s for a slot, shedding")
+            raise AdmissionRejected('queue_timeout') from None
+
+    def _release(self):
+        # Hand the slot straight to the highest-priority live waiter
+        while self._waiters:
+            _, _, waiter, command = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+            self._queued[command] -= 1
+            waiter.set_result(None)
+            return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def admit(self, command, user_id, chat_id, cost=1):
+        """
+        Rate limit, then wait for a slot in priority order; the slot is held for the
+        body of the `async with`. Raises AdmissionRejected if the command must be shed.
+        """
+        policy = self.policies[command]
+        buckets = self._check_rate(command, policy, user_id, chat_id, cost)
+        queued_at = time.monotonic()
+        try:
+            await self._acquire(command, policy.priority)
+        except AdmissionRejected:
+            # Shed for load, not for the user's behaviour: don't charge their rate limit
+            for bucket in buckets:
+                bucket.give_back(cost)
+            raise
+        self.admitted[command] += 1
+        waited = time.monotonic() - queued_at
+        if waited > 1:
+            logging.info(f"Admission: /{command} waited {waited:.1f}s for a slot")
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        return {
+            'active': self._active,
+            'max_active': self.max_active,
+            'queued': sum(self._queued.values()),
+            'queued_by_command': {command: n for command, n in self._queued.items() if n},
+            'max_queued': self.max_queued,
+            'admitted': dict(self.admitted),
+            'rejected': dict(self.rejected),
+        }
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+FAQ Answer Cache
+LRU + TTL cache of FAQ answers keyed on the normalized question. Near-duplicate
+questions are matched with MinHash signatures over content-word shingles and
+must ask about exactly the same content words, so "stuck on GPU" never gets
+the answer for "stuck on CPU". The whole cache is dropped whenever the FAQ
+corpus hash changes.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from faq_retrieval import tokenize
+
+# Cache settings
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_TTL = 6 * 3600          # Seconds an answer stays valid
+NEAR_DUPLICATE_THRESHOLD = 0.5       # Estimated word-shingle Jaccard for a near-duplicate hit (same content words required too)
+SHINGLE_SIZE = 2                     # Longest word n-gram used as a shingle
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16                   # LSH bands (MINHASH_PERMUTATIONS / MINHASH_BANDS rows each)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+def _shingles(text):
+    # Content words only, so rewordings that differ in stopwords ("the", "how do I") still match
+    words = tokenize(text) or text.split() or [text]
+    return {" ".join(words[i:i + n]) for n in range(1, SHINGLE_SIZE + 1) for i in range(len(words) - n + 1)}
+
+
+def content_terms(text):
+    """The words a question is about (stopwords and plurals folded away); near-duplicates must share all of them"""
+    return frozenset(tokenize(text))
+
+
+def _permutation_params():
+    # Deterministic (a, b) pairs so signatures are stable across restarts
+    params = []
+    for i in range(MINHASH_PERMUTATIONS):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], 'little') % (_MERSENNE_PRIME - 1) + 1
+        b = int.from_bytes(digest[8:], 'little') % _MERSENNE_PRIME
+        params.append((a, b))
+    return params
+
+
+_PERMUTATIONS = _permutation_params()
+
+
+def minhash_signature(text):
+    """MinHash signature of the content-word shingles of an already normalized text"""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'little')
+              for s in _shingles(text)]
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def _similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class AnswerCache:
+    """Thread-safe answer cache with exact and near-duplicate lookup"""
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.corpus_hash = None
+        self._entries = OrderedDict()   # normalized question -> (answer, signature, stored_at, content terms)
+        self._buckets = {}              # (band, band_hash) -> set of normalized questions
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _band_keys(self, signature):
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(MINHASH_BANDS)]
+
+    def _remove(self, key):
+        _, signature, _, _ = self._entries.pop(key)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _expired(self, stored_at, now):
+        return now - stored_at > self.ttl
+
+    def get(self, question):
+        """Return a cached answer for the question (or a near-duplicate), else None"""
+        key = normalize_question(question)
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not self._expired(entry[2], now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self._remove(key)
+                self.evictions += 1
+
+            signature = minhash_signature(key)
+            terms = content_terms(key)
+            candidates = set()
+            for band_key in self._band_keys(signature):
+                candidates.update(self._buckets.get(band_key, ()))
+
+            best_key, best_score = None, 0.0
+            for candidate in candidates:
+                answer, candidate_sig, stored_at, candidate_terms = self._entries[candidate]
+                # Similar wording about a different thing (GPU vs CPU, mainnet vs testnet) is not a duplicate
+                if self._expired(stored_at, now) or candidate_terms != terms:
+                    continue
+                score = _similarity(signature, candidate_sig)
+                if score > best_score:
+                    best_key, best_score = candidate, score
+
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                self.near_hits += 1
+                logging.info(f"Answer cache near-duplicate hit ({best_score:.2f}): '{key}' ~ '{best_key}'")
+                return self._entries[best_key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, question, answer):
+        key = normalize_question(question)
+        if not key:
+            return
+        signature = minhash_signature(key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (answer, signature, time.monotonic(), content_terms(key))
+            for band_key in self._band_keys(signature):
+                self._buckets.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def set_corpus_hash(self, corpus_hash):
+        """Drop every cached answer if the FAQ corpus changed since they were stored"""
+        with self._lock:
+            if corpus_hash == self.corpus_hash:
+                return
+            if self._entries:
+                logging.info(f"FAQ corpus changed, invalidating {len(self._entries)} cached answers")
+                self.invalidations += 1
+            self._entries.clear()
+            self._buckets.clear()
+            self.corpus_hash = corpus_hash
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
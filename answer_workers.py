@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Answer Worker Processes
+Optional deployment mode (FAQ_WORKERS=N) in which the bot process only talks to
+Telegram: FAQ answers (retrieval, prompt building, the OpenAI call, JSON parsing)
+and customer analysis formatting run in N worker processes, each with its own
+event loop and faq_engine. Workers are connected over a local socket
+(multiprocessing.connection). Callers wait when every worker is at
+WORKER_MAX_IN_FLIGHT, workers send heartbeats and are replaced when they die or
+stop responding, and their in-flight requests are retried on another worker.
+Heartbeats carry each worker's queued metric updates and answer-path counters;
+the bot replays the updates into its Prometheus metrics and adds the counters to
+its own in answer_stats(), so /metrics and /version cover the workers' answers.
+
+With FAQ_WORKERS=0 (the default) run_task() runs the same tasks in-process.
+"""
+
+import argparse
+import asyncio
+import copy
+import itertools
+import logging
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import faq_engine
+from metrics import (WORKER_IN_FLIGHT, WORKER_RECOVERED, WORKER_RESTARTS, WORKERS_ALIVE, apply_forwarded_metrics,
+                     forward_metrics, take_forwarded_metrics)
+
+# Pool settings
+FAQ_WORKERS = int(os.getenv('FAQ_WORKERS', '0'))                        # Worker processes; 0 answers in-process
+WORKER_MAX_IN_FLIGHT = int(os.getenv('WORKER_MAX_IN_FLIGHT', '8'))      # Requests per worker before callers wait
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv('WORKER_HEARTBEAT_TIMEOUT', '20'))  # Silence before a worker is replaced
+WORKER_HEARTBEAT_INTERVAL = 2.0        # Seconds between worker heartbeats (and pool health checks)
+WORKER_RESTART_DELAY = 1.0             # Minimum seconds between restarts of one worker slot
+WORKER_MAX_ATTEMPTS = 2                # Workers a request is tried on before it fails
+WORKER_AUTHKEY_ENV = 'FAQQER_WORKER_AUTHKEY'
+# Answer-path stats that are current values rather than running totals; a replaced worker's are dropped
+WORKER_STATS_GAUGES = frozenset({'size', 'max_entries', 'in_flight', 'pending'})
+WORKER_STATS_SHARED = frozenset({'entries'})   # Answer table size: workers load the bot's table
+
+
+class WorkerError(Exception):
+    """A request could not be completed by any answer worker"""
+
+
+# Tasks a worker (or the bot process, without workers) can run. Each is awaited
+# with the request's arguments and on_text (None unless the caller streams).
+
+async def _faq_task(question, on_text=None):
+    return await faq_engine.find_faq_answer(question, on_text)
+
+
+async def _analysis_task(chat_content, analysis_hours, custom_question=None, on_text=None):
+    from customer_analysis_job import analyze_chat_content
+    return await asyncio.to_thread(analyze_chat_content, chat_content, analysis_hours, custom_question)
+
+
+WORKER_TASKS = {
+    'faq': _faq_task,
+    'analysis': _analysis_task,
+}
+
+
+# Worker process side
+
+async def _serve(worker_id, conn):
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+
+    def read():
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = None
+            loop.call_soon_threadsafe(inbox.put_nowait, message)
+            if message is None:
+                return
+
+    threading.Thread(target=read, name='worker-inbox', daemon=True).start()
+
+    def send_heartbeat():
+        conn.send(('heartbeat', None, (take_forwarded_metrics(), faq_engine.engine_stats())))
+
+    async def heartbeat():
+        while True:
+            send_heartbeat()
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+    async def run_request(request_id, task, args, stream):
+        async def on_text(text):
+            conn.send(('text', request_id, text))
+
+        try:
+            result = await WORKER_TASKS[task](*args, on_text=on_text if stream else None)
+        except Exception as e:
+            logging.error(f"Task {task} failed: {type(e).__name__}: {e}")
+            send_heartbeat()
+            conn.send(('error', request_id, f"{type(e).__name__}: {e}"))
+        else:
+            # The request's metrics reach the bot before its answer does
+            send_heartbeat()
+            conn.send(('done', request_id, result))
+
+    forward_metrics()
+    running = {asyncio.ensure_future(heartbeat())}
+    # The bot process fetches remote sources, watches local files and rebuilds the answer
+    # table; workers read its on-disk caches and rebuild their snapshot when told to
+    faq_engine.answer_table.builder = False
+    await faq_engine.refresh_faq_content(cached_only=True)
+    logging.info("Answer worker ready")
+
+    while True:
+        message = await inbox.get()
+        if message is None:
+            break
+        if message[0] == 'refresh':
+            task = asyncio.ensure_future(faq_engine.refresh_faq_content(cached_only=True))
+        else:
+            _, request_id, task_name, args, stream = message
+            task = asyncio.ensure_future(run_request(request_id, task_name, args, stream))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    logging.info("Answer worker shutting down")
+
+
+def worker_main(worker_id, address):
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - worker {worker_id} - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler()])
+    authkey = bytes.fromhex(os.environ.pop(WORKER_AUTHKEY_ENV))
+    conn = Client(address, family='AF_UNIX', authkey=authkey)
+    conn.send(worker_id)
+    asyncio.run(_serve(worker_id, conn))
+
+
+# Bot process side
+
+class _Worker:
+    """One worker slot: the current process, its connection and the requests it holds"""
+
+    def __init__(self, worker_id, process):
+        self.worker_id = worker_id
+        self.process = process
+        self.conn = None            # Set once the process connects back
+        self.in_flight = {}         # request_id -> _Request
+        self.started_at = time.monotonic()
+        self.last_seen = self.started_at
+        self.replaced = False
+        self.stats = {}             # Latest answer-path counters (faq_engine.engine_stats()) it reported
+
+
+class _Request:
+    __slots__ = ('request_id', 'task', 'args', 'on_text', 'future', 'attempts', 'latest_text', 'pump')
+
+    def __init__(self, request_id, task, args, on_text, future):
+        self.request_id = request_id
+        self.task = task
+        self.args = args
+        self.on_text = on_text
+        self.future = future
+        self.attempts = 0
+        self.latest_text = None
+        self.pump = None            # Task delivering streamed text to on_text
+
+
+class AnswerWorkerPool:
+    """Runs WORKER_TASKS in worker processes with backpressure, health checks and retries"""
+
+    def __init__(self, size=FAQ_WORKERS, max_in_flight=WORKER_MAX_IN_FLIGHT):
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self._workers = {}          # worker_id -> _Worker
+        self._request_ids = itertools.count(1)
+        self._changed = None        # asyncio.Condition notified when capacity frees up
+        self._loop = None
+        self._listener = None
+        self._workdir = None
+        self._authkey = secrets.token_bytes(32)
+        self._monitor_task = None
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.recovered = 0          # Requests retried on another worker
+        self._retired_stats = {}    # Counters reported by workers that have since been replaced
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Condition()
+        # Workers run in a scratch directory so modules that create Telethon
+        # sessions on import can't touch the bot's session files
+        self._workdir = tempfile.mkdtemp(prefix='faqqer-workers-')
+        self._listener = Listener(family='AF_UNIX', authkey=self._authkey)
+        threading.Thread(target=self._accept_loop, name='worker-accept', daemon=True).start()
+        for worker_id in range(self.size):
+            self._spawn(worker_id)
+        self._monitor_task = asyncio.ensure_future(self._monitor())
+        logging.info(f"Started {self.size} answer workers (up to {self.max_in_flight} requests each)")
+
+    def _spawn(self, worker_id):
+        env = dict(os.environ, **{WORKER_AUTHKEY_ENV: self._authkey.hex()})
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--worker', str(worker_id),
+             '--address', self._listener.address],
+            cwd=self._workdir, env=env,
+        )
+        self._workers[worker_id] = _Worker(worker_id, process)
+        self._update_gauges()
+
+    def _accept_loop(self):
+        while not self._stopping:
+            try:
+                conn = self._listener.accept()
+                worker_id = conn.recv()
+            except (EOFError, OSError) as e:
+                if self._stopping:
+                    return
+                logging.warning(f"Rejected answer worker connection: {type(e).__name__}: {e}")
+                continue
+            self._loop.call_soon_threadsafe(self._attach, worker_id, conn)
+
+    def _attach(self, worker_id, conn):
+        worker = self._workers.get(worker_id)
+        if worker is None or worker.replaced or worker.conn is not None:
+            conn.close()
+            return
+        worker.conn = conn
+        worker.last_seen = time.monotonic()
+        threading.Thread(target=self._read_loop, args=(worker,), name=f'worker-{worker_id}-reader',
+                         daemon=True).start()
+        self._update_gauges()
+        self._notify()
+
+    def _read_loop(self, worker):
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                self._loop.call_soon_threadsafe(self._replace, worker, 'disconnected')
+                return
+            self._loop.call_soon_threadsafe(self._on_message, worker, message)
+
+    def _on_message(self, worker, message):
+        kind, request_id, payload = message
+        worker.last_seen = time.monotonic()
+        if kind == 'heartbeat':
+            updates, worker.stats = payload
+            apply_forwarded_metrics(updates)
+            return
+        request = worker.in_flight.get(request_id)
+        if request is None:
+            return                  # Already retried elsewhere or given up on
+        if kind == 'text':
+            self._deliver_text(request, payload)
+            return
+        del worker.in_flight[request_id]
+        if not request.future.done():
+            if kind == 'done':
+                self.completed += 1
+                request.future.set_result(payload)
+            else:
+                self.failed += 1
+                request.future.set_exception(WorkerError(payload))
+        self._update_gauges()
+        self._notify()
+
+    def _deliver_text(self, request, text):
+        # Only the newest text matters; one task per request keeps on_text calls in order
+        request.latest_text = text
+        if request.on_text is None or (request.pump is not None and not request.pump.done()):
+            return
+
+        async def pump():
+            while request.latest_text is not None:
+                text, request.latest_text = request.latest_text, None
+                try:
+                    await request.on_text(text)
+                except Exception as e:
+                    logging.error(f"Error delivering streamed text: {type(e).__name__}: {e}")
+
+        request.pump = asyncio.ensure_future(pump())
+
+    def _notify(self):
+        async def notify():
+            async with self._changed:
+                self._changed.notify_all()
+        asyncio.ensure_future(notify())
+
+    def _pick_worker(self):
+        """Least loaded connected worker with spare capacity, or None"""
+        ready = [worker for worker in self._workers.values()
+                 if worker.conn is not None and not worker.replaced and len(worker.in_flight) < self.max_in_flight]
+        return min(ready, key=lambda worker: len(worker.in_flight), default=None)
+
+    async def _dispatch(self, request):
+        async with self._changed:
+            worker = await self._changed.wait_for(self._pick_worker)
+        request.attempts += 1
+        worker.in_flight[request.request_id] = request
+        self._update_gauges()
+        try:
+            worker.conn.send(('run', request.request_id, request.task, request.args, request.on_text is not None))
+        except OSError:
+            self._replace(worker, 'disconnected')
+
+    async def run(self, task, *args, on_text=None):
+        """Run a WORKER_TASKS entry on a worker and return its result (raises WorkerError)"""
+        future = self._loop.create_future()
+        request = _Request(next(self._request_ids), task, args, on_text, future)
+        await self._dispatch(request)
+        try:
+            # Shield so a cancelled caller doesn't lose track of a request a worker still holds
+            return await asyncio.shield(future)
+        finally:
+            if request.pump is not None:
+                await request.pump
+
+    def _replace(self, worker, reason):
+        """Kill a dead or hung worker, retry its requests elsewhere and start a new process in its slot"""
+        if worker.replaced or self._stopping:
+            return
+        worker.replaced = True
+        if worker.process.poll() is None:
+            worker.process.kill()
+        if worker.conn is not None:
+            worker.conn.close()
+        self.restarts += 1
+        _add_stats(self._retired_stats, worker.stats, counters_only=True)
+        WORKER_RESTARTS.labels(reason).inc()
+        logging.error(f"Answer worker {worker.worker_id} {reason} (exit code {worker.process.poll()}), "
+                      f"recovering {len(worker.in_flight)} in-flight requests")
+
+        for request in worker.in_flight.values():
+            if request.future.done():
+                continue
+            if request.attempts >= WORKER_MAX_ATTEMPTS:
+                self.failed += 1
+                request.future.set_exception(WorkerError(f"answer worker {reason} ({request.attempts} attempts)"))
+                continue
+            self.recovered += 1
+            WORKER_RECOVERED.inc()
+            asyncio.ensure_future(self._dispatch(request))
+        worker.in_flight.clear()
+
+        delay = max(0.0, WORKER_RESTART_DELAY - (time.monotonic() - worker.started_at))
+        self._loop.call_later(delay, self._respawn, worker.worker_id)
+        self._update_gauges()
+        self._notify()
+
+    def _respawn(self, worker_id):
+        if not self._stopping:
+            self._spawn(worker_id)
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            for worker in list(self._workers.values()):
+                if worker.replaced:
+                    continue
+                if worker.process.poll() is not None:
+                    self._replace(worker, 'exited')
+                elif now - worker.last_seen > WORKER_HEARTBEAT_TIMEOUT:
+                    self._replace(worker, 'unresponsive')
+
+    def refresh(self):
+        """Ask every worker to rebuild its FAQ snapshot from the files and caches on disk"""
+        for worker in self._workers.values():
+            if worker.conn is not None and not worker.replaced:
+                try:
+                    worker.conn.send(('refresh', None, None))
+                except OSError:
+                    pass    # The reader thread notices and replaces it
+
+    async def stop(self):
+        self._stopping = True
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        for worker in self._workers.values():
+            if worker.conn is not None:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        for worker in self._workers.values():
+            try:
+                await asyncio.to_thread(worker.process.wait, 10)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+            for request in worker.in_flight.values():
+                if not request.future.done():
+                    request.future.set_exception(WorkerError("answer workers stopped"))
+        self._listener.close()
+        shutil.rmtree(self._workdir, ignore_errors=True)
+
+    def _update_gauges(self):
+        WORKERS_ALIVE.set(sum(1 for w in self._workers.values() if w.conn is not None and not w.replaced))
+        WORKER_IN_FLIGHT.set(sum(len(w.in_flight) for w in self._workers.values()))
+
+    def answer_stats(self):
+        """Answer-path counters summed over every worker this pool has run"""
+        totals = copy.deepcopy(self._retired_stats)
+        for worker in self._workers.values():
+            if not worker.replaced:
+                _add_stats(totals, worker.stats)
+        return totals
+
+    def stats(self):
+        workers = self._workers.values()
+        return {
+            'workers': self.size,
+            'alive': sum(1 for w in workers if w.conn is not None and not w.replaced),
+            'in_flight': sum(len(w.in_flight) for w in workers),
+            'completed': self.completed,
+            'failed': self.failed,
+            'restarts': self.restarts,
+            'recovered': self.recovered,
+        }
+
+
+def _add_stats(totals, stats, counters_only=False):
+    """Add the integer values of nested stats dicts into totals (ratios are recomputed, not added)"""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            _add_stats(totals.setdefault(key, {}), value, counters_only)
+        elif isinstance(value, int) and not isinstance(value, bool) and key not in WORKER_STATS_SHARED:
+            if not (counters_only and key in WORKER_STATS_GAUGES):
+                totals[key] = totals.get(key, 0) + value
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+
+# The pool used by run_task(), started by the bot when FAQ_WORKERS > 0
+worker_pool = None
+
+
+async def start_answer_workers(size=FAQ_WORKERS):
+    global worker_pool
+    if size > 0 and worker_pool is None:
+        worker_pool = AnswerWorkerPool(size)
+        await worker_pool.start()
+    return worker_pool
+
+
+async def stop_answer_workers():
+    global worker_pool
+    if worker_pool is not None:
+        await worker_pool.stop()
+        worker_pool = None
+
+
+async def run_task(task, *args, on_text=None):
+    """Run a task on the answer workers, or in this process when there are none"""
+    if worker_pool is not None:
+        return await worker_pool.run(task, *args, on_text=on_text)
+    return await WORKER_TASKS[task](*args, on_text=on_text)
+
+
+def refresh_answer_workers():
+    if worker_pool is not None:
+        worker_pool.refresh()
+
+
+# Whenever the bot's snapshot changes (startup, hourly refresh, file watcher, /refresh_faq),
+# workers follow; in worker processes there is no pool and this does nothing
+faq_engine.faq_corpus.add_listener(lambda snapshot: refresh_answer_workers())
+
+
+def worker_stats():
+    return worker_pool.stats() if worker_pool is not None else None
+
+
+def answer_stats():
+    """faq_engine.engine_stats() for this process plus every answer worker's"""
+    stats = faq_engine.engine_stats()
+    if worker_pool is None:
+        return stats
+    _add_stats(stats, worker_pool.answer_stats())
+    cache = stats['answer_cache']
+    cache['hit_rate'] = _ratio(cache['hits'], cache['hits'] + cache['misses'])
+    for usage in stats['llm_usage'].values():
+        usage['cached_ratio'] = _ratio(usage['cached_tokens'], usage['prompt_tokens'])
+    connections = stats['llm_connections']
+    connections['reuse_ratio'] = _ratio(connections['reused_connections'], connections['requests'])
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer worker process (started by the bot with FAQ_WORKERS=N)")
+    parser.add_argument('--worker', type=int, required=True)
+    parser.add_argument('--address', required=True)
+    args = parser.parse_args()
+    worker_main(args.worker, args.address)
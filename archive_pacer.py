@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Archive Fetch Pacer
+One request budget shared by every channel faq_archiver fetches concurrently.
+Requests are spaced by an interval that shrinks while Telegram keeps answering
+and grows when it answers with FloodWaitError; the server-provided wait is
+honoured by every channel, not just the one that hit it. Requests, messages,
+time spent and flood waits are tracked per channel for throughput reporting.
+While a paced request runs, in_paced_call is set, so the client can raise flood
+waits to the pacer instead of sleeping through them.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+from telethon.errors import FloodWaitError
+
+# Pacing settings
+ARCHIVE_FETCH_CONCURRENCY = int(os.getenv('ARCHIVE_FETCH_CONCURRENCY', '4'))   # Channels fetched at once
+PACER_INITIAL_INTERVAL = 1.0           # Seconds between requests to start with
+PACER_MIN_INTERVAL = 0.1               # Fastest pace reached after a run of successes
+PACER_MAX_INTERVAL = 30.0              # Slowest pace after repeated flood waits
+PACER_SPEEDUP = 0.8                    # Interval multiplier after a successful request
+PACER_BACKOFF = 2.0                    # Interval multiplier after a flood wait
+PACER_MAX_FLOOD_RETRIES = 5            # Flood waits tolerated for one request before giving up
+
+# True inside AdaptivePacer.call (per task), while the paced request is awaited
+in_paced_call = contextvars.ContextVar('in_paced_call', default=False)
+
+
+class AdaptivePacer:
+    """Spaces Telegram requests from all channels and adapts the pace to FloodWaitError"""
+
+    def __init__(self, interval=PACER_INITIAL_INTERVAL, min_interval=PACER_MIN_INTERVAL,
+                 max_interval=PACER_MAX_INTERVAL):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._next_slot = 0.0           # Monotonic time the next request may be sent
+        self._lock = asyncio.Lock()
+        self.channels = {}              # channel -> fetch counters
+
+    def _channel(self, channel):
+        return self.channels.setdefault(channel, {'requests': 0, 'messages': 0, 'flood_waits': 0,
+                                                  'flood_wait_seconds': 0, 'seconds': 0.0})
+
+    async def _wait_turn(self):
+        # The lock hands out slots in order, so concurrent channels cannot burst past the interval
+        async with self._lock:
+            # A flood wait can push the slot back while we sleep
+            while (delay := self._next_slot - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            self._next_slot = time.monotonic() + self.interval
+
+    def _succeeded(self):
+        self.interval = max(self.min_interval, self.interval * PACER_SPEEDUP)
+
+    def _flood_waited(self, seconds):
+        self.interval = min(self.max_interval, max(self.interval * PACER_BACKOFF, PACER_INITIAL_INTERVAL))
+        # Nobody sends until the server says so
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+    async def call(self, channel, request, *args, **kwargs):
+        """Await request(*args, **kwargs) in turn, retrying after flood waits"""
+        counters = self._channel(channel)
+        for attempt in range(PACER_MAX_FLOOD_RETRIES + 1):
+            await self._wait_turn()
+            started = time.monotonic()
+            paced = in_paced_call.set(True)
+            try:
+                result = await request(*args, **kwargs)
+            except FloodWaitError as e:
+                counters['flood_waits'] += 1
+                counters['flood_wait_seconds'] += e.seconds
+                self._flood_waited(e.seconds)
+                logging.warning(f"Flood wait of {e.seconds}s fetching {channel}; "
+                                f"request interval now {self.interval:.2f}s")
+                if attempt == PACER_MAX_FLOOD_RETRIES:
+                    raise
+                continue
+            finally:
+                in_paced_call.reset(paced)
+                counters['seconds'] += time.monotonic() - started
+            counters['requests'] += 1
+            self._succeeded()
+            return result
+
+    def count_messages(self, channel, count):
+        self._channel(channel)['messages'] += count
+
+    def stats(self):
+        return {
+            'interval': round(self.interval, 3),
+            'channels': {channel: dict(counters, seconds=round(counters['seconds'], 2))
+                         for channel, counters in self.channels.items()},
+        }
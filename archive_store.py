@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Archive Checkpoint Store
+Keeps the messages faq_archiver has already fetched, one JSONL file per channel,
+with a checkpoint per channel: the newest archived message id and the span over
+which the stored history is contiguous. Runs then fetch only messages newer than
+the checkpoint (Telethon min_id) and backfill only when asked for a window that
+reaches further back than that span. Records are read and rewritten as
+streams, so a channel's history is never held in memory. Sender usernames are kept in an LRU
+cache persisted next to the checkpoints, so a sender is looked up once, not
+once per message; senders Telegram could not resolve are remembered too and
+only retried after SENDER_RETRY_HOURS. A reply index (SQLite, so lookups never load it whole) maps
+(channel, message id) to a short snippet, giving replies their context even
+when the parent message is older than the window. Runs into one output directory
+take turns (store_lock), and every file is written to a unique temporary file and
+swapped in, so readers never see a partial file.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Retention settings
+ARCHIVE_RETENTION_HOURS = int(os.getenv('ARCHIVE_RETENTION_HOURS', '168'))   # History kept per channel
+SENDER_CACHE_SIZE = int(os.getenv('ARCHIVE_SENDER_CACHE_SIZE', '20000'))     # Senders remembered across runs
+SENDER_RETRY_HOURS = int(os.getenv('ARCHIVE_SENDER_RETRY_HOURS', '24'))      # Before an unresolvable sender is retried
+REPLY_INDEX_RETENTION_HOURS = int(os.getenv('REPLY_INDEX_RETENTION_HOURS', '2160'))  # Snippets kept (90 days)
+REPLY_SNIPPET_CHARS = 200              # Characters of a parent message quoted in a reply
+REPLY_LOOKUP_CHUNK = 500               # Ids per IN (...) query, under SQLite's variable limit
+STORE_DIRNAME = 'channel_store'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'       # UTC; sorts chronologically as a string
+
+
+def format_date(date):
+    """A message date (aware or naive UTC datetime) as stored in records"""
+    return date.strftime(DATE_FORMAT)
+
+
+def cutoff_date(hours_history, now=None):
+    now = now or datetime.utcnow()
+    return format_date(now - timedelta(hours=hours_history))
+
+
+def _safe_name(channel):
+    return re.sub(r'[^\w.-]', '_', str(channel))
+
+
+_store_locks = {}
+
+
+def store_lock(output_dir):
+    """The asyncio.Lock that archive runs into output_dir hold, so they never write its store at once"""
+    return _store_locks.setdefault(os.path.realpath(output_dir), asyncio.Lock())
+
+
+def _open_temp(path):
+    """A uniquely named temporary file next to path, opened for writing, and its name"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    return open(fd, 'w', encoding='utf-8'), tmp_path
+
+
+@contextmanager
+def replace_atomically(path):
+    """Write path through a temporary file that replaces it only once fully written"""
+    f, tmp_path = _open_temp(path)
+    try:
+        with f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class SenderCache:
+    """
+    LRU cache of sender id -> {'username'}, persisted as JSON (least recently used first).
+    Ids that could not be resolved are kept apart with the date they may be retried,
+    so they are neither looked up again every run nor counted as cached senders.
+    """
+
+    def __init__(self, path, max_size=SENDER_CACHE_SIZE, retry_hours=SENDER_RETRY_HOURS):
+        self.path = path
+        self.max_size = max_size
+        self.retry_hours = retry_hours
+        self._entries = OrderedDict()
+        self._failed = OrderedDict()    # Sender id -> date (DATE_FORMAT) after which to retry it
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0                # Entities requested from Telegram
+        self.skipped = 0                # Lookups not made because the sender failed recently
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for sender_id, entry in json.load(f):
+                    if 'retry_after' in entry:
+                        self._failed[sender_id] = entry['retry_after']
+                    else:
+                        self._entries[sender_id] = entry
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable sender cache {path}: {e}")
+            self._entries.clear()
+            self._failed.clear()
+
+    def __contains__(self, sender_id):
+        return sender_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, sender_id):
+        entry = self._entries.get(sender_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(sender_id)
+        return entry
+
+    def put(self, sender_id, username):
+        self._failed.pop(sender_id, None)
+        self._entries[sender_id] = {'username': username}
+        self._entries.move_to_end(sender_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def failed_recently(self, sender_id):
+        """Whether sender_id could not be resolved less than retry_hours ago"""
+        retry_after = self._failed.get(sender_id)
+        if retry_after is None:
+            return False
+        if retry_after <= format_date(datetime.utcnow()):
+            del self._failed[sender_id]
+            return False
+        self.skipped += 1
+        return True
+
+    def put_failed(self, sender_id):
+        """Remember that sender_id could not be resolved, so it is not looked up again for a while"""
+        self._failed[sender_id] = format_date(datetime.utcnow() + timedelta(hours=self.retry_hours))
+        self._failed.move_to_end(sender_id)
+        while len(self._failed) > self.max_size:
+            self._failed.popitem(last=False)
+
+    def save(self):
+        now = format_date(datetime.utcnow())
+        failed = [(sender_id, {'retry_after': retry_after}) for sender_id, retry_after in self._failed.items()
+                  if retry_after > now]
+        with replace_atomically(self.path) as f:
+            json.dump(list(self._entries.items()) + failed, f, ensure_ascii=False)
+
+    def stats(self):
+        return {'size': len(self._entries), 'failed': len(self._failed), 'hits': self.hits, 'misses': self.misses,
+                'lookups': self.lookups, 'skipped': self.skipped}
+
+
+def reply_snippet(text):
+    """How a message is quoted by replies to it"""
+    text = (text or "").strip() or "Media message"
+    return text if len(text) <= REPLY_SNIPPET_CHARS else text[:REPLY_SNIPPET_CHARS].rstrip() + "..."
+
+
+class ReplyIndex:
+    """
+    (channel, message id) -> snippet of the message, kept in SQLite and updated every run.
+    A None snippet records a parent Telegram could not return (deleted), so it is not refetched.
+    """
+
+    def __init__(self, path, retention_hours=REPLY_INDEX_RETENTION_HOURS):
+        self.path = path
+        self.retention_hours = retention_hours
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.parents_fetched = 0
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS replies ("
+                "channel TEXT NOT NULL, id INTEGER NOT NULL, date TEXT NOT NULL, snippet TEXT, "
+                "PRIMARY KEY (channel, id)) WITHOUT ROWID"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS replies_date ON replies (date)")
+        return self._db
+
+    def add(self, channel, entries):
+        """entries: iterable of (message id, date, snippet or None)"""
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO replies VALUES (?, ?, ?, ?)",
+                                [(str(channel), message_id, date, snippet) for message_id, date, snippet in entries])
+
+    def missing(self, channel, message_ids):
+        """The ids among message_ids the index has no entry for"""
+        missing = set(message_ids)
+        ids = sorted(missing)
+        for start in range(0, len(ids), REPLY_LOOKUP_CHUNK):
+            chunk = ids[start:start + REPLY_LOOKUP_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.db.execute(f"SELECT id FROM replies WHERE channel = ? AND id IN ({placeholders})",
+                                   (str(channel), *chunk))
+            missing.difference_update(row[0] for row in rows)
+        return missing
+
+    def get(self, channel, message_id):
+        """Snippet of a message, or None if it is not indexed (or no longer exists)"""
+        row = self.db.execute("SELECT snippet FROM replies WHERE channel = ? AND id = ?",
+                              (str(channel), message_id)).fetchone()
+        if row is None or row[0] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def prune(self):
+        with self.db:
+            self.db.execute("DELETE FROM replies WHERE date < ?", (cutoff_date(self.retention_hours),))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        size = self.db.execute("SELECT COUNT(*) FROM replies").fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'misses': self.misses, 'parents_fetched': self.parents_fetched}
+
+
+class ChannelWriter:
+    """
+    Writes one channel's records (oldest first) to a temporary file. commit() swaps it
+    in and moves the checkpoint; until then the stored records can still be read.
+    """
+
+    def __init__(self, store, channel, keep_since):
+        self.store = store
+        self.channel = channel
+        self.keep_since = keep_since
+        self.count = 0
+        self.last_id = 0
+        self.path = store._records_file(channel)
+        self._file, self._tmp_path = _open_temp(self.path)
+
+    def write(self, record):
+        if record['date'] < self.keep_since:
+            return
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.count += 1
+        self.last_id = max(self.last_id, record['id'])
+
+    def commit(self, complete_since, fetched_until):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        previous = self.store.checkpoint(self.channel) or {}
+        self.store.checkpoints[str(self.channel)] = {
+            'last_id': max(self.last_id, previous.get('last_id', 0)),
+            'complete_since': max(complete_since, self.keep_since),
+            'fetched_until': fetched_until,
+            'updated_at': time.time(),
+        }
+        self.store._save_checkpoints()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ChannelStore:
+    """Archived message records and checkpoints for the channels archived into one output directory"""
+
+    def __init__(self, output_dir, retention_hours=ARCHIVE_RETENTION_HOURS):
+        self.directory = os.path.join(output_dir, STORE_DIRNAME)
+        self.retention_hours = retention_hours
+        self.checkpoints_file = os.path.join(self.directory, 'checkpoints.json')
+        self._checkpoints = None
+        self.senders = SenderCache(os.path.join(self.directory, 'senders.json'))
+        self.replies = ReplyIndex(os.path.join(self.directory, 'replies.sqlite3'))
+
+    def _records_file(self, channel):
+        return os.path.join(self.directory, f"{_safe_name(channel)}.jsonl")
+
+    @property
+    def checkpoints(self):
+        if self._checkpoints is None:
+            try:
+                with open(self.checkpoints_file, 'r', encoding='utf-8') as f:
+                    self._checkpoints = json.load(f)
+            except FileNotFoundError:
+                self._checkpoints = {}
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable archive checkpoints {self.checkpoints_file}: {e}")
+                self._checkpoints = {}
+        return self._checkpoints
+
+    def checkpoint(self, channel):
+        """
+        {'last_id', 'complete_since', 'fetched_until', 'updated_at'} for a channel, or None if it was
+        never archived. Stored records are contiguous from complete_since to fetched_until.
+        """
+        return self.checkpoints.get(str(channel))
+
+    def records(self, channel):
+        """Stored records for a channel, oldest first, read one at a time"""
+        try:
+            with open(self._records_file(channel), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Stopped reading unreadable archive store for {channel}: {e}")
+
+    def oldest_id(self, channel, since=''):
+        """Id of the oldest stored record for a channel dated since (a stored date), or None"""
+        for record in self.records(channel):
+            if record['date'] >= since:
+                return record['id']
+        return None
+
+    def writer(self, channel, hours_history=0):
+        """
+        A ChannelWriter replacing a channel's records. Records older than the retention
+        period (or the requested window, if longer) are dropped as they are written.
+        """
+        keep_since = cutoff_date(max(self.retention_hours, hours_history))
+        return ChannelWriter(self, channel, keep_since)
+
+    def reset(self, channel):
+        """Forget a channel's records and checkpoint (the next run refetches its whole window)"""
+        self.checkpoints.pop(str(channel), None)
+        try:
+            os.remove(self._records_file(channel))
+        except FileNotFoundError:
+            pass
+        self._save_checkpoints()
+
+    def _save_checkpoints(self):
+        with replace_atomically(self.checkpoints_file) as f:
+            json.dump(self.checkpoints, f, indent=2)
@@ -5,6 +5,9 @@ from telethon.tl.types import PeerChat, PeerChannel
 from apscheduler.triggers.cron import CronTrigger
 import requests
 import random
+import time
+
+from metrics import HASH_POWER_LATENCY, HASH_POWER_RUNS, watch_scheduler
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
@@ -111,7 +114,8 @@ def schedule_block_height_job(client, loop):
 
     # Add the job to post block height every 4 hours
     scheduler.add_job(lambda: loop.create_task(post_block_height(client)),
-                      CronTrigger.from_crontab('0 */4 * * *'))
+                      CronTrigger.from_crontab('0 */4 * * *'), id='block_height')
+    watch_scheduler(scheduler)
 
     # Start the scheduler
     scheduler.start()
@@ -119,6 +123,8 @@ def schedule_block_height_job(client, loop):
     logging.info("Scheduler started for block height job")
 
 async def post_hash_power(client):
+    started = time.monotonic()
+    outcome = 'ok'
     try:
         # Fetch block height and hash rates
         block_height, current_sha_hash_rate, current_rxm_hash_rate, current_rxt_hash_rate, current_cuckaroo_hash_rate = get_latest_info()
@@ -153,9 +159,14 @@ async def post_hash_power(client):
                 await client.send_message(peer, hash_power_stats)
                 logging.info(f"Posted hash power stats to group ID {group_id}")
             except Exception as e:
+                outcome = 'partial'
                 logging.error(f"Error posting hash power stats to group ID {group_id}: {e}")
     except Exception as e:
+        outcome = 'error'
         logging.error(f"Error fetching hash power stats: {e}")
+    finally:
+        HASH_POWER_RUNS.labels(outcome).inc()
+        HASH_POWER_LATENCY.observe(time.monotonic() - started)
 
 def schedule_hash_power_job(client, loop):
     # Initialize the scheduler
@@ -163,7 +174,8 @@ def schedule_hash_power_job(client, loop):
 
     # Add the job to post hash power every 3 hours
     scheduler.add_job(lambda: loop.create_task(post_hash_power(client)),
-                      CronTrigger.from_crontab('0 */3 * * *'))
+                      CronTrigger.from_crontab('0 */3 * * *'), id='hash_power')
+    watch_scheduler(scheduler)
 
     # Start the scheduler
     scheduler.start()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Shared pytest fixtures: a local fake LLM server, an offline FAQ snapshot and
+imports of the modules that create a Telethon client on import
+"""
+
+import asyncio
+import importlib
+import os
+
+import pytest
+
+import llm_client
+from fake_llm_server import start_fake_llm_server
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """A fake OpenAI-compatible server used by this process and by answer workers it starts"""
+    server = start_fake_llm_server(latency='fixed:10', tokens_per_second=10000, answer_words=5)
+    # Worker processes read the backend from the environment
+    monkeypatch.setenv('LLM_BACKEND', 'fake')
+    monkeypatch.setenv('FAKE_LLM_URL', server.base_url)
+    monkeypatch.setenv('FAQ_ANSWER_TABLE', '0')
+    previous = llm_client.get_backend()
+    llm_client.set_backend(llm_client.LlmBackend('fake', server.base_url, 'test', None))
+    yield server
+    llm_client.set_backend(previous)
+    server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def local_snapshot():
+    """A FaqSnapshot of the repo's local FAQ files (no network)"""
+    from faq_snapshot import FaqCorpus
+    return asyncio.run(FaqCorpus().refresh(fetch_remote=False))
+
+
+@pytest.fixture
+def telethon_import(tmp_path, monkeypatch):
+    """
+    Import a module that creates a Telethon client at import time (faq_archiver and its
+    importers). Runs in tmp_path, where the client's session file lands, with the
+    current event loop the client needs.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TELEGRAM_API_ID', os.getenv('TELEGRAM_API_ID', '1'))
+    monkeypatch.setenv('TELEGRAM_API_HASH', os.getenv('TELEGRAM_API_HASH', 'test'))
+
+    def load(name):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return importlib.import_module(name)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+    return load
@@ -10,9 +10,14 @@ from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import json
-from openai import OpenAI, OpenAIError
+from openai import OpenAIError
 import traceback
 
+from llm_client import get_openai_client, llm_model, record_usage
+from metrics import track_openai, watch_scheduler
+from answer_workers import run_task
+from token_budget import count_tokens, take_within_budget
+
 # Import the archiver functionality
 from faq_archiver import archive_channels, client as archiver_client
 
@@ -27,7 +32,6 @@ ANALYSIS_TIMEOUT = 120
 MAX_MESSAGE_LENGTH = 4000
 MAX_EXAMPLE_LENGTH = 200  # Increased from 80 to 200 for longer quotes
 MAX_TOKENS_PER_REQUEST = 25000  # Leave room for response tokens (30k limit - 5k buffer)
-CHARS_PER_TOKEN_ESTIMATE = 4    # Rough estimate: 1 token ≈ 4 characters
 
 # Customer service analysis prompt
 ANALYSIS_PROMPT = """
@@ -104,40 +108,35 @@ Respond in JSON format with this exact structure:
 def truncate_chat_content(chat_content, max_tokens=MAX_TOKENS_PER_REQUEST):
     """
     Truncate chat content to fit within token limits while preserving recent messages.
-    Uses character count as proxy for token count (rough estimate: 1 token ≈ 4 chars)
+    Tokens are counted with the model's tokenizer (see token_budget.py), so non-English
+    chat is budgeted correctly.
     """
-    max_chars = max_tokens * CHARS_PER_TOKEN_ESTIMATE
-    
-    if len(chat_content) <= max_chars:
+    total_tokens = count_tokens(chat_content)
+    if total_tokens <= max_tokens:
         return chat_content
     
-    logging.warning(f"Chat content too large ({len(chat_content)} chars, ~{len(chat_content)//CHARS_PER_TOKEN_ESTIMATE} tokens). Truncating to recent messages...")
+    logging.warning(f"Chat content too large ({len(chat_content)} chars, {total_tokens} tokens). Truncating to recent messages...")
     
     # Split into lines (messages)
     lines = chat_content.split('\n')
     
-    # Keep the most recent messages that fit within the limit
-    truncated_lines = []
-    current_length = 0
-    
-    # Add lines from the end (most recent) until we hit the limit
-    for line in reversed(lines):
-        line_length = len(line) + 1  # +1 for newline
-        if current_length + line_length > max_chars:
-            break
-        truncated_lines.append(line)
-        current_length += line_length
+    # Reserve room for the truncation header (its counts only vary by a few digits)
+    header_template = "[TRUNCATED: Showing most recent {kept} messages out of {total} total messages]\n\n"
+    header_budget = count_tokens(header_template.format(kept=len(lines), total=len(lines)))
     
-    # Reverse back to chronological order
-    truncated_lines.reverse()
+    # Keep the most recent lines that fit (one extra token per line for the newline)
+    kept_reversed, _ = take_within_budget(reversed(lines), max_tokens - header_budget, separator_tokens=1)
+    truncated_lines = kept_reversed[::-1]
     
-    truncated_content = '\n'.join(truncated_lines)
+    # Per-line counts can differ slightly from the joined text; trim until the real count fits
+    header = header_template.format(kept=len(truncated_lines), total=len(lines))
+    final_content = header + '\n'.join(truncated_lines)
+    while truncated_lines and count_tokens(final_content) > max_tokens:
+        truncated_lines = truncated_lines[1:]
+        header = header_template.format(kept=len(truncated_lines), total=len(lines))
+        final_content = header + '\n'.join(truncated_lines)
     
-    # Add header explaining truncation
-    header = f"[TRUNCATED: Showing most recent {len(truncated_lines)} messages out of {len(lines)} total messages]\n\n"
-    final_content = header + truncated_content
-    
-    logging.info(f"Truncated content: {len(lines)} -> {len(truncated_lines)} messages, {len(chat_content)} -> {len(final_content)} chars")
+    logging.info(f"Truncated content: {len(lines)} -> {len(truncated_lines)} messages, {total_tokens} -> {count_tokens(final_content)} tokens")
     
     return final_content
 
@@ -149,10 +148,7 @@ def query_openai_analysis(chat_content, custom_question=None):
         custom_question: Optional custom question that becomes the dominant analysis prompt
     """
     try:
-        # Truncate content if it's too large
-        truncated_content = truncate_chat_content(chat_content)
-        
-        client = OpenAI()
+        client = get_openai_client()
         
         # Use custom question if provided, otherwise use default analysis prompt
         if custom_question:
@@ -209,25 +205,31 @@ If no issues related to "{custom_question}" are found, respond with:
   "categories": []
 }}
 """
-            full_prompt = analysis_prompt + "\n\n" + truncated_content
             logging.info(f"Using custom analysis question (exclusive focus): {custom_question}")
         else:
-            full_prompt = ANALYSIS_PROMPT + "\n\n" + truncated_content
+            analysis_prompt = ANALYSIS_PROMPT
         
-        # Estimate total tokens for logging
-        estimated_tokens = len(full_prompt) // CHARS_PER_TOKEN_ESTIMATE
-        logging.info(f"Sending analysis request: ~{estimated_tokens} tokens ({len(full_prompt)} chars)")
+        # Truncate content so instructions + messages fill the token budget exactly
+        chat_budget = MAX_TOKENS_PER_REQUEST - count_tokens(analysis_prompt + "\n\n")
+        truncated_content = truncate_chat_content(chat_content, chat_budget)
+        full_prompt = analysis_prompt + "\n\n" + truncated_content
         
-        response = client.chat.completions.create(
-            model=ANALYSIS_MODEL,
-            temperature=ANALYSIS_TEMPERATURE,
-            response_format={"type": "json_object"},  # Force JSON response
-            messages=[
-                {"role": "user", "content": full_prompt}
-            ],
-            timeout=ANALYSIS_TIMEOUT,
-        )
+        # Count total tokens for logging
+        prompt_tokens = count_tokens(full_prompt)
+        logging.info(f"Sending analysis request: {prompt_tokens} tokens ({len(full_prompt)} chars)")
+        
+        with track_openai("analysis"):
+            response = client.chat.completions.create(
+                model=llm_model(ANALYSIS_MODEL),
+                temperature=ANALYSIS_TEMPERATURE,
+                response_format={"type": "json_object"},  # Force JSON response
+                messages=[
+                    {"role": "user", "content": full_prompt}
+                ],
+                timeout=ANALYSIS_TIMEOUT,
+            )
         
+        record_usage("analysis", response.usage)
         result = response.choices[0].message.content
         logging.info(f"OpenAI analysis response received: {len(result)} characters")
         
@@ -245,6 +247,13 @@ If no issues related to "{custom_question}" are found, respond with:
         logging.error(f"OpenAI analysis error: {error_info}")
         return None
 
+def analyze_chat_content(chat_content, analysis_hours, custom_question=None):
+    """Analyze chat content with OpenAI and format the result for Telegram (None if the analysis failed)"""
+    analysis_result = query_openai_analysis(chat_content, custom_question)
+    if not analysis_result:
+        return None
+    return format_telegram_table(analysis_result, analysis_hours, custom_question)
+
 async def send_message_to_group(telegram_client, message, target_group_id=None):
     """Send message to specified group or the configured default group"""
     # Use provided target_group_id or fall back to configured default
@@ -428,9 +437,9 @@ Bot accounts cannot access historical messages from channels.
             logging.error("Analysis archive file not found")
             return
         
-        # Analyze with OpenAI
-        analysis_result = query_openai_analysis(chat_content, custom_question)
-        if not analysis_result:
+        # Analyze with OpenAI and format the results, off the event loop (in an answer worker with FAQ_WORKERS)
+        formatted_message = await run_task('analysis', chat_content, analysis_hours, custom_question)
+        if not formatted_message:
             logging.error("Failed to get analysis from OpenAI")
             error_msg = f"""
 🔍 **Customer Service Analysis - {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}**
@@ -440,9 +449,6 @@ Bot accounts cannot access historical messages from channels.
             await send_message_to_group(telegram_client, error_msg, target_group_id)
             return
         
-        # Format and send the results
-        formatted_message = format_telegram_table(analysis_result, analysis_hours, custom_question)
-        
         # Split message if it's too long (Telegram limit ~4096 characters)
         if len(formatted_message) > MAX_MESSAGE_LENGTH:
             # Send in parts
@@ -481,8 +487,10 @@ def schedule_customer_analysis_job(telegram_client, loop):
     # Run every 3 hours (0 minutes, every 3rd hour)
     scheduler.add_job(
         lambda: loop.create_task(run_customer_service_analysis(telegram_client)),
-        CronTrigger.from_crontab("0 */3 * * *")  # Every 3 hours at minute 0
+        CronTrigger.from_crontab("0 */3 * * *"),  # Every 3 hours at minute 0
+        id='customer_analysis',
     )
+    watch_scheduler(scheduler)
     
     scheduler.start()
     logging.info("Customer service analysis scheduler started (every 3 hours)")
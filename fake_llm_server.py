@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Fake LLM Server
+A local stand-in for the OpenAI chat-completions API, so the bot can be load-tested
+and benchmarked without network access or API cost. It supports:
+- latency distributions for time-to-first-token plus a per-token generation rate
+- injected 500 errors and 429 rate limits (with retry-after, which the SDK honours)
+- JSON mode: FAQ answers, batched answers and customer analysis in the shapes the bot expects
+- streaming (SSE chunks with a final usage chunk)
+- usage with simulated prompt caching of repeated system prompts
+
+Run it and point the bot at it:
+    python fake_llm_server.py --port 8089 --latency lognormal:800,0.5 --rate-limit-rate 0.05
+    LLM_BACKEND=fake FAKE_LLM_URL=http://127.0.0.1:8089/v1 python faqqer_bot.py
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from token_budget import count_tokens
+
+# Defaults (override through the environment or the command line)
+FAKE_LLM_HOST = os.getenv('FAKE_LLM_HOST', '127.0.0.1')
+FAKE_LLM_PORT = int(os.getenv('FAKE_LLM_PORT', '8089'))
+FAKE_LLM_LATENCY = os.getenv('FAKE_LLM_LATENCY', 'lognormal:600,0.4')    # Time to first token
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '60'))
+FAKE_LLM_ERROR_RATE = float(os.getenv('FAKE_LLM_ERROR_RATE', '0'))         # Share of requests failing with 500
+FAKE_LLM_RATE_LIMIT_RATE = float(os.getenv('FAKE_LLM_RATE_LIMIT_RATE', '0'))  # Share of requests rejected with 429
+FAKE_LLM_RETRY_AFTER = float(os.getenv('FAKE_LLM_RETRY_AFTER', '1'))      # Seconds suggested in 429 responses
+FAKE_LLM_ANSWER_WORDS = int(os.getenv('FAKE_LLM_ANSWER_WORDS', '60'))     # Length of generated answers
+PROMPT_CACHE_MIN_TOKENS = 1024         # Like OpenAI: prompts shorter than this are never cached
+PROMPT_CACHE_INCREMENT = 128           # Cached prefixes are counted in 128-token steps
+PROMPT_CACHE_ENTRIES = 256
+
+FILLER_WORDS = ("Tari Universe mining wallet bridge node sync pool block reward hash rate setup "
+                "update release support network peers balance transaction confirm install").split()
+
+BATCH_QUESTIONS_PATTERN = re.compile(r'Questions: (\[.*\])', re.DOTALL)
+QUESTION_PATTERN = re.compile(r'Question: (.*)', re.DOTALL)
+
+
+def parse_latency(spec):
+    """
+    Build a sampler (returns seconds) from a latency spec in milliseconds:
+    fixed:MS, uniform:LOW,HIGH, normal:MEAN,STDDEV or lognormal:MEDIAN,SIGMA
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0] / 1000
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == 'normal' and len(values) == 2:
+        return lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+    if kind == 'lognormal' and len(values) == 2:
+        # Median in ms, sigma is the spread of the underlying normal (unitless)
+        return lambda: values[0] * random.lognormvariate(0, values[1]) / 1000
+    raise ValueError(f"Invalid latency spec '{spec}' (use fixed:MS, uniform:LO,HI, normal:MEAN,SD or lognormal:MEDIAN,SIGMA)")
+
+
+class FakeLlmConfig:
+    """Behaviour of the fake server; attributes can be changed while it is running"""
+
+    def __init__(self, latency=FAKE_LLM_LATENCY, tokens_per_second=FAKE_LLM_TOKENS_PER_SECOND,
+                 error_rate=FAKE_LLM_ERROR_RATE, rate_limit_rate=FAKE_LLM_RATE_LIMIT_RATE,
+                 retry_after=FAKE_LLM_RETRY_AFTER, answer_words=FAKE_LLM_ANSWER_WORDS, seed=None):
+        self.latency = latency
+        self.sample_latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.answer_words = answer_words
+        if seed is not None:
+            random.seed(seed)
+
+
+class FakeLlmState:
+    """Counters and the simulated prompt cache, shared by all request threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.prompt_cache = OrderedDict()    # system prompt hash -> None (LRU)
+
+    def cached_tokens(self, messages):
+        system = next((m.get('content') or '' for m in messages if m.get('role') == 'system'), '')
+        tokens = count_tokens(system)
+        if tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        key = hash(system)
+        with self.lock:
+            hit = key in self.prompt_cache
+            self.prompt_cache[key] = None
+            self.prompt_cache.move_to_end(key)
+            while len(self.prompt_cache) > PROMPT_CACHE_ENTRIES:
+                self.prompt_cache.popitem(last=False)
+        return tokens // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT if hit else 0
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+
+def _filler(question, words):
+    rng = random.Random(question)
+    return " ".join(rng.choice(FILLER_WORDS) for _ in range(words))
+
+
+def fake_content(messages, json_mode, answer_words):
+    """Response text in the shape the calling code expects"""
+    prompt = "\n".join(m.get('content') or '' for m in messages)
+    user = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+
+    batch = BATCH_QUESTIONS_PATTERN.search(user)
+    if "'answers'" in prompt and batch:
+        try:
+            questions = json.loads(batch.group(1))
+        except ValueError:
+            questions = []
+        return json.dumps({'answers': [
+            {'id': q.get('id'), 'answer': f"Fake answer to '{q.get('question')}': {_filler(str(q), answer_words)}"}
+            for q in questions if isinstance(q, dict)
+        ]})
+    if '"categories"' in prompt:
+        return json.dumps({
+            'analysis_summary': "Fake analysis: no real messages were analysed.",
+            'total_issues_found': 0,
+            'categories': [],
+        })
+
+    match = QUESTION_PATTERN.search(user)
+    question = (match.group(1) if match else user).strip()[:200]
+    answer = f"Fake answer to '{question}': {_filler(question, answer_words)}"
+    return json.dumps({'answer': answer}) if json_mode else answer
+
+
+def _split_stream(content):
+    # Roughly one chunk per word, like token deltas
+    return re.findall(r'\S+\s*|\s+', content)
+
+
+class FakeLlmHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # Keep-alive, so connection pooling can be measured too
+    server_version = 'FakeLLM/1.0'
+
+    def log_message(self, format, *args):
+        logging.debug(f"Fake LLM: {format % args}")
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, message, error_type, code=None, headers=None):
+        self._send_json(status, {'error': {'message': message, 'type': error_type, 'param': None, 'code': code}},
+                        headers)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            with self.server.state.lock:
+                self._send_json(200, dict(self.server.state.counts))
+        elif self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'fake-model', 'object': 'model'}]})
+        else:
+            self._send_error(404, f"Unknown path {self.path}", 'invalid_request_error')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_error(404, f"Unknown path {self.path}", 'invalid_request_error')
+            return
+        try:
+            request = json.loads(raw)
+            messages = request['messages']
+        except (ValueError, KeyError, TypeError):
+            self._send_error(400, "Request body must be JSON with 'messages'", 'invalid_request_error')
+            return
+
+        config = self.server.config
+        state = self.server.state
+        state.count('requests')
+
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            state.count('rate_limited')
+            self._send_error(429, "Rate limit reached (injected by fake server)", 'requests', 'rate_limit_exceeded',
+                             headers={'retry-after': f"{config.retry_after:g}",
+                                      'retry-after-ms': str(int(config.retry_after * 1000))})
+            return
+        if roll < config.rate_limit_rate + config.error_rate:
+            state.count('errors')
+            time.sleep(config.sample_latency())
+            self._send_error(500, "Internal server error (injected by fake server)", 'server_error')
+            return
+
+        json_mode = (request.get('response_format') or {}).get('type') == 'json_object'
+        content = fake_content(messages, json_mode, config.answer_words)
+        prompt_tokens = sum(count_tokens(m.get('content') or '') + 4 for m in messages)
+        completion_tokens = count_tokens(content)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': state.cached_tokens(messages)},
+        }
+        state.count('prompt_tokens', prompt_tokens)
+        state.count('completion_tokens', completion_tokens)
+
+        completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+        model = request.get('model', 'fake-model')
+        created = int(time.time())
+        time.sleep(config.sample_latency())
+
+        if not request.get('stream'):
+            time.sleep(completion_tokens / config.tokens_per_second)
+            state.count('completions')
+            self._send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop', 'logprobs': None}],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason, 'logprobs': None}],
+            })
+
+        try:
+            send_event(chunk({'role': 'assistant', 'content': ''}))
+            pieces = _split_stream(content)
+            delay = completion_tokens / config.tokens_per_second / max(1, len(pieces))
+            for piece in pieces:
+                send_event(chunk({'content': piece}))
+                time.sleep(delay)
+            send_event(chunk({}, 'stop'))
+            if (request.get('stream_options') or {}).get('include_usage'):
+                send_event(json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created,
+                                       'model': model, 'choices': [], 'usage': usage}))
+            send_event('[DONE]')
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            state.count('completions')
+            state.count('streams')
+        except (BrokenPipeError, ConnectionResetError):
+            state.count('disconnects')
+
+
+class FakeLlmServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeLlmHandler)
+        self.config = config
+        self.state = FakeLlmState()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_fake_llm_server(host=FAKE_LLM_HOST, port=0, **config):
+    """Start a fake server on a background thread (port 0 picks a free port); call .shutdown() to stop it"""
+    server = FakeLlmServer((host, port), FakeLlmConfig(**config))
+    threading.Thread(target=server.serve_forever, name='fake-llm-server', daemon=True).start()
+    logging.info(f"Fake LLM server listening on {server.base_url} (latency {server.config.latency})")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake OpenAI chat-completions server")
+    parser.add_argument('--host', default=FAKE_LLM_HOST)
+    parser.add_argument('--port', type=int, default=FAKE_LLM_PORT)
+    parser.add_argument('--latency', default=FAKE_LLM_LATENCY,
+                        help="time to first token: fixed:MS, uniform:LO,HI, normal:MEAN,SD or lognormal:MEDIAN,SIGMA")
+    parser.add_argument('--tokens-per-second', type=float, default=FAKE_LLM_TOKENS_PER_SECOND)
+    parser.add_argument('--error-rate', type=float, default=FAKE_LLM_ERROR_RATE)
+    parser.add_argument('--rate-limit-rate', type=float, default=FAKE_LLM_RATE_LIMIT_RATE)
+    parser.add_argument('--retry-after', type=float, default=FAKE_LLM_RETRY_AFTER)
+    parser.add_argument('--answer-words', type=int, default=FAKE_LLM_ANSWER_WORDS)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = FakeLlmConfig(args.latency, args.tokens_per_second, args.error_rate, args.rate_limit_rate,
+                           args.retry_after, args.answer_words, args.seed)
+    server = FakeLlmServer((args.host, args.port), config)
+    logging.info(f"Fake LLM server listening on {server.base_url} (latency {config.latency}, "
+                 f"{config.error_rate:.0%} errors, {config.rate_limit_rate:.0%} rate limited)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Precomputed FAQ Answer Table
+Mines the channel archive for the questions users ask most, clusters paraphrases
+with MinHash, and precomputes one answer per cluster against the current FAQ
+snapshot. The table is stored on disk with the corpus hash it was built from and
+is checked before the LLM, so the most common questions are answered without an
+API call. It is rebuilt in the background whenever the FAQ corpus changes.
+
+Run directly to rebuild the table by hand: python faq_answer_table.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+
+from answer_cache import (AnswerCache, MINHASH_BANDS, MINHASH_PERMUTATIONS, content_terms, minhash_signature,
+                          normalize_question)
+from faq_retrieval import tokenize
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_FILE = os.path.join(BASE_DIR, 'archive', 'channel_history.txt')
+ANSWER_TABLE_FILE = os.path.join(BASE_DIR, 'faq_cache', 'answer_table.json')
+
+# Mining settings
+ANSWER_TABLE_MAX_ENTRIES = int(os.getenv('ANSWER_TABLE_MAX_ENTRIES', '50'))   # Question clusters answered
+ANSWER_TABLE_MIN_ASKERS = int(os.getenv('ANSWER_TABLE_MIN_ASKERS', '2'))     # Distinct users who asked a cluster
+ANSWER_TABLE_CONCURRENCY = 2           # Answers generated at once while rebuilding
+ANSWER_TABLE_POLL_INTERVAL = 30        # Seconds between disk checks for stores that don't build
+PARAPHRASE_THRESHOLD = 0.8             # Estimated Jaccard similarity to join a question cluster (same content words too)
+MIN_QUESTION_TERMS = 2                 # Content words (stopwords excluded) a question needs
+MAX_QUESTION_CHARS = 300
+
+MESSAGE_SEPARATOR = re.compile(r'^-{50}$', re.MULTILINE)
+MESSAGE_PATTERN = re.compile(r'^(?:Channel: .*? \| )?User: (.*?) \| Date: .*?\nMessage: (.*)', re.DOTALL)
+REPLY_SUFFIX_PATTERN = re.compile(r'\s*\(Replying to: .*\)\s*$', re.DOTALL)
+FAQ_COMMAND_PATTERN = re.compile(r'^/(?:ask|faq|faqqer)(?:@\w+)?\s+(.+)', re.DOTALL)
+QUESTION_PATTERN = re.compile(r'[^.!?\n]*\?')
+
+
+def read_archive_messages(path=ARCHIVE_FILE):
+    """Yield (user, text) for every message in an archiver text export"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    for record in MESSAGE_SEPARATOR.split(content):
+        match = MESSAGE_PATTERN.search(record.strip())
+        if match:
+            yield match.group(1), REPLY_SUFFIX_PATTERN.sub('', match.group(2)).strip()
+
+
+def extract_question(text):
+    """The question asked in a message (a /faq command or a sentence ending in '?'), else None"""
+    command = FAQ_COMMAND_PATTERN.match(text)
+    if command:
+        question = command.group(1).strip()
+    else:
+        candidates = [q.strip() for q in QUESTION_PATTERN.findall(text)]
+        if not candidates:
+            return None
+        question = max(candidates, key=len)
+    if len(tokenize(question)) < MIN_QUESTION_TERMS or len(question) > MAX_QUESTION_CHARS:
+        return None
+    return question
+
+
+def _band_keys(signature):
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    return [(band, signature[band * rows:(band + 1) * rows]) for band in range(MINHASH_BANDS)]
+
+
+def cluster_questions(asked, threshold=PARAPHRASE_THRESHOLD):
+    """
+    Group paraphrased questions. `asked` is a list of (user, question).
+    A wording only joins a cluster whose representative has exactly the same content
+    words, since every paraphrase is served the representative's precomputed answer.
+    Returns clusters sorted by popularity, each a dict with the most common wording
+    ('question'), every normalized wording ('paraphrases'), 'asks' and 'askers'.
+    """
+    wordings = {}   # normalized -> Counter of original wordings
+    users = {}      # normalized -> set of users
+    for user, question in asked:
+        key = normalize_question(question)
+        if not key:
+            continue
+        wordings.setdefault(key, Counter())[question] += 1
+        users.setdefault(key, set()).add(user)
+
+    clusters = []
+    buckets = {}    # LSH band key -> cluster indexes
+    # Most asked wordings first, so they become the cluster representatives
+    for key in sorted(wordings, key=lambda k: (-sum(wordings[k].values()), k)):
+        signature = minhash_signature(key)
+        terms = content_terms(key)
+        candidates = set()
+        for band_key in _band_keys(signature):
+            candidates.update(buckets.get(band_key, ()))
+
+        best, best_score = None, 0.0
+        for i in candidates:
+            if clusters[i]['terms'] != terms:
+                continue
+            rep = clusters[i]['signature']
+            score = sum(1 for x, y in zip(signature, rep) if x == y) / len(signature)
+            if score > best_score:
+                best, best_score = i, score
+
+        if best is None or best_score < threshold:
+            best = len(clusters)
+            clusters.append({'signature': signature, 'terms': terms, 'paraphrases': [], 'wordings': Counter(),
+                             'users': set()})
+            for band_key in _band_keys(signature):
+                buckets.setdefault(band_key, set()).add(best)
+        cluster = clusters[best]
+        cluster['paraphrases'].append(key)
+        cluster['wordings'].update(wordings[key])
+        cluster['users'].update(users[key])
+
+    result = [{
+        'question': cluster['wordings'].most_common(1)[0][0],
+        'paraphrases': cluster['paraphrases'],
+        'asks': sum(cluster['wordings'].values()),
+        'askers': len(cluster['users']),
+    } for cluster in clusters]
+    result.sort(key=lambda c: (-c['askers'], -c['asks'], c['question']))
+    return result
+
+
+def mine_frequent_questions(snapshot, archive_path=ARCHIVE_FILE, max_entries=ANSWER_TABLE_MAX_ENTRIES,
+                            min_askers=ANSWER_TABLE_MIN_ASKERS):
+    """Most asked question clusters in the archive that the FAQ has something to say about"""
+    asked = []
+    for user, text in read_archive_messages(archive_path):
+        question = extract_question(text)
+        if question:
+            asked.append((user, question))
+
+    frequent = []
+    for cluster in cluster_questions(asked):
+        # One user repeating themselves (or a bot's canned text) isn't a frequent question
+        if cluster['askers'] < min_askers:
+            continue
+        # Chat chatter ("what error do you see?") has no FAQ section to answer from
+        if not snapshot.index.search(cluster['question'], 1):
+            continue
+        # Banned topics are deflected before the table is consulted
+        if snapshot.topic_filter.match(cluster['question']):
+            continue
+        frequent.append(cluster)
+        if len(frequent) >= max_entries:
+            break
+    logging.info(f"Answer table: mined {len(asked)} questions, {len(frequent)} frequent clusters kept")
+    return frequent
+
+
+class AnswerTable:
+    """Precomputed answers for one FAQ corpus, looked up by exact or near-duplicate wording"""
+
+    def __init__(self, corpus_hash, entries, built_at=None):
+        self.corpus_hash = corpus_hash
+        self.entries = entries      # list of {'question', 'paraphrases', 'asks', 'askers', 'answer'}
+        self.built_at = built_at or time.time()
+        self._index = AnswerCache(max_entries=max(1, sum(len(e['paraphrases']) for e in entries)),
+                                  ttl=float('inf'))
+        for entry in entries:
+            # Only wordings about exactly what the answer was generated for (tables mined
+            # with looser clustering may hold paraphrases that ask something else)
+            terms = content_terms(normalize_question(entry['question']))
+            for paraphrase in entry['paraphrases']:
+                if content_terms(paraphrase) == terms:
+                    self._index.put(paraphrase, entry['answer'])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, question):
+        return self._index.get(question)
+
+    def save(self, path=ANSWER_TABLE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = {'corpus_hash': self.corpus_hash, 'built_at': self.built_at, 'entries': self.entries}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=ANSWER_TABLE_FILE):
+        """The table stored on disk, or None if there is none (or it is unreadable)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(data['corpus_hash'], data['entries'], data.get('built_at'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable answer table {path}: {e}")
+            return None
+
+
+async def build_answer_table(snapshot, answer_fn, archive_path=ARCHIVE_FILE, max_entries=ANSWER_TABLE_MAX_ENTRIES):
+    """
+    Mine the archive and answer each frequent question cluster against the snapshot.
+    answer_fn(question, snapshot) is awaited per cluster and should raise on failure;
+    clusters that fail (or get an empty answer) are left out of the table.
+    """
+    clusters = await asyncio.to_thread(mine_frequent_questions, snapshot, archive_path, max_entries)
+    semaphore = asyncio.Semaphore(ANSWER_TABLE_CONCURRENCY)
+
+    async def answer(cluster):
+        async with semaphore:
+            try:
+                text = await answer_fn(cluster['question'], snapshot)
+            except Exception as e:
+                logging.warning(f"Answer table: no answer for '{cluster['question']}': {type(e).__name__}: {e}")
+                return None
+        return dict(cluster, answer=text) if text else None
+
+    answered = await asyncio.gather(*(answer(cluster) for cluster in clusters))
+    return AnswerTable(snapshot.corpus_hash, [entry for entry in answered if entry is not None])
+
+
+class AnswerTableStore:
+    """Serves the answer table that matches the current FAQ snapshot and rebuilds it when the corpus changes"""
+
+    def __init__(self, answer_fn, path=ANSWER_TABLE_FILE, archive_path=ARCHIVE_FILE, builder=True):
+        self.answer_fn = answer_fn
+        self.path = path
+        self.archive_path = archive_path
+        self.builder = builder      # False: only load tables another process built
+        self.table = None
+        self._latest = None         # Newest snapshot a table was requested for
+        self._rebuild_task = None
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    def lookup(self, question, snapshot):
+        """Precomputed answer for the question, if the table was built from this snapshot's corpus"""
+        table = self.table
+        if table is None or table.corpus_hash != snapshot.corpus_hash:
+            return None
+        answer = table.lookup(question)
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def schedule_rebuild(self, snapshot):
+        """Snapshot listener: make sure a table for this snapshot's corpus is (being) built"""
+        self._latest = snapshot
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = asyncio.ensure_future(self._rebuild_latest())
+
+    async def _rebuild_latest(self):
+        # Loop so a corpus change during a rebuild triggers one more rebuild afterwards
+        while self.table is None or self.table.corpus_hash != self._latest.corpus_hash:
+            snapshot = self._latest
+            stored = await asyncio.to_thread(AnswerTable.load, self.path)
+            if stored is not None and stored.corpus_hash == snapshot.corpus_hash:
+                self.table = stored
+                logging.info(f"Answer table loaded from disk: {len(stored)} precomputed answers")
+                continue
+            if not self.builder:
+                await asyncio.sleep(ANSWER_TABLE_POLL_INTERVAL)
+                continue
+            if not os.path.exists(self.archive_path):
+                logging.info(f"No channel archive at {self.archive_path}, answer table disabled")
+                return
+            try:
+                started = time.monotonic()
+                table = await build_answer_table(snapshot, self.answer_fn, self.archive_path)
+                await asyncio.to_thread(table.save, self.path)
+            except Exception as e:
+                logging.error(f"Error rebuilding answer table: {e}")
+                return
+            self.table = table
+            self.rebuilds += 1
+            logging.info(f"Answer table rebuilt for snapshot v{snapshot.version}: {len(table)} answers "
+                         f"in {time.monotonic() - started:.1f}s")
+
+    def stats(self):
+        table = self.table
+        return {
+            'entries': len(table) if table is not None else 0,
+            'current': table is not None and self._latest is not None
+                       and table.corpus_hash == self._latest.corpus_hash,
+            'hits': self.hits,
+            'misses': self.misses,
+            'rebuilds': self.rebuilds,
+        }
+
+
+if __name__ == "__main__":
+    # Manual rebuild with the bots' answer path
+    import faq_engine
+
+    async def rebuild():
+        snapshot = await faq_engine.faq_corpus.refresh()
+        table = await build_answer_table(snapshot, faq_engine.request_faq_answer)
+        table.save()
+        print(f"Answer table written to {ANSWER_TABLE_FILE}: {len(table)} answers")
+        for entry in table.entries:
+            print(f"- [{entry['askers']} askers / {entry['asks']} asks] {entry['question']}")
+
+    asyncio.run(rebuild())
@@ -1,10 +1,17 @@
 import asyncio
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
+from telethon.errors import FloodWaitError
 import os
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+import argparse
+import heapq
 import sys
+import time
+
+from archive_pacer import ARCHIVE_FETCH_CONCURRENCY, AdaptivePacer, in_paced_call
+from archive_store import ChannelStore, cutoff_date, format_date, replace_atomically, reply_snippet, store_lock
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -20,6 +27,7 @@ DEFAULT_CHANNELS = ["tariproject", "OrderOfSoon"]  # Target channel/group userna
 DEFAULT_HOURS_HISTORY = 24  # Number of hours of history to fetch
 DEFAULT_OUTPUT_DIR = 'archive'
 DEFAULT_MEDIA_FOLDER = 'media_files'
+MEDIA_BACKFILL_BATCH = 100  # Stored records per get_messages(ids=...) call when downloading their missing media
 
 # Set up logging to print to console
 logging.basicConfig(
@@ -35,97 +43,337 @@ def ensure_directories_exist(output_dir, media_folder):
     if not os.path.exists(media_folder):
         os.makedirs(media_folder)
 
+class ArchiveClient(TelegramClient):
+    """
+    A TelegramClient that raises every flood wait during paced requests, so the archive
+    pacer can slow every channel down, not just the request that hit one. Other calls
+    (login, entity resolution) sleep through short waits as Telethon normally does.
+    """
+
+    @property
+    def flood_sleep_threshold(self):
+        return 0 if in_paced_call.get() else self._flood_sleep_threshold
+
+    @flood_sleep_threshold.setter
+    def flood_sleep_threshold(self, value):
+        TelegramClient.flood_sleep_threshold.fset(self, value)
+
 # Initialize the Telegram client for user login
-client = TelegramClient('session_name', api_id, api_hash)
+client = ArchiveClient('session_name', api_id, api_hash)
 
-async def get_messages_from_channel(channel_username, hours_history, media_folder):
+async def get_messages_from_channel(channel_username, hours_history, min_id=0, max_id=0, pacer=None):
     """
-    Fetches all messages from the given channel within the specified time period.
-    Returns messages sorted in chronological order (oldest first).
+    Yields the messages of the given channel within the specified time period,
+    newer than min_id and older than max_id (0 = no bound), one page at a time
+    and oldest first. A min_id fetch continues a stored history, so it starts
+    right after min_id and keeps everything it pages through; otherwise paging
+    starts at the cutoff. Requests are spaced by pacer (shared between channels
+    fetched together).
     """
+    pacer = pacer or AdaptivePacer()
     now_utc_naive = datetime.utcnow()  # naive UTC
     cutoff_time_naive = now_utc_naive - timedelta(hours=hours_history)
 
-    offset_id = 0
     limit = 100
-    all_messages = []
+    found = 0
 
-    logging.info(f"Starting to fetch messages from the last {hours_history}h in channel: {channel_username}")
+    logging.info(f"Starting to fetch messages from the last {hours_history}h in channel: {channel_username}"
+                 + (f" (after message {min_id})" if min_id else "")
+                 + (f" (before message {max_id})" if max_id else ""))
 
+    # Oldest first: start just after min_id (or at the cutoff) and page forwards
+    offset = {'offset_id': min_id} if min_id else {'offset_date': cutoff_time_naive.replace(tzinfo=timezone.utc)}
     while True:
-        # Fetch up to 'limit' messages (newest first)
-        messages = await client.get_messages(
+        # Fetch up to 'limit' messages (oldest first)
+        messages = await pacer.call(
+            channel_username,
+            client.get_messages,
             channel_username,
             limit=limit,
-            offset_id=offset_id
+            max_id=max_id,
+            reverse=True,
+            **offset
         )
-        
-        if not messages:
-            logging.info(f"No more messages found in {channel_username}. Stopping.")
+        pacer.count_messages(channel_username, len(messages))
+
+        # Keep only messages within the specified time period (the server already starts at the
+        # cutoff; a min_id fetch keeps everything, as its caller only uses one inside the window)
+        page = messages if min_id else [msg for msg in messages
+                                        if msg.date.replace(tzinfo=None) >= cutoff_time_naive]
+        if page:
+            found += len(page)
+            yield page
+
+        # A short page is the newest one
+        if len(messages) < limit:
             break
 
-        # The oldest message in this batch
-        batch_oldest_date = messages[-1].date.replace(tzinfo=None)
-
-        # Keep only messages within the specified time period
-        for msg in messages:
-            msg_date_naive = msg.date.replace(tzinfo=None)
-            if msg_date_naive >= cutoff_time_naive:
-                # Add channel info to message for combined output
-                msg.channel_name = channel_username
-                all_messages.append(msg)
-
-        # If the oldest message in the batch is older than our cutoff, stop
-        if batch_oldest_date < cutoff_time_naive:
-            break
+        # Prepare to fetch newer messages next time
+        offset = {'offset_id': messages[-1].id}
 
-        # Prepare to fetch older messages next time
-        offset_id = messages[-1].id
+    logging.info(f"Finished fetching from {channel_username}. Messages found: {found}")
 
-        # Sleep to respect Telegram rate limits
-        await asyncio.sleep(1)
+async def resolve_senders(messages, senders, channel_username, pacer=None):
+    """
+    Put the senders of a batch of messages into the sender cache. Senders Telegram
+    sent along with the messages always refresh their cache entry (usernames change);
+    senders it left out that are not cached yet are looked up with get_entity for the
+    whole batch instead of one get_sender() per message. Senders that could not be
+    resolved recently are not looked up again until their retry date.
+    """
+    missing = set()
+    for msg in messages:
+        if msg.sender_id is None:
+            continue
+        if msg.sender is not None:
+            senders.put(msg.sender_id, getattr(msg.sender, 'username', None))
+        elif msg.sender_id not in senders:
+            missing.add(msg.sender_id)
+    missing = {sender_id for sender_id in missing if not senders.failed_recently(sender_id)}
+    if missing:
+        senders.lookups += len(missing)
+        await lookup_senders(sorted(missing), senders, channel_username, pacer or AdaptivePacer())
+
+async def lookup_senders(sender_ids, senders, channel_username, pacer):
+    """
+    Resolve sender ids with one get_entity call. get_entity fails the whole list if one
+    id can't be resolved, so a failed batch is split in halves until only that id is left,
+    which is then remembered as failed.
+    """
+    try:
+        entities = await pacer.call(channel_username, client.get_entity, list(sender_ids))
+    except FloodWaitError as e:
+        # The pacer already waited and retried; splitting would only add requests
+        logging.warning(f"Could not resolve {len(sender_ids)} senders in {channel_username}: {e}")
+        return
+    except Exception as e:
+        if len(sender_ids) == 1:
+            logging.warning(f"Could not resolve sender {sender_ids[0]} in {channel_username}: {e}")
+            senders.put_failed(sender_ids[0])
+            return
+        middle = len(sender_ids) // 2
+        await lookup_senders(sender_ids[:middle], senders, channel_username, pacer)
+        await lookup_senders(sender_ids[middle:], senders, channel_username, pacer)
+        return
+    for entity in entities:
+        senders.put(utils.get_peer_id(entity), getattr(entity, 'username', None))
+
+async def message_record(msg, channel_username, senders, media_folder=None, pacer=None):
+    """
+    A JSON-serializable record of a message, as kept in the channel store and written to the archive.
+    The sender's username comes from the sender cache (see resolve_senders).
+    """
+    sender = senders.get(msg.sender_id) if msg.sender_id is not None else None
+    record = {
+        'id': msg.id,
+        'channel': channel_username,
+        'date': format_date(msg.date),
+        'sender_id': msg.sender_id,
+        'username': sender['username'] if sender else None,
+        'text': msg.text or "",
+        'reply_to': msg.reply_to_msg_id,
+        'media': bool(msg.media),
+        'media_path': None,
+    }
+    # Media is only needed (and downloaded) for HTML output
+    if media_folder and msg.media:
+        record['media_path'] = await download_media(msg, channel_username, media_folder, pacer)
+    return record
+
+async def download_media(msg, channel_username, media_folder, pacer=None):
+    """Download a message's media into media_folder; returns the file's path, or None if that failed"""
+    try:
+        media_path = await (pacer or AdaptivePacer()).call(channel_username, msg.download_media, file=media_folder)
+        if not media_path:
+            logging.warning(f"Failed to download media for message {msg.id}")
+        return media_path
+    except Exception as e:
+        logging.error(f"Error downloading media for message {msg.id}: {e}")
+        return None
+
+def lacks_media(record):
+    """Whether a record has media with no downloaded file (stored by a text-mode run, or the file was removed)"""
+    return record['media'] and not (record['media_path'] and os.path.exists(record['media_path']))
+
+async def download_missing_media(records, channel_username, media_folder, pacer=None):
+    """Download the media records lack, refetching their messages with one get_messages(ids=[...]) call"""
+    lacking = {record['id']: record for record in records if lacks_media(record)}
+    if not lacking:
+        return
+    try:
+        messages = await (pacer or AdaptivePacer()).call(channel_username, client.get_messages, channel_username,
+                                                         ids=sorted(lacking))
+    except Exception as e:
+        logging.warning(f"Could not refetch {len(lacking)} messages for their media in {channel_username}: {e}")
+        return
+    for msg in messages:
+        if msg is not None and msg.media:
+            lacking[msg.id]['media_path'] = await download_media(msg, channel_username, media_folder, pacer)
+
+async def with_media(records, channel_username, media_folder, pacer=None):
+    """Stored records, in order, with missing media downloaded in batches of MEDIA_BACKFILL_BATCH"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == MEDIA_BACKFILL_BATCH:
+            await download_missing_media(batch, channel_username, media_folder, pacer)
+            for pending in batch:
+                yield pending
+            batch = []
+    await download_missing_media(batch, channel_username, media_folder, pacer)
+    for pending in batch:
+        yield pending
+
+async def index_replies(messages, replies, channel_username, pacer=None):
+    """
+    Add a batch of messages to the reply index, then fetch the messages they reply to
+    that the index does not have yet, in one get_messages(ids=[...]) call for the batch.
+    """
+    replies.add(channel_username, [(msg.id, format_date(msg.date), reply_snippet(msg.text)) for msg in messages])
+    missing = replies.missing(channel_username, {msg.reply_to_msg_id for msg in messages if msg.reply_to_msg_id})
+    if not missing:
+        return
+    try:
+        parents = await (pacer or AdaptivePacer()).call(channel_username, client.get_messages, channel_username,
+                                                        ids=sorted(missing))
+    except Exception as e:
+        logging.warning(f"Could not fetch {len(missing)} replied-to messages in {channel_username}: {e}")
+        return
+    found = {parent.id: parent for parent in parents if parent is not None}
+    replies.parents_fetched += len(found)
+    # Parents Telegram did not return (deleted) are recorded so they are not fetched again
+    unavailable_date = format_date(datetime.utcnow())
+    replies.add(channel_username, [
+        (parent_id, format_date(found[parent_id].date), reply_snippet(found[parent_id].text))
+        if parent_id in found else (parent_id, unavailable_date, None)
+        for parent_id in missing
+    ])
+
+async def fetch_records(store, channel_username, hours_history, media_folder=None, pacer=None, **bounds):
+    """Records of a channel's messages (see get_messages_from_channel for bounds), oldest first"""
+    async for messages in get_messages_from_channel(channel_username, hours_history, pacer=pacer, **bounds):
+        await resolve_senders(messages, store.senders, channel_username, pacer)
+        await index_replies(messages, store.replies, channel_username, pacer)
+        for msg in messages:
+            yield await message_record(msg, channel_username, store.senders, media_folder, pacer)
 
-    logging.info(f"Finished fetching from {channel_username}. Messages found: {len(all_messages)}")
-    return all_messages
+async def update_channel_archive(store, channel_username, hours_history, media_folder=None, rebuild_window=False,
+                                 pacer=None):
+    """
+    Bring a channel's stored history up to date; returns the number of messages fetched.
+    The stored history is contiguous from its checkpoint's complete_since up to
+    fetched_until. If that reaches into the window, only messages after the
+    checkpoint are fetched, plus [cutoff, complete_since) when the window reaches
+    back further. Otherwise the whole window is fetched and the history is only
+    contiguous from the cutoff (older records are kept until retention drops them).
+    rebuild_window ignores the checkpoint and refetches the whole window. The store
+    is rewritten as a stream, already in order. With a media_folder (HTML output),
+    stored records in the window that have no media file yet get their media downloaded.
+    """
+    pacer = pacer or AdaptivePacer()
+    cutoff = cutoff_date(hours_history)
+    fetched_until = cutoff_date(0)      # Messages arriving during the fetch are picked up next run
+    checkpoint = None if rebuild_window else store.checkpoint(channel_username)
+    writer = store.writer(channel_username, hours_history)
+    fetched = 0
+
+    try:
+        if checkpoint is None or checkpoint.get('fetched_until', '') < cutoff:
+            if checkpoint is not None:
+                # Everything stored predates the window, with an unknown gap before it
+                for record in store.records(channel_username):
+                    writer.write(record)
+            async for record in fetch_records(store, channel_username, hours_history, media_folder, pacer):
+                writer.write(record)
+                fetched += 1
+            complete_since = cutoff
+            logging.info(f"{channel_username}: archived {fetched} messages (full window)")
+        else:
+            complete_since = checkpoint['complete_since']
+            if cutoff < complete_since:
+                # The window reaches further back than the contiguous history: backfill
+                # [cutoff, complete_since), replacing stored records from before a gap in it
+                oldest_id = store.oldest_id(channel_username, since=complete_since) or checkpoint['last_id'] + 1
+                for record in store.records(channel_username):
+                    if record['date'] >= cutoff:
+                        break
+                    writer.write(record)
+                async for record in fetch_records(store, channel_username, hours_history, media_folder, pacer,
+                                                  max_id=oldest_id):
+                    writer.write(record)
+                    fetched += 1
+                logging.info(f"{channel_username}: backfilled {fetched} older messages")
+
+            stored = (record for record in store.records(channel_username) if record['date'] >= complete_since)
+            if media_folder:
+                async for record in with_media(stored, channel_username, media_folder, pacer):
+                    writer.write(record)
+            else:
+                for record in stored:
+                    writer.write(record)
+            complete_since = min(complete_since, cutoff)
+
+            new = 0
+            async for record in fetch_records(store, channel_username, hours_history, media_folder, pacer,
+                                              min_id=checkpoint['last_id']):
+                writer.write(record)
+                new += 1
+            fetched += new
+            logging.info(f"{channel_username}: {new} new messages since message {checkpoint['last_id']}")
+    except BaseException:
+        writer.abort()
+        raise
+
+    writer.commit(complete_since, fetched_until)
+    return fetched
+
+def replied_message(record, replies=None):
+    """Snippet of the message a record replies to, from the reply index"""
+    snippet = replies.get(record['channel'], record['reply_to']) if replies is not None else None
+    return snippet or "Unknown message"
+
+def sender_name(record, senders=None):
+    """
+    Username for display ("Unknown" when there is no sender): the sender cache's
+    current entry if it has one, else the username stored with the record
+    """
+    if record['sender_id'] is None:
+        return "Unknown"
+    cached = senders.get(record['sender_id']) if senders is not None else None
+    return cached['username'] if cached else record['username']
 
-async def write_combined_text_history(all_messages, filepath, channels, hours_history):
+async def write_combined_text_history(all_messages, filepath, channels, hours_history, senders=None,
+                                      replies=None):
     """Write combined messages from all channels to a text file"""
-    with open(filepath, 'w', encoding='utf-8') as f:
+    with replace_atomically(filepath) as f:
         # Write header
         f.write(f"Combined Chat History for channels: {', '.join(channels)}\n")
         f.write(f"Time period: Last {hours_history} hours\n")
         f.write(f"Generated on: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC\n")
         f.write('=' * 70 + '\n\n')
         
-        # To store a mapping of message ID to its content (used for "reply to" info)
-        message_dict = {}
-        
-        for msg in all_messages:
-            sender = await msg.get_sender()
-            username = sender.username if sender else "Unknown"
-            date_str = msg.date.strftime('%Y-%m-%d %H:%M:%S')
-            content = msg.text or "Media message"
-            channel_name = getattr(msg, 'channel_name', 'Unknown')
-
-            # Check if message is a reply to another
-            if msg.reply_to_msg_id:
-                replied_message = message_dict.get(msg.reply_to_msg_id, "Unknown message")
-                reply_info = f"(Replying to: {replied_message})"
+        for record in all_messages:
+            username = sender_name(record, senders)
+            date_str = record['date']
+            content = record['text'] or "Media message"
+            channel_name = record['channel']
+
+            # Check if message is a reply to another (the parent may be older than this window)
+            if record['reply_to']:
+                reply_info = f"(Replying to: {replied_message(record, replies)})"
             else:
                 reply_info = ""
 
-            # Add message content to dictionary for future replies
-            message_dict[msg.id] = content
-
             f.write(f"Channel: {channel_name} | User: {username} | Date: {date_str}\n")
             f.write(f"Message: {content} {reply_info}\n")
             f.write('-' * 50 + '\n')  # Separator
 
     logging.info(f"Combined text chat history saved to {os.path.abspath(filepath)}")
 
-async def write_combined_html_history(all_messages, filepath, channels, hours_history, media_folder):
+async def write_combined_html_history(all_messages, filepath, channels, hours_history, media_folder, senders=None,
+                                      replies=None):
     """Write combined messages from all channels to an HTML file"""
-    with open(filepath, 'w', encoding='utf-8') as f:
+    with replace_atomically(filepath) as f:
         # Basic HTML skeleton
         f.write('<html><head><title>Combined Channel History</title><style>')
         f.write('body { font-family: Arial, sans-serif; background-color: #f4f4f9; }')
@@ -140,56 +388,44 @@ async def write_combined_html_history(all_messages, filepath, channels, hours_hi
         f.write(f'<p>Time period: Last {hours_history} hours</p>')
         f.write(f'<p>Generated on: {datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")} UTC</p><hr>')
 
-        # To store a mapping of message ID to its content (used for "reply to" info)
-        message_dict = {}
-
-        for msg in all_messages:
-            sender = await msg.get_sender()
-            username = sender.username if sender else "Unknown"
-            date_str = msg.date.strftime('%Y-%m-%d %H:%M:%S')
-            content = msg.text or ""
-            channel_name = getattr(msg, 'channel_name', 'Unknown')
+        for record in all_messages:
+            username = sender_name(record, senders)
+            date_str = record['date']
+            content = record['text']
+            channel_name = record['channel']
 
-            # Reply info
-            if msg.reply_to_msg_id:
-                replied_message = message_dict.get(msg.reply_to_msg_id, "Unknown message")
-                reply_info = f'<div class="reply">Replying to: {replied_message}</div>'
+            # Reply info (the parent may be older than this window)
+            if record['reply_to']:
+                reply_info = f'<div class="reply">Replying to: {replied_message(record, replies)}</div>'
             else:
                 reply_info = ""
 
+            # Media was downloaded when the message was archived
             media_reference = ""
-            if msg.media:
-                try:
-                    media_path = await msg.download_media(file=media_folder)
-                    if media_path:
-                        media_filename = os.path.basename(media_path)
-                        if media_filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                            media_reference = (
-                                f'<div class="media">'
-                                f'<img src="{media_folder}/{media_filename}" alt="Image" width="300">'
-                                '</div>'
-                            )
-                        elif media_filename.lower().endswith(('.mp4', '.webm', '.mkv')):
-                            media_reference = (
-                                f'<div class="media">'
-                                f'<video width="300" controls>'
-                                f'<source src="{media_folder}/{media_filename}" type="video/mp4">'
-                                'Your browser does not support the video tag.'
-                                '</video></div>'
-                            )
-                        else:
-                            media_reference = (
-                                f'<div class="media">'
-                                f'<a href="{media_folder}/{media_filename}" download>'
-                                f'Download {media_filename}</a></div>'
-                            )
+            if record['media']:
+                media_path = record['media_path']
+                if media_path:
+                    media_filename = os.path.basename(media_path)
+                    if media_filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
+                        media_reference = (
+                            f'<div class="media">'
+                            f'<img src="{media_folder}/{media_filename}" alt="Image" width="300">'
+                            '</div>'
+                        )
+                    elif media_filename.lower().endswith(('.mp4', '.webm', '.mkv')):
+                        media_reference = (
+                            f'<div class="media">'
+                            f'<video width="300" controls>'
+                            f'<source src="{media_folder}/{media_filename}" type="video/mp4">'
+                            'Your browser does not support the video tag.'
+                            '</video></div>'
+                        )
                     else:
-                        logging.warning(f"Failed to download media for message {msg.id}")
-                except Exception as e:
-                    logging.error(f"Error downloading media for message {msg.id}: {e}")
-
-            # Store for future replies
-            message_dict[msg.id] = content if content else "Media message"
+                        media_reference = (
+                            f'<div class="media">'
+                            f'<a href="{media_folder}/{media_filename}" download>'
+                            f'Download {media_filename}</a></div>'
+                        )
 
             # HTML output
             f.write('<div class="message">')
@@ -206,9 +442,15 @@ async def write_combined_html_history(all_messages, filepath, channels, hours_hi
     logging.info(f"Combined HTML chat history saved to {os.path.abspath(filepath)}")
 
 async def archive_channels(channels=None, hours_history=None, output_dir=None, 
-                          media_folder=None, output_as_text=True):
+                          media_folder=None, output_as_text=True, rebuild_window=False,
+                          fetch_concurrency=None):
     """
     Main function to archive messages from multiple Telegram channels.
+    Messages already archived into output_dir are kept in its channel store, so
+    each run only fetches what is new since the channel's checkpoint; runs into the
+    same output_dir take turns. Channels are fetched concurrently, sharing one
+    adaptive request pace. Fetching, merging and writing all stream records, so
+    memory does not grow with the window.
     
     Args:
         channels (list): List of channel usernames to archive
@@ -216,6 +458,8 @@ async def archive_channels(channels=None, hours_history=None, output_dir=None,
         output_dir (str): Directory to save output files
         media_folder (str): Directory to save media files
         output_as_text (bool): Whether to output as text (True) or HTML (False)
+        rebuild_window (bool): Ignore the checkpoints and refetch the whole window
+        fetch_concurrency (int): Channels fetched at once (default ARCHIVE_FETCH_CONCURRENCY)
     
     Returns:
         dict: Summary statistics including message counts and unique senders
@@ -229,6 +473,8 @@ async def archive_channels(channels=None, hours_history=None, output_dir=None,
         output_dir = DEFAULT_OUTPUT_DIR
     if media_folder is None:
         media_folder = DEFAULT_MEDIA_FOLDER
+    if fetch_concurrency is None:
+        fetch_concurrency = ARCHIVE_FETCH_CONCURRENCY
     
     # Ensure directories exist
     ensure_directories_exist(output_dir, media_folder)
@@ -243,76 +489,130 @@ async def archive_channels(channels=None, hours_history=None, output_dir=None,
     # Start the Telegram client
     await client.start(phone=phone_number)
     
-    # Collect all messages from all channels
-    all_messages = []
-    channel_stats = {}
-    
-    for channel in channels:
-        try:
-            messages = await get_messages_from_channel(channel, hours_history, media_folder)
-            all_messages.extend(messages)
-            channel_stats[channel] = len(messages)
-            logging.info(f"Channel {channel}: {len(messages)} messages")
-        except Exception as e:
-            logging.error(f"Error fetching messages from {channel}: {e}")
-            channel_stats[channel] = 0
-    
-    # Sort all messages in chronological order (oldest to newest)
-    all_messages.sort(key=lambda m: m.date)
-    
-    logging.info(f"Total messages collected: {len(all_messages)}")
-    
-    # Write combined output
-    if output_as_text:
-        await write_combined_text_history(all_messages, output_text_file, channels, hours_history)
-    else:
-        await write_combined_html_history(all_messages, output_html_file, channels, hours_history, media_folder)
-    
-    # Count unique senders across all channels
-    unique_senders = set()
-    unique_senders_per_channel = {}
-    
-    for channel in channels:
-        unique_senders_per_channel[channel] = set()
-    
-    for msg in all_messages:
-        sender = await msg.get_sender()
-        channel_name = getattr(msg, 'channel_name', 'Unknown')
-        
-        if sender:
-            sender_id = sender.username if sender.username else str(sender.id)
-            unique_senders.add(sender_id)
-            if channel_name in unique_senders_per_channel:
+    # Bring every channel's store up to date; a concurrent run into the same output_dir waits its turn
+    lock = store_lock(output_dir)
+    await lock.acquire()
+    store = ChannelStore(output_dir)
+    try:
+        cutoff = cutoff_date(hours_history)
+        pacer = AdaptivePacer()
+        fetch_slots = asyncio.Semaphore(max(1, fetch_concurrency))
+        fetch_seconds = {}
+
+        async def fetch_channel(channel):
+            async with fetch_slots:
+                started = time.monotonic()
+                try:
+                    await update_channel_archive(store, channel, hours_history,
+                                                 None if output_as_text else media_folder, rebuild_window, pacer)
+                    return True
+                except Exception as e:
+                    logging.error(f"Error fetching messages from {channel}: {e}")
+                    return False
+                finally:
+                    fetch_seconds[channel] = time.monotonic() - started
+
+        fetched = await asyncio.gather(*(fetch_channel(c) for c in channels))
+        channel_fetch = {}
+        for channel in channels:
+            counters = pacer.stats()['channels'].get(channel, {})
+            seconds = fetch_seconds[channel]
+            channel_fetch[channel] = {
+                'messages_fetched': counters.get('messages', 0),
+                'requests': counters.get('requests', 0),
+                'flood_waits': counters.get('flood_waits', 0),
+                'seconds': round(seconds, 2),
+                'messages_per_second': round(counters.get('messages', 0) / seconds, 1) if seconds else 0.0,
+            }
+            logging.info(f"Channel {channel}: {channel_fetch[channel]['messages_fetched']} fetched in "
+                         f"{channel_fetch[channel]['requests']} requests, {seconds:.1f}s, "
+                         f"{channel_fetch[channel]['messages_per_second']} msg/s")
+
+        # Merge the channels' stored windows in chronological order (oldest to newest); each
+        # channel's store is already sorted, so this is a k-way merge reading one record per channel
+        def window(channel):
+            return (record for record in store.records(channel) if record['date'] >= cutoff)
+
+        merged = heapq.merge(*(window(channel) for channel, ok in zip(channels, fetched) if ok),
+                             key=lambda record: record['date'])
+
+        # Message and unique sender counts are taken as the writer consumes the stream
+        total_messages = 0
+        channel_stats = {channel: 0 for channel in channels}
+        unique_senders = set()
+        unique_senders_per_channel = {channel: set() for channel in channels}
+
+        def counted(records):
+            nonlocal total_messages
+            for msg in records:
+                channel_name = msg['channel']
+                total_messages += 1
+                channel_stats[channel_name] += 1
+
+                if msg['sender_id'] is not None:
+                    username = sender_name(msg, store.senders)
+                    sender_id = username if username else str(msg['sender_id'])
+                else:
+                    sender_id = "System"
+                unique_senders.add(sender_id)
                 unique_senders_per_channel[channel_name].add(sender_id)
+                yield msg
+
+        # Write combined output
+        if output_as_text:
+            await write_combined_text_history(counted(merged), output_text_file, channels, hours_history,
+                                              store.senders, store.replies)
         else:
-            unique_senders.add("System")
-            if channel_name in unique_senders_per_channel:
-                unique_senders_per_channel[channel_name].add("System")
-    
-    # Prepare summary statistics
-    stats = {
-        'total_messages': len(all_messages),
-        'total_unique_senders': len(unique_senders),
-        'hours_fetched': hours_history,
-        'channels_processed': channels,
-        'channel_message_counts': channel_stats,
-        'unique_senders_per_channel': {k: len(v) for k, v in unique_senders_per_channel.items()}
-    }
-    
+            await write_combined_html_history(counted(merged), output_html_file, channels, hours_history,
+                                              media_folder, store.senders, store.replies)
+
+        logging.info(f"Total messages collected: {total_messages}")
+
+        # Prepare summary statistics
+        stats = {
+            'total_messages': total_messages,
+            'total_unique_senders': len(unique_senders),
+            'hours_fetched': hours_history,
+            'channels_processed': channels,
+            'channel_message_counts': channel_stats,
+            'unique_senders_per_channel': {k: len(v) for k, v in unique_senders_per_channel.items()},
+            'channel_fetch': channel_fetch,
+            'request_interval': pacer.stats()['interval'],
+            'sender_cache': store.senders.stats(),
+            'reply_index': store.replies.stats(),
+        }
+    finally:
+        try:
+            store.senders.save()
+        except OSError as e:
+            logging.warning(f"Could not save sender cache: {e}")
+        try:
+            store.replies.prune()
+            store.replies.close()
+        finally:
+            lock.release()
+
     # Log summary
     logging.info(f"Archive complete! Summary:")
     logging.info(f"  Total messages: {stats['total_messages']}")
     logging.info(f"  Total unique senders: {stats['total_unique_senders']}")
     logging.info(f"  Channels processed: {len(channels)}")
+    logging.info(f"  Sender lookups: {stats['sender_cache']['lookups']} "
+                 f"({stats['sender_cache']['size']} senders cached, "
+                 f"{stats['sender_cache']['skipped']} skipped as recently unresolvable)")
+    logging.info(f"  Reply context: {stats['reply_index']['hits']} replies resolved, "
+                 f"{stats['reply_index']['misses']} unknown, {stats['reply_index']['parents_fetched']} parents fetched")
     for channel, count in channel_stats.items():
         unique_count = stats['unique_senders_per_channel'].get(channel, 0)
-        logging.info(f"    {channel}: {count} messages, {unique_count} unique senders")
+        fetch = channel_fetch[channel]
+        logging.info(f"    {channel}: {count} messages, {unique_count} unique senders, "
+                     f"fetched at {fetch['messages_per_second']} msg/s ({fetch['flood_waits']} flood waits)")
     
     return stats
 
-async def main():
+async def main(rebuild_window=False):
     """Default main function for backward compatibility"""
-    stats = await archive_channels()
+    stats = await archive_channels(rebuild_window=rebuild_window)
     print(f"\nArchive Summary:")
     print(f"Total messages: {stats['total_messages']}")
     print(f"Total unique senders: {stats['total_unique_senders']}")
@@ -320,5 +620,9 @@ async def main():
 
 # Run the client until complete
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive recent Telegram channel history")
+    parser.add_argument('--rebuild-window', action='store_true',
+                        help="ignore the per-channel checkpoints and refetch the whole window")
+    args = parser.parse_args()
     with client:
-        client.loop.run_until_complete(main())
+        client.loop.run_until_complete(main(args.rebuild_window))
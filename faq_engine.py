@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+FAQ Answer Engine
+The async FAQ answer path shared by the Telegram and Discord bots: the versioned
+multi-source FAQ corpus and its refreshes, the precomputed answer table, the
+answer cache, single-flight coalescing, optional micro-batching and the
+concurrency-limited, prompt-cache-friendly OpenAI call. Front-ends call
+find_faq_answer() and start periodic_faq_refresh() / faq_corpus.watch_local_files()
+on their own event loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import traceback
+
+from dotenv import load_dotenv
+from openai import OpenAIError
+
+from answer_cache import AnswerCache, normalize_question  # Cache of answers to repeated questions
+from faq_answer_table import AnswerTableStore  # Precomputed answers to the most asked questions
+from faq_snapshot import FaqCorpus  # Versioned FAQ snapshots with retrieval index and file watching
+from faq_streaming import AnswerStreamParser  # Streaming answers
+from llm_client import connection_stats, get_async_openai_client, llm_model, record_usage, usage_stats  # Shared pooled OpenAI client
+from metrics import FAQ_REFRESH_DURATION, record_faq_snapshot, record_topic_match, track_openai
+from micro_batch import MicroBatcher  # Batches distinct questions into one completion
+from single_flight import SingleFlight  # Coalesces identical in-flight requests
+from topic_filter import avoidance_reply  # Local banned-topic matching
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Maximum number of OpenAI requests in flight at once, across all chats
+FAQ_MAX_CONCURRENCY = int(os.getenv('FAQ_MAX_CONCURRENCY', '8'))
+
+# Precomputed answer table mined from archive/channel_history.txt (FAQ_ANSWER_TABLE=0 disables it)
+FAQ_ANSWER_TABLE = os.getenv('FAQ_ANSWER_TABLE', '1') == '1'
+
+# Optional micro-batching: distinct questions arriving within a short window share one completion
+FAQ_BATCHING = os.getenv('FAQ_BATCHING', '0') == '1'
+FAQ_BATCH_WINDOW = float(os.getenv('FAQ_BATCH_WINDOW_MS', '150')) / 1000
+FAQ_BATCH_MAX_SIZE = int(os.getenv('FAQ_BATCH_MAX_SIZE', '8'))
+
+# FAQ corpus: an immutable, versioned snapshot that is swapped in atomically on refresh
+faq_corpus = FaqCorpus()
+answer_cache = AnswerCache()
+
+# Cached answers are only valid for the corpus they were generated from
+faq_corpus.add_listener(lambda snapshot: answer_cache.set_corpus_hash(snapshot.corpus_hash))
+faq_corpus.add_listener(record_faq_snapshot)
+
+# Identical questions arriving together share one upstream call
+faq_flight = SingleFlight("FAQ answers")
+
+# Function to refresh FAQ content (only sources whose content changed are re-indexed)
+async def refresh_faq_content(fetch_remote=True, cached_only=False):
+    started = time.monotonic()
+    try:
+        snapshot = await faq_corpus.refresh(fetch_remote=fetch_remote, cached_only=cached_only)
+        FAQ_REFRESH_DURATION.labels('ok').observe(time.monotonic() - started)
+        if snapshot.remote_sources:
+            logging.info(f"FAQ content refreshed: snapshot v{snapshot.version} combines remote sources and local files")
+        else:
+            reason = "no remote source is cached yet" if cached_only else "remote fetch failed"
+            logging.warning(f"FAQ content refreshed: snapshot v{snapshot.version} uses only local FAQ content as {reason}")
+    except Exception as e:
+        FAQ_REFRESH_DURATION.labels('error').observe(time.monotonic() - started)
+        logging.error(f"Error refreshing FAQ content: {e}")
+
+# Async function to periodically refresh FAQ content
+async def periodic_faq_refresh():
+    while True:
+        try:
+            await asyncio.sleep(3600)  # Wait 1 hour (3600 seconds)
+            logging.info("Starting periodic FAQ content refresh...")
+            await refresh_faq_content()
+        except Exception as e:
+            logging.error(f"Error in periodic FAQ refresh: {e}")
+
+# Concurrency limit shared by all FAQ requests
+openai_semaphore = asyncio.Semaphore(FAQ_MAX_CONCURRENCY)
+
+# Static FAQ instructions. Keep this byte-for-byte stable: it is the shared prefix
+# that lets OpenAI serve repeated prompts from its prompt cache
+FAQ_SYSTEM_PROMPT = """Search the FAQ below for the answer to the user's question.
+Avoid mentioning banned topics.
+If you can't find the answer, use your knowledge of cryptocurrency and blockchain to provide a relevant answer.
+If you do not know the answer with certainty, tell the user that their question will be forwarded to support staff for answering.
+If the questions seems missing, remind the user that the format for interacting with you is '/faq <type your question inline>'. Give an example, e.g., /faq What is Tari Universe?
+Answer in JSON format: {'answer': '<answer>'}"""
+
+# Function to query OpenAI GPT-4o and handle any API errors
+# With on_text, the answer is streamed and on_text(answer_so_far) is awaited as it grows
+async def query_openai_gpt(system, faq_avoidance_text, prompt, on_text=None):
+
+    # Layout for provider-side prompt caching: the static instructions come first, then the
+    # rarely changing avoidance list, then the FAQ context; only the user message varies per question
+    system = FAQ_SYSTEM_PROMPT + "\n\nDo not talk about the following topics:\n" + faq_avoidance_text + \
+             "\n\nFAQ:\n\n" + system
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": prompt}
+    ]
+    try:
+        openai_client = get_async_openai_client()
+        async with openai_semaphore:
+            with track_openai("faq"):
+                if on_text is None:
+                    response = await openai_client.chat.completions.create(
+                        model=llm_model("gpt-4o"),  # gpt-3.5-turbo
+                        response_format={"type": "json_object"},
+                        temperature=0.3,
+                        messages=messages,
+                        timeout=60,
+                    )
+                    record_usage("faq", response.usage)
+                    result = response.choices[0].message.content
+                else:
+                    stream = await openai_client.chat.completions.create(
+                        model=llm_model("gpt-4o"),
+                        response_format={"type": "json_object"},
+                        temperature=0.3,
+                        messages=messages,
+                        timeout=60,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    parser = AnswerStreamParser()
+                    parts = []
+                    async for chunk in stream:
+                        if chunk.usage:
+                            record_usage("faq", chunk.usage)
+                        if not chunk.choices or not chunk.choices[0].delta.content:
+                            continue
+                        parts.append(chunk.choices[0].delta.content)
+                        if parser.feed(chunk.choices[0].delta.content):
+                            await on_text(parser.text)
+                    result = "".join(parts)
+        logging.info(f"OpenAI response: {result}")
+        return result
+
+    except OpenAIError as e:  # Handle OpenAI API errors
+        error_info = {
+            "message": str(e),
+            "type": type(e).__name__,
+            "traceback": traceback.format_exc(),
+        }
+        logging.error(f"OpenAI error: {error_info}")
+        return """
+        {'answer': 'Sorry, I encountered an error while trying to answer your question. Please try again.'}
+        """
+
+# Function to search the FAQ for relevant information using GPT-4o
+async def find_faq_answer(question, on_text=None):
+    # Read one snapshot up front so a concurrent refresh can't mix two corpus versions
+    snapshot = faq_corpus.current
+
+    # Questions about banned topics get a canned reply without an API call
+    banned_topic = snapshot.topic_filter.match(question)
+    if banned_topic is not None:
+        record_topic_match(banned_topic)
+        logging.info(f"Question matches banned topic '{banned_topic}', not answering")
+        return avoidance_reply(banned_topic)
+
+    # The most common questions from the channel archive have precomputed answers
+    table_answer = answer_table.lookup(question, snapshot)
+    if table_answer is not None:
+        logging.info(f"FAQ answer served from answer table: {table_answer}")
+        return table_answer
+
+    # Repeated (or nearly identical) questions are answered from the cache
+    cached_answer = answer_cache.get(question)
+    if cached_answer is not None:
+        logging.info(f"FAQ answer served from cache: {cached_answer}")
+        return cached_answer
+
+    # Concurrent copies of the same question against the same corpus await one completion
+    flight_key = (normalize_question(question), snapshot.version)
+    # (callers that join an in-flight question get the final answer, not the stream)
+    return await faq_flight.do(flight_key, lambda: generate_faq_answer(question, snapshot, on_text))
+
+# Function to generate an answer with GPT-4o against a snapshot (bypasses the cache)
+async def generate_faq_answer(question, snapshot, on_text=None):
+    # Distinct questions arriving together share one completion (streamed answers go alone)
+    if FAQ_BATCHING and on_text is None:
+        return await faq_batcher.submit((question, snapshot), key=snapshot.version)
+    return await answer_from_snapshot(question, snapshot, on_text)
+
+# Function to answer one question against a given FAQ snapshot
+async def answer_from_snapshot(question, snapshot, on_text=None):
+    try:
+        answer = await request_faq_answer(question, snapshot, on_text)
+    except json.JSONDecodeError as e:
+        logging.error(f"Error decoding JSON response: {e}")
+        return "There was an error processing your request."
+
+    if answer:
+        logging.info(f"FAQ answer found: {answer}")
+        # Don't cache answers generated from a snapshot that was replaced meanwhile
+        if faq_corpus.current is snapshot:
+            answer_cache.put(question, answer)
+    return answer
+
+# Function to ask GPT-4o for one answer against a snapshot (raises JSONDecodeError on a malformed reply)
+async def request_faq_answer(question, snapshot, on_text=None):
+    # Create the prompt to send to GPT-4o; the question is the only per-request part
+    prompt = "Question: %s" % question
+
+    # Send only the FAQ sections relevant to the question; fall back to the
+    # full corpus when retrieval finds nothing (e.g. non-English questions)
+    faq_context = snapshot.index.build_context(question)
+    if faq_context is None:
+        logging.info("FAQ retrieval found no matching sections, using full FAQ content")
+        faq_context = snapshot.index.build_full_context()
+
+    # Get the response from OpenAI GPT-4o
+    answer = await query_openai_gpt(faq_context, snapshot.faq_avoidance_text, prompt, on_text)
+    if answer:
+        # get json object from the answer
+        answer = json.loads(answer)['answer']
+    return answer
+
+# Instructions for a batch of questions; they go in the user message so the
+# system prompt stays identical to the single-question one (and prompt-cacheable)
+FAQ_BATCH_INSTRUCTIONS = """Answer each of the following questions separately, following the instructions above for every one.
+Answer in JSON format: {'answers': [{'id': <question id>, 'answer': '<answer>'}, ...]} with one entry per question."""
+
+# Function to answer several questions against one snapshot with a single completion.
+# Returns one answer per question, or None for questions that must be answered on their own
+async def answer_faq_batch(items):
+    questions = [question for question, _ in items]
+    snapshot = items[0][1]
+
+    # Questions without any matching section need the full corpus: answer those alone
+    matched = [i for i, question in enumerate(questions) if snapshot.index.search(question, 1)]
+    if len(matched) < 2:
+        return [None] * len(items)
+
+    faq_context = snapshot.index.build_batch_context([questions[i] for i in matched])
+    numbered = [{"id": n + 1, "question": questions[i]} for n, i in enumerate(matched)]
+    prompt = FAQ_BATCH_INSTRUCTIONS + "\n\nQuestions: " + json.dumps(numbered, ensure_ascii=False)
+    logging.info(f"Answering {len(matched)} FAQ questions in one batch")
+
+    raw = await query_openai_gpt(faq_context, snapshot.faq_avoidance_text, prompt)
+    answers = {}
+    for entry in json.loads(raw)['answers']:
+        if isinstance(entry, dict) and entry.get('answer'):
+            answers[int(entry['id'])] = entry['answer']
+
+    results = [None] * len(items)
+    for n, i in enumerate(matched):
+        answer = answers.get(n + 1)
+        if answer is None:
+            continue
+        results[i] = answer
+        logging.info(f"FAQ answer found (batched): {answer}")
+        if faq_corpus.current is snapshot:
+            answer_cache.put(questions[i], answer)
+    return results
+
+# Answers to the questions asked most in the channel archive, rebuilt whenever the corpus changes
+answer_table = AnswerTableStore(request_faq_answer)
+if FAQ_ANSWER_TABLE:
+    faq_corpus.add_listener(answer_table.schedule_rebuild)
+
+faq_batcher = MicroBatcher("FAQ batching", answer_faq_batch,
+                           lambda item: answer_from_snapshot(*item),
+                           window=FAQ_BATCH_WINDOW, max_size=FAQ_BATCH_MAX_SIZE)
+
+# Counters of this process's answer path (with FAQ_WORKERS the bot adds its workers', see answer_workers)
+def engine_stats():
+    return {
+        'answer_cache': answer_cache.stats(),
+        'faq_flight': faq_flight.stats(),
+        'answer_table': answer_table.stats(),
+        'faq_batcher': faq_batcher.stats(),
+        'llm_usage': usage_stats(),
+        'llm_connections': connection_stats(),
+    }
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+FAQ Replay Benchmark
+Replays the real /faq questions from the channel archive through the bot's actual
+`handler` with fake Telethon events, against the local fake LLM server, at a
+configurable arrival rate. Writes a JSON report (latency percentiles, throughput,
+tokens per answer, event-loop lag, cache/coalescing/queue counters) so regressions
+in prompt size or concurrency show up before deploy.
+
+    python faq_replay_benchmark.py --rate 5 --count 200 --latency lognormal:800,0.4
+    python faq_replay_benchmark.py --rate 0 --count 100 --batching --output before.json
+
+With --workers N, answers come from N answer worker processes; their token usage
+and cache counters stay in the workers, so compare the fake_server counts instead.
+
+Feature flags (--streaming, --batching) and any FAQ_* / ADMISSION_* environment
+variables are applied before the bot is imported, exactly as in production.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+from faq_answer_table import ARCHIVE_FILE, FAQ_COMMAND_PATTERN, read_archive_messages
+
+LOOP_LAG_INTERVAL = 0.01           # Seconds between event-loop lag probes
+REPORT_FILE = os.path.join(BASE_DIR, 'faq_replay_report.json')
+
+
+def load_archived_questions(path=ARCHIVE_FILE):
+    """(user, message text) for every /faq, /ask or /faqqer command in the archive"""
+    questions = []
+    for user, text in read_archive_messages(path):
+        match = FAQ_COMMAND_PATTERN.match(text)
+        # Hash rate requests post to the group chats instead of replying; leave them out
+        if match and match.group(1).lower().strip() not in ("hash rates", "hashrates", "hash rate"):
+            questions.append((user, text))
+    return questions
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def at(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 2),
+        'p50': at(0.50),
+        'p95': at(0.95),
+        'p99': at(0.99),
+        'max': round(ordered[-1], 2),
+    }
+
+
+class FakeMessage:
+    """Stands in for a Telethon message: records when it was sent and edited"""
+
+    def __init__(self, text, on_change):
+        self.text = text
+        self._on_change = on_change
+
+    async def edit(self, text):
+        self.text = text
+        self._on_change(self)
+        return self
+
+
+class FakeEvent:
+    """The parts of a Telethon NewMessage event that the FAQ handler uses"""
+
+    def __init__(self, text, sender_id, chat_id):
+        self.message = FakeMessage(text, lambda message: None)
+        self.sender_id = sender_id
+        self.chat_id = chat_id
+        self.received_at = None
+        self.first_reply_at = None
+        self.last_reply_at = None
+        self.replies = []
+
+    def _touch(self, message):
+        now = time.monotonic()
+        if self.first_reply_at is None:
+            self.first_reply_at = now
+        self.last_reply_at = now
+
+    async def reply(self, text):
+        message = FakeMessage(text, self._touch)
+        self.replies.append(message)
+        self._touch(message)
+        return message
+
+
+async def measure_loop_lag(samples, stop):
+    """Record how late the event loop wakes up from a short sleep (ms)"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        samples.append((time.perf_counter() - started - LOOP_LAG_INTERVAL) * 1000)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run_benchmark(args):
+    # The bot and the archiver create Telethon .session files in the working
+    # directory on import; keep them out of the checkout
+    os.environ.setdefault('TELEGRAM_API_ID', '1')
+    os.environ.setdefault('TELEGRAM_API_HASH', 'benchmark')
+    os.environ['FAQ_ANSWER_TABLE'] = '1' if args.answer_table else '0'
+    if args.streaming:
+        os.environ['FAQ_STREAMING'] = '1'
+        os.environ.setdefault('FAQ_STREAM_EDIT_INTERVAL', '0.2')
+    if args.batching:
+        os.environ['FAQ_BATCHING'] = '1'
+    os.chdir(tempfile.mkdtemp(prefix='faq-bench-'))
+
+    import llm_client
+    from fake_llm_server import start_fake_llm_server
+
+    server = start_fake_llm_server(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                   error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                   seed=args.seed)
+    llm_client.set_backend(llm_client.LlmBackend('fake', server.base_url, 'benchmark', None))
+    # Answer worker processes pick the backend up from the environment
+    os.environ['LLM_BACKEND'] = 'fake'
+    os.environ['FAKE_LLM_URL'] = server.base_url
+
+    import answer_workers
+    import faqqer_bot
+    from token_budget import token_stats
+
+    await faqqer_bot.refresh_faq_content(fetch_remote=not args.offline)
+    if args.workers:
+        await answer_workers.start_answer_workers(args.workers)
+    snapshot = faqqer_bot.faq_corpus.current
+
+    archived = load_archived_questions(args.archive)
+    if not archived:
+        raise SystemExit(f"No /faq questions found in {args.archive}")
+    rng = random.Random(args.seed)
+    plan = [archived[i % len(archived)] for i in range(args.count)]
+    if args.shuffle:
+        rng.shuffle(plan)
+
+    lag_samples = []
+    stop_lag = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples, stop_lag))
+    faqqer_bot.loop_watchdog.start()
+
+    events = []
+    tasks = []
+    started = time.monotonic()
+    for i, (user, text) in enumerate(plan):
+        # Many archived questions have no username, so spread them over synthetic
+        # senders; otherwise the per-user rate limit would dominate the run
+        sender_id = zlib.crc32(f"{user}:{i % args.users}".encode('utf-8'))
+        chat_id = -1000 - sender_id % args.chats
+        event = FakeEvent(text, sender_id, chat_id)
+        event.received_at = time.monotonic()
+        events.append(event)
+        tasks.append(asyncio.create_task(faqqer_bot.handler(event)))
+        if args.rate > 0:
+            await asyncio.sleep(rng.expovariate(args.rate))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    wall_time = time.monotonic() - started
+
+    stop_lag.set()
+    await lag_task
+    faqqer_bot.loop_watchdog.stop()
+    workers = answer_workers.worker_stats()
+    await answer_workers.stop_answer_workers()
+    server.shutdown()
+
+    busy_texts = ("⏳",)
+    latencies, first_reply, errors, rejected, answered = [], [], 0, 0, 0
+    for event, result in zip(events, results):
+        if isinstance(result, Exception):
+            errors += 1
+            logging.error(f"Handler failed: {type(result).__name__}: {result}")
+            continue
+        if not event.replies:
+            rejected += 1      # Silently shed (rate limited user already notified)
+            continue
+        if event.replies[-1].text.startswith(busy_texts):
+            rejected += 1
+            continue
+        answered += 1
+        latencies.append((event.last_reply_at - event.received_at) * 1000)
+        first_reply.append((event.first_reply_at - event.received_at) * 1000)
+
+    usage = llm_client.usage_stats().get('faq', {})
+    completions = usage.get('requests', 0)
+    report = {
+        'benchmark': 'faq_replay',
+        'revision': git_revision(),
+        'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+        'config': {
+            'count': args.count,
+            'arrival_rate': args.rate or 'burst',
+            'users': args.users,
+            'chats': args.chats,
+            'latency': args.latency,
+            'tokens_per_second': args.tokens_per_second,
+            'error_rate': args.error_rate,
+            'rate_limit_rate': args.rate_limit_rate,
+            'streaming': faqqer_bot.FAQ_STREAMING,
+            'batching': faqqer_bot.FAQ_BATCHING,
+            'answer_table': args.answer_table,
+            'max_concurrency': faqqer_bot.FAQ_MAX_CONCURRENCY,
+            'workers': args.workers,
+            'tokenizer': token_stats()['encoding'],
+            'snapshot_version': snapshot.version,
+            'snapshot_sections': len(snapshot.index),
+            'archived_questions': len(archived),
+        },
+        'requests': {
+            'sent': len(events),
+            'answered': answered,
+            'rejected': rejected,
+            'errors': errors,
+        },
+        'latency_ms': percentiles(latencies),
+        'first_reply_ms': percentiles(first_reply),
+        'throughput': {
+            'wall_time_s': round(wall_time, 3),
+            'answers_per_s': round(answered / wall_time, 2) if wall_time else None,
+        },
+        'tokens': {
+            'completions': completions,
+            'prompt_tokens': usage.get('prompt_tokens', 0),
+            'cached_tokens': usage.get('cached_tokens', 0),
+            'completion_tokens': usage.get('completion_tokens', 0),
+            'prompt_tokens_per_answer': round(usage.get('prompt_tokens', 0) / answered, 1) if answered else None,
+            'completion_tokens_per_answer': round(usage.get('completion_tokens', 0) / answered, 1) if answered else None,
+            'prompt_tokens_per_completion': round(usage.get('prompt_tokens', 0) / completions, 1) if completions else None,
+        },
+        'event_loop_lag_ms': percentiles(lag_samples),
+        'event_loop_stalls': faqqer_bot.loop_watchdog.stats(),
+        'answer_cache': faqqer_bot.answer_cache.stats(),
+        'coalescing': faqqer_bot.faq_flight.stats(),
+        'batching': faqqer_bot.faq_batcher.stats(),
+        'admission': faqqer_bot.admission.stats(),
+        'workers': workers,
+        'connections': llm_client.connection_stats(),
+        'fake_server': dict(server.state.counts),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay archived /faq questions through the bot's handler")
+    parser.add_argument('--archive', default=ARCHIVE_FILE, help="archiver text export to take questions from")
+    parser.add_argument('--count', type=int, default=100, help="questions to send (archived questions are cycled)")
+    parser.add_argument('--rate', type=float, default=5.0, help="mean arrivals per second (Poisson); 0 sends all at once")
+    parser.add_argument('--users', type=int, default=50, help="number of distinct senders the questions come from")
+    parser.add_argument('--chats', type=int, default=3, help="number of chats the questions are spread over")
+    parser.add_argument('--shuffle', action='store_true', help="shuffle the archived questions")
+    parser.add_argument('--latency', default='lognormal:600,0.4', help="fake LLM time to first token (see fake_llm_server.py)")
+    parser.add_argument('--tokens-per-second', type=float, default=60)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--streaming', action='store_true', help="benchmark with FAQ_STREAMING=1")
+    parser.add_argument('--batching', action='store_true', help="benchmark with FAQ_BATCHING=1")
+    parser.add_argument('--workers', type=int, default=0, help="answer in this many worker processes (FAQ_WORKERS)")
+    parser.add_argument('--answer-table', action='store_true', help="also build and use the precomputed answer table")
+    parser.add_argument('--offline', action='store_true', help="don't fetch remote FAQ sources (use the on-disk cache)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=REPORT_FILE, help="where to write the JSON report")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run_benchmark_quietly(args))
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    latency = report['latency_ms']
+    print(f"{report['requests']['answered']}/{report['requests']['sent']} answered in "
+          f"{report['throughput']['wall_time_s']}s ({report['throughput']['answers_per_s']}/s); "
+          f"latency p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms; "
+          f"{report['tokens']['prompt_tokens_per_answer']} prompt tokens per answer; "
+          f"loop lag p99 {report['event_loop_lag_ms'].get('p99')} ms")
+    print(f"Report written to {output}")
+
+
+async def run_benchmark_quietly(args):
+    # The bot logs every answer at INFO; that would dominate the loop lag being measured
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+    return await run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
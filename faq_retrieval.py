@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+FAQ Retrieval
+Splits the combined FAQ corpus into sections and ranks them against a question with BM25,
+so only the most relevant sections need to be sent to OpenAI.
+"""
+
+import logging
+import math
+import re
+from collections import Counter
+
+from token_budget import count_tokens, take_within_budget
+
+# Retrieval settings
+RETRIEVAL_TOP_K = 6                 # Max sections sent to the model per question
+FAQ_CONTEXT_TOKEN_BUDGET = 3000     # Tokens of retrieved sections per question
+FAQ_FALLBACK_TOKEN_BUDGET = 12000   # Tokens of corpus sent when nothing matches
+FAQ_BATCH_TOKEN_BUDGET = 6000       # Tokens of retrieved sections shared by a batch of questions
+MAX_SECTION_CHARS = 1500            # Sections longer than this are split on paragraph boundaries
+MIN_SECTION_CHARS = 40              # Tiny fragments (separators, lone headings) are merged forward
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Header written by fetch_remote_faq_content in front of every source
+SOURCE_HEADER_PATTERN = re.compile(r'^=== Content from (.+?) ===$', re.MULTILINE)
+
+# Lines that start a new FAQ section: markdown headings or "Q." style questions
+SECTION_START_PATTERN = re.compile(r'^(#{1,6}\s+\S|Q\.\s*\S)')
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for', 'from',
+    'how', 'i', 'if', 'in', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'so', 'that',
+    'the', 'this', 'to', 'was', 'we', 'what', 'when', 'where', 'which', 'who', 'why',
+    'will', 'with', 'you', 'your',
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed and a naive plural strip"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def split_sources(corpus):
+    """
+    Split the combined corpus back into (source_name, text) pairs using the
+    "=== Content from ... ===" headers. Text before the first header is attributed to "faq".
+    """
+    sources = []
+    matches = list(SOURCE_HEADER_PATTERN.finditer(corpus))
+    if not matches:
+        return [("faq", corpus)]
+
+    if corpus[:matches[0].start()].strip():
+        sources.append(("faq", corpus[:matches[0].start()]))
+
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(corpus)
+        sources.append((match.group(1).strip(), corpus[match.end():end]))
+    return sources
+
+
+def _split_long_section(text):
+    """Split an oversized section on blank lines, keeping chunks under MAX_SECTION_CHARS"""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r'\n\s*\n', text):
+        if current and len(current) + len(paragraph) + 2 > MAX_SECTION_CHARS:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_sections(text):
+    """Split one FAQ source into sections on headings and "Q." lines"""
+    sections = []
+    current = []
+    for line in text.splitlines():
+        if SECTION_START_PATTERN.match(line) and current:
+            sections.append('\n'.join(current).strip())
+            current = []
+        current.append(line)
+    if current:
+        sections.append('\n'.join(current).strip())
+
+    # Merge tiny fragments into the following section and split oversized ones
+    merged = []
+    carry = ""
+    for section in sections:
+        if not section:
+            continue
+        section = f"{carry}\n\n{section}" if carry else section
+        if len(section) < MIN_SECTION_CHARS:
+            carry = section
+            continue
+        carry = ""
+        if len(section) > MAX_SECTION_CHARS:
+            merged.extend(_split_long_section(section))
+        else:
+            merged.append(section)
+    if carry:
+        if merged:
+            merged[-1] = f"{merged[-1]}\n\n{carry}"
+        else:
+            merged.append(carry)
+    return merged
+
+
+def index_sections(text):
+    """
+    Split one FAQ source into sections and tokenize them.
+    Returns a tuple of (section_text, term_counts, token_count); sections without
+    any indexable words are dropped.
+    """
+    indexed = []
+    for section in split_sections(text):
+        tokens = tokenize(section)
+        if tokens:
+            indexed.append((section, Counter(tokens), len(tokens)))
+    return tuple(indexed)
+
+
+class FaqIndex:
+    """BM25 index over the sections of the FAQ corpus"""
+
+    def __init__(self, corpus=""):
+        sources = [(name, index_sections(text)) for name, text in split_sources(corpus)]
+        self._build(sources, len(corpus))
+
+    @classmethod
+    def from_sources(cls, sources, corpus_chars):
+        """
+        Build an index from already tokenized sources, given as (source_name, index_sections(text))
+        pairs. Lets the caller re-tokenize only the sources that changed.
+        """
+        index = cls.__new__(cls)
+        index._build(sources, corpus_chars)
+        return index
+
+    def _build(self, sources, corpus_chars):
+        self.sections = []      # list of (source_name, text)
+        self.term_freqs = []    # Counter per section
+        self.doc_lengths = []
+        self.doc_freqs = Counter()
+        self.avg_doc_length = 0.0
+        self.corpus_chars = corpus_chars
+
+        seen = set()
+        for source_name, indexed_sections in sources:
+            for section, counts, length in indexed_sections:
+                # The local FAQ is appended to the corpus twice; index each section once
+                if section in seen:
+                    continue
+                seen.add(section)
+                self.sections.append((source_name, section))
+                self.term_freqs.append(counts)
+                self.doc_lengths.append(length)
+                self.doc_freqs.update(counts.keys())
+
+        if self.doc_lengths:
+            self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def _idf(self, term):
+        n = len(self.sections)
+        df = self.doc_freqs.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, question, top_k=RETRIEVAL_TOP_K):
+        """Return up to top_k (score, source_name, text) tuples, best match first"""
+        query_terms = set(tokenize(question))
+        if not query_terms or not self.sections:
+            return []
+
+        scores = []
+        for i, counts in enumerate(self.term_freqs):
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[i] / self.avg_doc_length)
+            score = 0.0
+            for term in query_terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self._idf(term) * tf * (BM25_K1 + 1) / (tf + length_norm)
+            if score > 0:
+                scores.append((score, i))
+
+        scores.sort(key=lambda item: item[0], reverse=True)
+        return [(score, *self.sections[i]) for score, i in scores[:top_k]]
+
+    def build_context(self, question, top_k=RETRIEVAL_TOP_K, token_budget=FAQ_CONTEXT_TOKEN_BUDGET):
+        """
+        Build the FAQ context for a question from the best matching sections, adding
+        them in score order until top_k or the token budget is reached.
+        Returns None when nothing matches (e.g. the question is not in English),
+        so the caller can fall back to build_full_context().
+        """
+        results = self.search(question, top_k)
+        if not results:
+            return None
+
+        blocks = {f"[{source}]\n{text}": text for _, source, text in results}
+        return self._fill_context(blocks, token_budget)
+
+    def build_batch_context(self, questions, top_k=RETRIEVAL_TOP_K, token_budget=FAQ_BATCH_TOKEN_BUDGET):
+        """
+        One shared FAQ context for several questions: the union of their best matching
+        sections, taking each question's next-best section in turn so every question
+        gets its top matches before any gets its weaker ones.
+        Returns None when nothing matches any of the questions.
+        """
+        ranked = [self.search(question, top_k) for question in questions]
+        blocks = {}
+        for rank in range(top_k):
+            for results in ranked:
+                if rank < len(results):
+                    _, source, text = results[rank]
+                    blocks.setdefault(f"[{source}]\n{text}", text)
+        if not blocks:
+            return None
+        return self._fill_context(blocks, token_budget)
+
+    def _fill_context(self, blocks, token_budget):
+        """Take {block: section_text} in the given order up to the budget, joined in corpus order"""
+        taken, used = take_within_budget(blocks, token_budget, separator_tokens=count_tokens(CONTEXT_SEPARATOR))
+        if not taken:
+            return None
+
+        # Keep corpus order so related sections read naturally
+        order = {section: i for i, (_, section) in enumerate(self.sections)}
+        taken.sort(key=lambda block: order[blocks[block]])
+
+        context = CONTEXT_SEPARATOR.join(taken)
+        logging.info(f"FAQ retrieval: {len(taken)} of {len(self.sections)} sections, "
+                     f"{used} tokens, {len(context)} of {self.corpus_chars} chars")
+        return context
+
+    def build_full_context(self, token_budget=FAQ_FALLBACK_TOKEN_BUDGET):
+        """All sections in corpus order, up to the token budget"""
+        blocks = [f"[{source}]\n{text}" for source, text in self.sections]
+        taken, used = take_within_budget(blocks, token_budget, separator_tokens=count_tokens(CONTEXT_SEPARATOR))
+        if len(taken) < len(blocks):
+            logging.warning(f"FAQ corpus exceeds the {token_budget} token fallback budget, "
+                            f"sending {len(taken)} of {len(blocks)} sections")
+        return CONTEXT_SEPARATOR.join(taken)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+FAQ Corpus Snapshots
+Holds the FAQ corpus as an immutable, versioned snapshot that is swapped in with a
+single assignment, so a request that grabbed a snapshot never sees a half-updated
+corpus. Rebuilds are incremental: only sources whose content hash changed are
+re-split and re-tokenized. Local files are watched (inotify on Linux, mtime polling
+elsewhere) so edits in faqs/ take effect within seconds.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import glob
+import hashlib
+import logging
+import os
+import struct
+import sys
+
+from faq_retrieval import FaqIndex, index_sections
+from faq_sources import fetch_remote_sources
+from topic_filter import TopicFilter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FAQS_FOLDER = os.path.join(BASE_DIR, 'faqs')
+LOCAL_FAQ_FILE = os.path.join(FAQS_FOLDER, 'faq_prompt.txt')
+AVOIDANCE_FILE = os.path.join(BASE_DIR, 'avoidance_faq_prompt.txt')
+
+# Watch settings
+WATCH_DEBOUNCE_SECONDS = 2.0     # Quiet period after the last change before rebuilding
+WATCH_POLL_INTERVAL = 5.0        # Used when inotify is unavailable
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class FaqSource:
+    """One loaded FAQ source (a .txt file or a fetched .url) with its tokenized sections"""
+
+    __slots__ = ('name', 'kind', 'header', 'text', 'content_hash', 'sections')
+
+    def __init__(self, name, kind, header, text, sections=None):
+        self.name = name
+        self.kind = kind            # 'remote' or 'local'
+        self.header = header
+        self.text = text
+        self.content_hash = content_hash(text)
+        self.sections = sections if sections is not None else index_sections(text)
+
+
+class FaqSnapshot:
+    """Immutable view of the FAQ corpus at one version. Never mutate after construction."""
+
+    def __init__(self, version, remote_sources, local_sources, local_faq_text, faq_avoidance_text):
+        self.version = version
+        self.remote_sources = tuple(remote_sources)
+        self.local_sources = tuple(local_sources)
+        self.local_faq_text = local_faq_text
+        self.faq_avoidance_text = faq_avoidance_text
+
+        sources = self.remote_sources + self.local_sources
+        combined = "".join(f"\n\n{source.header}\n\n{source.text}" for source in sources)
+        self.faq_text = combined + "\n\n" + local_faq_text if combined else local_faq_text
+
+        if sources:
+            self.index = FaqIndex.from_sources([(s.name, s.sections) for s in sources], len(self.faq_text))
+        else:
+            self.index = FaqIndex(self.faq_text)
+
+        self.topic_filter = TopicFilter(faq_avoidance_text)
+        self.corpus_hash = content_hash(self.faq_text + "\0" + faq_avoidance_text)
+
+    @property
+    def sources(self):
+        return self.remote_sources + self.local_sources
+
+
+EMPTY_SNAPSHOT = FaqSnapshot(0, (), (), "", "")
+
+
+class FaqCorpus:
+    """Owns the current FaqSnapshot and rebuilds it when sources change"""
+
+    def __init__(self, faqs_folder=FAQS_FOLDER, local_faq_file=LOCAL_FAQ_FILE, avoidance_file=AVOIDANCE_FILE):
+        self.faqs_folder = faqs_folder
+        self.local_faq_file = local_faq_file
+        self.avoidance_file = avoidance_file
+        self.current = EMPTY_SNAPSHOT
+        self._listeners = []
+        self._refresh_lock = asyncio.Lock()
+
+    def add_listener(self, callback):
+        """Register callback(snapshot), called after every new snapshot is swapped in"""
+        self._listeners.append(callback)
+
+    def _reuse_or_build(self, previous, name, kind, header, text):
+        old = previous.get(name)
+        if old is not None and old.text == text and old.header == header:
+            return old
+        return FaqSource(name, kind, header, text,
+                         sections=old.sections if old is not None and old.text == text else None)
+
+    async def _load_remote_sources(self, previous, cached_only=False):
+        # Sorted so the combined corpus (and therefore the prompt) is byte-identical across runs
+        url_files = sorted(glob.glob(os.path.join(self.faqs_folder, '*.url')))
+        sources = []
+        for url_file, url, body in await fetch_remote_sources(url_files, cached_only):
+            if body is None:
+                continue
+            name = os.path.basename(url_file)
+            sources.append(self._reuse_or_build(previous, name, 'remote',
+                                                f"=== Content from {name} ===", body))
+        return sources
+
+    def _load_local_sources(self, previous):
+        sources = []
+        for txt_file in sorted(glob.glob(os.path.join(self.faqs_folder, '*.txt'))):
+            name = os.path.basename(txt_file)
+            try:
+                with open(txt_file, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            except OSError as e:
+                logging.error(f"Error reading local FAQ file {txt_file}: {e}")
+                continue
+            sources.append(self._reuse_or_build(previous, name, 'local', f"=== Content from {name} ===", text))
+        return sources
+
+    async def refresh(self, fetch_remote=True, cached_only=False):
+        """
+        Rebuild the snapshot from disk (and the network if fetch_remote) and swap it in.
+        cached_only reads remote sources from the on-disk cache another process keeps fresh.
+        Returns the current snapshot; the version only changes if some content changed.
+        """
+        if not os.path.exists(self.faqs_folder):
+            logging.error(f"FAQs folder not found: {self.faqs_folder}")
+            return self.current
+
+        async with self._refresh_lock:
+            current = self.current
+            previous = {source.name: source for source in current.sources}
+
+            if fetch_remote or cached_only:
+                remote_sources = await self._load_remote_sources(previous, cached_only)
+            else:
+                remote_sources = current.remote_sources
+            local_sources = self._load_local_sources(previous)
+
+            with open(self.local_faq_file, 'r', encoding='utf-8') as f:
+                local_faq_text = f.read()
+            with open(self.avoidance_file, 'r', encoding='utf-8') as f:
+                faq_avoidance_text = f.read()
+
+            all_sources = list(remote_sources) + local_sources
+            rebuilt = [s.name for s in all_sources if previous.get(s.name) is not s]
+            logging.info(f"Loaded {len(all_sources)} FAQ sources ({len(remote_sources)} remote, "
+                         f"{len(local_sources)} local); changed: {rebuilt or 'none'}")
+
+            snapshot = FaqSnapshot(current.version + 1, remote_sources, local_sources,
+                                   local_faq_text, faq_avoidance_text)
+            if snapshot.corpus_hash == current.corpus_hash:
+                logging.info(f"FAQ corpus unchanged, keeping snapshot v{current.version}")
+                return current
+
+            # Single reference assignment: readers see either the old or the new snapshot
+            self.current = snapshot
+            logging.info(f"FAQ snapshot v{snapshot.version} active: {len(snapshot.faq_text)} chars, "
+                         f"{len(snapshot.index)} sections")
+
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logging.error(f"Error in FAQ snapshot listener: {e}")
+        return snapshot
+
+    def _watched_paths(self):
+        """Directories to watch and the file names within them that matter"""
+        return {
+            self.faqs_folder: None,  # Every .txt / .url in faqs/
+            os.path.dirname(self.avoidance_file): {os.path.basename(self.avoidance_file)},
+        }
+
+    async def watch_local_files(self, debounce=WATCH_DEBOUNCE_SECONDS):
+        """Watch local FAQ files and rebuild the snapshot shortly after they change"""
+        changed = asyncio.Event()
+        remote_list_changed = False
+
+        def on_change(directory, name):
+            nonlocal remote_list_changed
+            wanted = self._watched_paths().get(directory)
+            if wanted is None and not name.endswith(('.txt', '.url')):
+                return
+            if wanted is not None and name not in wanted:
+                return
+            if name.endswith('.url'):
+                remote_list_changed = True
+            changed.set()
+
+        watcher = _InotifyWatcher.create(list(self._watched_paths()), on_change)
+        if watcher is None:
+            logging.info(f"Watching local FAQ files by polling every {WATCH_POLL_INTERVAL}s")
+            poller = asyncio.create_task(self._poll_local_files(on_change))
+        else:
+            logging.info("Watching local FAQ files with inotify")
+            poller = None
+
+        try:
+            while True:
+                await changed.wait()
+                changed.clear()
+                # Debounce: editors often write a file several times in quick succession
+                while True:
+                    try:
+                        await asyncio.wait_for(changed.wait(), debounce)
+                        changed.clear()
+                    except asyncio.TimeoutError:
+                        break
+                fetch_remote = remote_list_changed
+                remote_list_changed = False
+                logging.info("Local FAQ files changed, rebuilding FAQ snapshot")
+                try:
+                    await self.refresh(fetch_remote=fetch_remote)
+                except Exception as e:
+                    logging.error(f"Error rebuilding FAQ snapshot after file change: {e}")
+        finally:
+            if watcher is not None:
+                watcher.close()
+            if poller is not None:
+                poller.cancel()
+
+    async def _poll_local_files(self, on_change):
+        def scan():
+            mtimes = {}
+            for directory in self._watched_paths():
+                try:
+                    names = os.listdir(directory)
+                except OSError:
+                    continue
+                for name in names:
+                    try:
+                        mtimes[(directory, name)] = os.stat(os.path.join(directory, name)).st_mtime_ns
+                    except OSError:
+                        pass
+            return mtimes
+
+        last = scan()
+        while True:
+            await asyncio.sleep(WATCH_POLL_INTERVAL)
+            current = scan()
+            for key in set(last) | set(current):
+                if last.get(key) != current.get(key):
+                    on_change(*key)
+            last = current
+
+
+class _InotifyWatcher:
+    """Minimal inotify binding (Linux only) driven by the asyncio event loop"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, libc, fd, loop, on_change):
+        self._libc = libc
+        self._fd = fd
+        self._loop = loop
+        self._on_change = on_change
+        self._watches = {}  # watch descriptor -> directory
+
+    @classmethod
+    def create(cls, directories, on_change):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable: {e}")
+            return None
+        if fd < 0:
+            logging.warning(f"inotify_init1 failed: errno {ctypes.get_errno()}")
+            return None
+
+        watcher = cls(libc, fd, asyncio.get_running_loop(), on_change)
+        for directory in directories:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), cls.WATCH_MASK)
+            if wd < 0:
+                logging.warning(f"Could not watch {directory}: errno {ctypes.get_errno()}")
+                continue
+            watcher._watches[wd] = directory
+        if not watcher._watches:
+            watcher.close()
+            return None
+
+        watcher._loop.add_reader(fd, watcher._read_events)
+        return watcher
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, _mask, _cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += length
+            directory = self._watches.get(wd)
+            if directory is not None and name:
+                self._on_change(directory, name)
+
+    def close(self):
+        try:
+            self._loop.remove_reader(self._fd)
+        except (ValueError, RuntimeError):
+            pass
+        os.close(self._fd)
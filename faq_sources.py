@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Remote FAQ Sources
+Fetches the URLs listed in faqs/*.url concurrently on one async HTTP session.
+Each source is revalidated with ETag / If-Modified-Since against an on-disk cache
+of its last good body, so unchanged sources cost a 304 and a dead source falls
+back to the cached copy instead of blocking startup or refresh.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+import httpx
+
+# Fetch settings
+REMOTE_FETCH_TIMEOUT = 10        # Seconds allowed per source (connect + read)
+REMOTE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faq_cache')
+
+
+def _cache_paths(url):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    return (os.path.join(REMOTE_CACHE_DIR, f"{key}.body"),
+            os.path.join(REMOTE_CACHE_DIR, f"{key}.json"))
+
+
+def load_cached_source(url):
+    """Return (body, metadata) from the on-disk cache, or (None, {}) if nothing is cached"""
+    body_path, meta_path = _cache_paths(url)
+    try:
+        with open(body_path, 'r', encoding='utf-8') as f:
+            body = f.read()
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return body, meta
+    except (OSError, ValueError):
+        return None, {}
+
+
+def store_cached_source(url, body, response):
+    """Persist the last good body with its validators; written atomically (safe across processes)"""
+    os.makedirs(REMOTE_CACHE_DIR, exist_ok=True)
+    body_path, meta_path = _cache_paths(url)
+    meta = {
+        'url': url,
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified'),
+        'fetched_at': time.time(),
+    }
+    for path, data in ((body_path, body), (meta_path, json.dumps(meta))):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def _is_html(response):
+    content_type = response.headers.get('content-type', '').lower()
+    text = response.text.strip().lower()
+    return 'text/html' in content_type or text.startswith('<!doctype html') or text.startswith('<html')
+
+
+async def fetch_remote_source(session, url):
+    """
+    Fetch one remote source with conditional revalidation.
+    Returns the body text (fresh or cached), or None if nothing usable is available.
+    """
+    cached_body, meta = load_cached_source(url)
+    headers = {}
+    if cached_body is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        # Bound the whole request, not just each connect/read step
+        response = await asyncio.wait_for(session.get(url, headers=headers, timeout=REMOTE_FETCH_TIMEOUT),
+                                          REMOTE_FETCH_TIMEOUT)
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        if cached_body is not None:
+            logging.warning(f"Fetching {url} failed ({type(e).__name__}: {e}), using cached copy")
+            return cached_body
+        logging.error(f"Fetching {url} failed and no cached copy exists: {type(e).__name__}: {e}")
+        return None
+
+    if response.status_code == 304 and cached_body is not None:
+        logging.info(f"FAQ source unchanged (304): {url}")
+        return cached_body
+
+    if response.status_code == 200:
+        # Skip web pages - we want raw FAQ content
+        if _is_html(response):
+            logging.warning(f"Skipping {url} - returns HTML web page instead of raw content")
+            return None
+        logging.info(f"Successfully fetched FAQ from {url}")
+        try:
+            store_cached_source(url, response.text, response)
+        except OSError as e:
+            logging.warning(f"Could not cache FAQ source {url}: {e}")
+        return response.text
+
+    if cached_body is not None:
+        logging.warning(f"Failed to fetch FAQ from {url}: Status code {response.status_code}, using cached copy")
+        return cached_body
+    logging.error(f"Failed to fetch FAQ from {url}: Status code {response.status_code}")
+    return None
+
+
+async def fetch_remote_sources(url_files, cached_only=False):
+    """
+    Fetch every .url file concurrently (with cached_only, read the on-disk cache instead).
+    Returns a list of (url_file, url, body) in the order of url_files; body is None on failure.
+    """
+    sources = []
+    for url_file in url_files:
+        try:
+            with open(url_file, 'r', encoding='utf-8') as f:
+                sources.append((url_file, f.read().strip()))
+        except OSError as e:
+            logging.error(f"Error reading URL file {url_file}: {e}")
+
+    if not sources:
+        return []
+    if cached_only:
+        return [(url_file, url, load_cached_source(url)[0]) for url_file, url in sources]
+
+    async with httpx.AsyncClient(follow_redirects=True) as session:
+        bodies = await asyncio.gather(
+            *(fetch_remote_source(session, url) for _, url in sources),
+            return_exceptions=True,
+        )
+
+    results = []
+    for (url_file, url), body in zip(sources, bodies):
+        if isinstance(body, Exception):
+            logging.error(f"Error processing URL file {url_file}: {body}")
+            body = None
+        results.append((url_file, url, body))
+    return results
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Streaming FAQ Answers
+Helpers for showing an answer while it is still being generated: an incremental
+parser for the {'answer': '...'} JSON wrapper, and a throttled editor that keeps
+updating one placeholder message without tripping Telegram/Discord edit limits.
+Also records time-to-first-visible-text per front-end.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# Streaming settings
+FAQ_STREAMING = os.getenv('FAQ_STREAMING', '0') == '1'                      # Opt-in streaming mode
+STREAM_EDIT_INTERVAL = float(os.getenv('FAQ_STREAM_EDIT_INTERVAL', '1.5'))   # Min seconds between edits of one message
+STREAM_PLACEHOLDER = "💭 Thinking..."
+STREAM_FINAL_RETRY_DELAY = 1.0                                              # Seconds before retrying a failed final edit
+STREAM_FINAL_RETRY_MAX_WAIT = 30.0                                          # Longest flood wait honoured before giving up on editing
+TTFT_SAMPLES = 500                                                          # Recent samples kept per front-end
+
+_ANSWER_KEY_PATTERN = re.compile(r'[\'"]answer[\'"]\s*:\s*([\'"])')
+_SIMPLE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '/': '/', '\\': '\\', '"': '"', "'": "'"}
+
+
+class AnswerStreamParser:
+    """
+    Incrementally extracts the value of the "answer" key from a JSON object that
+    arrives in arbitrary chunks. Escapes split across chunks are held back until complete.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = None        # Index of the next undecoded char of the answer string
+        self._quote = None
+        self._parts = []
+        self.done = False
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def feed(self, chunk):
+        """Add a chunk; returns True if more of the answer was decoded"""
+        self._buffer += chunk
+        if self.done:
+            return False
+
+        if self._pos is None:
+            match = _ANSWER_KEY_PATTERN.search(self._buffer)
+            if not match:
+                return False
+            self._quote = match.group(1)
+            self._pos = match.end()
+
+        before = len(self._parts)
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if char == self._quote:
+                self.done = True
+                i += 1
+                break
+            if char != '\\':
+                self._parts.append(char)
+                i += 1
+                continue
+
+            # Escape sequence: wait for the rest of it if it's split across chunks
+            if i + 1 >= len(buffer):
+                break
+            code = buffer[i + 1]
+            if code != 'u':
+                self._parts.append(_SIMPLE_ESCAPES.get(code, code))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            try:
+                codepoint = int(buffer[i + 2:i + 6], 16)
+            except ValueError:
+                self._parts.append(buffer[i:i + 6])
+                i += 6
+                continue
+            if 0xD800 <= codepoint < 0xDC00:
+                # High surrogate: needs the following \uDCxx low surrogate
+                if i + 12 > len(buffer):
+                    break
+                low = buffer[i + 6:i + 12]
+                if low.startswith('\\u'):
+                    try:
+                        low_codepoint = int(low[2:], 16)
+                    except ValueError:
+                        low_codepoint = 0
+                    if 0xDC00 <= low_codepoint < 0xE000:
+                        combined = 0x10000 + ((codepoint - 0xD800) << 10) + (low_codepoint - 0xDC00)
+                        self._parts.append(chr(combined))
+                        i += 12
+                        continue
+            self._parts.append(chr(codepoint))
+            i += 6
+
+        self._pos = i
+        return len(self._parts) > before
+
+
+class _LatencySamples:
+    """Bounded window of latency samples with simple percentiles"""
+
+    def __init__(self, size=TTFT_SAMPLES):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+        if not samples:
+            return {'count': count, 'p50': None, 'p95': None, 'last': None}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {'count': count, 'p50': percentile(0.50), 'p95': percentile(0.95), 'last': self._samples[-1]}
+
+
+_time_to_first_text = {}
+
+
+def record_time_to_first_text(front_end, seconds):
+    _time_to_first_text.setdefault(front_end, _LatencySamples()).record(seconds)
+    logging.info(f"Time to first visible text ({front_end}): {seconds:.2f}s")
+
+
+def time_to_first_text_stats():
+    """Time-to-first-visible-text percentiles per front-end ('telegram', 'discord')"""
+    return {front_end: samples.stats() for front_end, samples in _time_to_first_text.items()}
+
+
+class ProgressiveEditor:
+    """
+    Edits one placeholder message as the answer grows, at most once per min_interval.
+    `edit` is an async callable taking the new message text; `fallback`, if given, is
+    an async callable that sends the text as a new message when the final edit fails.
+    """
+
+    def __init__(self, edit, front_end, started_at, min_interval=STREAM_EDIT_INTERVAL, fallback=None):
+        self._edit = edit
+        self._fallback = fallback
+        self.front_end = front_end
+        self.started_at = started_at
+        self.min_interval = min_interval
+        self._last_edit_at = 0.0
+        self._shown = ""
+        self._first_text_recorded = False
+
+    def _mark_shown(self, text):
+        self._shown = text
+        self._last_edit_at = time.monotonic()
+        if not self._first_text_recorded:
+            self._first_text_recorded = True
+            record_time_to_first_text(self.front_end, self._last_edit_at - self.started_at)
+
+    async def _apply(self, text):
+        """Show text in the placeholder; returns the exception if the edit failed"""
+        if not text.strip() or text == self._shown:
+            return None
+        try:
+            await self._edit(text)
+        except Exception as e:
+            # Rate limited or message gone: keep streaming, finish() retries the final text
+            logging.warning(f"Streaming edit failed ({self.front_end}): {type(e).__name__}: {e}")
+            return e
+        self._mark_shown(text)
+        return None
+
+    async def update(self, text):
+        """Show partial text if enough time has passed since the last edit"""
+        if time.monotonic() - self._last_edit_at >= self.min_interval:
+            await self._apply(text + " ▌")
+
+    async def finish(self, text):
+        """
+        Always show the final text. A failed edit is retried once, after the flood wait
+        the server asked for (Telethon's FloodWaitError.seconds, capped); if that fails
+        too, the text is sent as a new message through fallback.
+        """
+        error = await self._apply(text)
+        if error is None:
+            return
+        await asyncio.sleep(min(getattr(error, 'seconds', None) or STREAM_FINAL_RETRY_DELAY,
+                                STREAM_FINAL_RETRY_MAX_WAIT))
+        if await self._apply(text) is None or self._fallback is None:
+            return
+        try:
+            await self._fallback(text)
+        except Exception as e:
+            logging.error(f"Could not deliver streamed answer ({self.front_end}): {type(e).__name__}: {e}")
+            return
+        self._mark_shown(text)
@@ -1,16 +1,25 @@
 import os
 import re
-import traceback
 import logging
+import time
 from datetime import datetime
 from telethon import TelegramClient, events
-from openai import OpenAI, OpenAIError
-import openai
 from dotenv import load_dotenv
-import json
-import requests
 from blockchain_job import schedule_block_height_job, schedule_hash_power_job  # Import the block height job
 from customer_analysis_job import schedule_customer_analysis_job, manual_analysis_trigger  # Import customer analysis job
+from single_flight import SingleFlight  # Coalesces identical in-flight requests
+from faq_streaming import FAQ_STREAMING, STREAM_PLACEHOLDER, ProgressiveEditor, time_to_first_text_stats  # Streaming answers
+from faq_engine import (  # FAQ answer path shared with the Discord bot
+    FAQ_BATCHING, FAQ_MAX_CONCURRENCY, answer_cache, faq_batcher, faq_corpus, faq_flight,
+    periodic_faq_refresh, refresh_faq_content,
+)
+from answer_workers import (  # Optional answer worker processes
+    WorkerError, answer_stats, run_task, start_answer_workers, stop_answer_workers, worker_stats,
+)
+from token_budget import token_stats  # Tokenizer-based prompt budgets
+from admission_control import AdmissionController, AdmissionRejected, analysis_cost  # Rate limits and load shedding
+from metrics import instrument_command, set_command_outcome, start_metrics_server  # Prometheus /metrics
+from loop_watchdog import LoopWatchdog  # Reports event-loop stalls and the call that blocked
 import asyncio
 from telethon.tl.types import Channel
 
@@ -38,119 +47,20 @@ api_hash = os.getenv('TELEGRAM_API_HASH')  # From Telegram Developer Portal
 # Initialize the Telegram bot client (don't start it yet)
 client = TelegramClient('bot', api_id, api_hash)
 
-# Load the FAQ from the uploaded text file
-faq_file_path = os.path.join('faqs', 'faq_prompt.txt')
-
-# Function to fetch FAQ content from multiple remote sources
-def fetch_remote_faq_content():
-    import os
-    import glob
-    
-    # Path to the FAQs folder
-    faqs_folder = os.path.join(os.path.dirname(__file__), 'faqs')
-    
-    combined_content = ""
-    successful_fetches = 0
-    total_sources = 0
-    
-    if not os.path.exists(faqs_folder):
-        logging.error(f"FAQs folder not found: {faqs_folder}")
-        return None
-    
-    # Process .url files (remote URLs)
-    url_files = glob.glob(os.path.join(faqs_folder, '*.url'))
-    for url_file in url_files:
-        total_sources += 1
-        try:
-            with open(url_file, 'r', encoding='utf-8') as f:
-                url = f.read().strip()
-                
-            logging.info(f"Fetching from URL file {os.path.basename(url_file)}: {url}")
-            response = requests.get(url)
-            
-            if response.status_code == 200:
-                # Check if the content is HTML (indicating web page rather than raw content)
-                content_type = response.headers.get('content-type', '').lower()
-                is_html = 'text/html' in content_type or response.text.strip().startswith('<!doctype html') or response.text.strip().startswith('<html')
-                
-                if is_html:
-                    logging.warning(f"Skipping {url} - returns HTML web page instead of raw content")
-                    continue
-                    
-                logging.info(f"Successfully fetched FAQ from {url}")
-                combined_content += f"\n\n=== Content from {os.path.basename(url_file)} ({url}) ===\n\n"
-                combined_content += response.text
-                successful_fetches += 1
-            else:
-                logging.error(f"Failed to fetch FAQ from {url}: Status code {response.status_code}")
-        except Exception as e:
-            logging.error(f"Error processing URL file {url_file}: {e}")
-    
-    # Process .txt files (local text content)
-    txt_files = glob.glob(os.path.join(faqs_folder, '*.txt'))
-    for txt_file in txt_files:
-        total_sources += 1
-        try:
-            with open(txt_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-            logging.info(f"Successfully loaded local FAQ file: {os.path.basename(txt_file)}")
-            combined_content += f"\n\n=== Content from {os.path.basename(txt_file)} ===\n\n"
-            combined_content += content
-            successful_fetches += 1
-        except Exception as e:
-            logging.error(f"Error reading local FAQ file {txt_file}: {e}")
-    
-    if successful_fetches > 0:
-        logging.info(f"Successfully loaded content from {successful_fetches} out of {total_sources} FAQ sources")
-        return combined_content
-    else:
-        logging.error("Failed to load content from any FAQ sources")
-        return None
-
-# Global variables for FAQ content that will be refreshed periodically
-faq_text = ""
-local_faq_text = ""
-faq_avoidance_text = ""
+# Identical hash rate requests arriving together share one upstream call
+hash_power_flight = SingleFlight("Hash power")
 
-# Function to refresh FAQ content
-def refresh_faq_content():
-    global faq_text, local_faq_text, faq_avoidance_text
-    
-    try:
-        # Read the local FAQ content
-        with open(faq_file_path, 'r', encoding='utf-8') as faq_file:
-            local_faq_text = faq_file.read()
-        
-        # Read the avoidance FAQ content
-        avoidance_file_path = 'avoidance_faq_prompt.txt'
-        with open(avoidance_file_path, 'r', encoding='utf-8') as faq_file:
-            faq_avoidance_text = faq_file.read()
-        
-        # Fetch and combine with remote content
-        remote_faq_text = fetch_remote_faq_content()
-        if remote_faq_text:
-            faq_text = remote_faq_text + "\n\n" + local_faq_text
-            logging.info("FAQ content refreshed: Combined content from remote sources and local file")
-        else:
-            faq_text = local_faq_text
-            logging.warning("FAQ content refreshed: Using only local FAQ content as remote fetch failed")
-            
-    except Exception as e:
-        logging.error(f"Error refreshing FAQ content: {e}")
+# Samples event-loop lag and names the blocking call when the loop stalls
+loop_watchdog = LoopWatchdog()
 
-# Async function to periodically refresh FAQ content
-async def periodic_faq_refresh():
-    while True:
-        try:
-            await asyncio.sleep(3600)  # Wait 1 hour (3600 seconds)
-            logging.info("Starting periodic FAQ content refresh...")
-            refresh_faq_content()
-        except Exception as e:
-            logging.error(f"Error in periodic FAQ refresh: {e}")
+# Per-user / per-chat rate limits and a priority queue for /faq, /refresh_faq and /analyze_support
+admission = AdmissionController()
 
-# Initialize FAQ content on startup
-refresh_faq_content()
+async def reply_rejected(event, rejection):
+    set_command_outcome('rejected')
+    # Rate-limited users get one notice per interval, not one reply per spammed command
+    if rejection.notify:
+        await event.reply(rejection.message)
 
 
 async def list_channels(client):
@@ -165,72 +75,30 @@ async def list_channels(client):
     else:
         logging.info("Bot is not subscribed to any channels.")
 
-
-# Function to query OpenAI GPT-4o and handle any API errors
-def query_openai_gpt(system, faq_avoidance_text, prompt):
-
-    system = system + "\n\nDo not talk about the following topics:\n" + faq_avoidance_text + \
-             "\n\nIf you do not know the answer with certainty, tell the user that their question will be forwarded to support staff for answering.\n\nIf the questions seems missing, remind the user that the format for interacting with you is '/faq <type your question inline>'. Give an example, e.g., /faq What is Tari Universe?"
+# Answer a question in this process or, with FAQ_WORKERS set, in an answer worker
+async def answer_question(question, on_text=None):
     try:
-        client = OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-4o",  # gpt-3.5-turbo
-            response_format={"type": "json_object"},
-            temperature=0.3,
-
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": prompt}
-            ],
-            timeout=60,
-        )
-        result = response.choices[0].message.content
-        logging.info(f"OpenAI response: {result}")
-        return result
-
-    except OpenAIError as e:  # Handle OpenAI API errors
-        error_info = {
-            "message": str(e),
-            "type": type(e).__name__,
-            "traceback": traceback.format_exc(),
-        }
-        logging.error(f"OpenAI error: {error_info}")
-        return """
-        {'answer': 'Sorry, I encountered an error while trying to answer your question. Please try again.'}
-        """
-
-# Function to search the FAQ for relevant information using GPT-4o
-def find_faq_answer(question):
-    # Create the prompt to send to GPT-4o
-
-    prompt = """
-    Search the FAQ for the answer.
-    Avoid mentioning banned topics.
-    If you can't find the answer, use your knowledge of cryptocurrency and blockchain to provide a relevant answer.
-    If you don't know the answer, say that the question will be forwarded to support staff for answering.
-     
-    Question:  %s
-    Answer in JSON format: {'answer': '<answer>'}
-    """ % question
-
-    # Get the response from OpenAI GPT-4o
-    answer = query_openai_gpt(faq_text, faq_avoidance_text, prompt)
-    if answer:
-        # get json object from the answer
-        try:
-            answer = json.loads(answer)['answer']
-            logging.info(f"FAQ answer found: {answer}")
-        except json.JSONDecodeError as e:
-            logging.error(f"Error decoding JSON response: {e}")
-            return "There was an error processing your request."
-
-    return answer
-
+        return await run_task('faq', question, on_text=on_text)
+    except WorkerError as e:
+        logging.error(f"Answer worker error: {e}")
+        set_command_outcome('error')
+        return "There was an error processing your request."
 
+# Last pending FAQ reply per chat, used to keep replies in question order
+chat_reply_tails = {}
 
 # Telegram bot event handler
 @client.on(events.NewMessage(pattern=r'/(ask|faq|faqqer)'))
+@instrument_command('faq')
 async def handler(event):
+    started_at = time.monotonic()
+    try:
+        async with admission.admit('faq', event.sender_id, event.chat_id):
+            await answer_faq(event, started_at)
+    except AdmissionRejected as e:
+        await reply_rejected(event, e)
+
+async def answer_faq(event, started_at):
     # Extract the user's question from the message
     user_message = event.message.text[len('/ask '):]
     
@@ -239,29 +107,63 @@ async def handler(event):
         logging.info("Hash rates request received. Triggering hash power job.")
         # Directly call the post_hash_power function to get an immediate update
         from blockchain_job import post_hash_power
-        await post_hash_power(client)
+        await hash_power_flight.do("hash_rates", lambda: post_hash_power(client))
         return
     
-    # Search the FAQ for a relevant answer
-    answer = find_faq_answer(user_message)
+    # Answers are generated concurrently, but replies within a chat are posted
+    # in the order the questions arrived
+    chat_id = event.chat_id
+    previous_reply = chat_reply_tails.get(chat_id)
+    my_reply = asyncio.get_running_loop().create_future()
+    chat_reply_tails[chat_id] = my_reply
 
-    # Respond to the user with the answer
-    await event.reply(f"{answer}")
+    try:
+        if FAQ_STREAMING:
+            # Post a placeholder right away (in question order) and fill it in as tokens arrive
+            if previous_reply is not None:
+                await asyncio.shield(previous_reply)
+            placeholder = await event.reply(STREAM_PLACEHOLDER)
+            my_reply.set_result(None)
+
+            editor = ProgressiveEditor(placeholder.edit, "telegram", started_at, fallback=event.reply)
+            answer = await answer_question(user_message, on_text=editor.update)
+            await editor.finish(f"{answer}")
+            return
+
+        # Search the FAQ for a relevant answer
+        answer = await answer_question(user_message)
+
+        if previous_reply is not None:
+            await asyncio.shield(previous_reply)
+
+        # Respond to the user with the answer
+        await event.reply(f"{answer}")
+    finally:
+        if not my_reply.done():
+            my_reply.set_result(None)
+        if chat_reply_tails.get(chat_id) is my_reply:
+            del chat_reply_tails[chat_id]
 
 # Manual FAQ refresh command handler
 @client.on(events.NewMessage(pattern=r'/refresh_faq'))
+@instrument_command('refresh_faq')
 async def refresh_handler(event):
     try:
         logging.info("Manual FAQ refresh requested")
-        await event.reply("🔄 Refreshing FAQ content...")
-        refresh_faq_content()
-        await event.reply("✅ FAQ content has been refreshed successfully!")
+        async with admission.admit('refresh_faq', event.sender_id, event.chat_id):
+            await event.reply("🔄 Refreshing FAQ content...")
+            await refresh_faq_content()
+            await event.reply("✅ FAQ content has been refreshed successfully!")
+    except AdmissionRejected as e:
+        await reply_rejected(event, e)
     except Exception as e:
         logging.error(f"Error in manual FAQ refresh: {e}")
+        set_command_outcome('error')
         await event.reply("❌ Failed to refresh FAQ content. Please try again later.")
 
 # Manual customer analysis command handler
 @client.on(events.NewMessage(pattern=r'/analyze_support(?:\s+(.*))?'))
+@instrument_command('analyze_support')
 async def analyze_support_handler(event):
     try:
         logging.info("Manual customer service analysis requested")
@@ -283,24 +185,30 @@ async def analyze_support_handler(event):
                 # No hours specified, treat the entire argument as a question
                 custom_question = args
         
-        if custom_question:
-            await event.reply(f"🔍 Starting custom analysis for the last {hours} hours...\n📝 Focus: {custom_question}")
-            logging.info(f"Custom analysis question: {custom_question}")
-        else:
-            await event.reply(f"🔍 Starting customer service analysis for the last {hours} hours...")
-        
-        # Get the chat ID where the command was issued
-        chat_id = event.chat_id
-        logging.info(f"Posting analysis results to originating chat: {chat_id}")
-        
-        await manual_analysis_trigger(client, target_group_id=chat_id, hours=hours, custom_question=custom_question)
-        # The analysis function will post results directly to the originating channel
+        # Longer windows cost more of the rate limit budget
+        async with admission.admit('analyze_support', event.sender_id, event.chat_id, cost=analysis_cost(hours)):
+            if custom_question:
+                await event.reply(f"🔍 Starting custom analysis for the last {hours} hours...\n📝 Focus: {custom_question}")
+                logging.info(f"Custom analysis question: {custom_question}")
+            else:
+                await event.reply(f"🔍 Starting customer service analysis for the last {hours} hours...")
+            
+            # Get the chat ID where the command was issued
+            chat_id = event.chat_id
+            logging.info(f"Posting analysis results to originating chat: {chat_id}")
+            
+            await manual_analysis_trigger(client, target_group_id=chat_id, hours=hours, custom_question=custom_question)
+            # The analysis function will post results directly to the originating channel
+    except AdmissionRejected as e:
+        await reply_rejected(event, e)
     except Exception as e:
         logging.error(f"Error in manual customer analysis: {e}")
+        set_command_outcome('error')
         await event.reply("❌ Failed to run customer service analysis. Please try again later.")
 
 # Version command handler
 @client.on(events.NewMessage(pattern=r'/version'))
+@instrument_command('version')
 async def version_handler(event):
     try:
         logging.info("Version command requested")
@@ -311,6 +219,33 @@ async def version_handler(event):
         # Check if customer analysis is available
         phone_number = os.getenv('TELEGRAM_PHONE_NUMBER')
         analysis_status = "✅ Available" if phone_number else "⚠️ Requires TELEGRAM_PHONE_NUMBER"
+        # Answer-path counters include the answer workers' when FAQ_WORKERS is on
+        engine_stats = answer_stats()
+        cache_stats = engine_stats['answer_cache']
+        llm_stats = engine_stats['llm_connections']
+        flight_stats = engine_stats['faq_flight']
+        faq_usage = engine_stats['llm_usage'].get('faq', {})
+        tokenizer = token_stats()
+        admission_stats = admission.stats()
+        batch_stats = engine_stats['faq_batcher']
+        table_stats = engine_stats['answer_table']
+        stall_stats = loop_watchdog.stats()
+        pool_stats = worker_stats()
+        workers_status = "off (answering in the bot process)"
+        if pool_stats is not None:
+            workers_status = (f"{pool_stats['alive']}/{pool_stats['workers']} alive, {pool_stats['in_flight']} in flight, "
+                              f"{pool_stats['restarts']} restarts, {pool_stats['recovered']} requests recovered")
+        stall_status = f"{stall_stats['stalls']}"
+        if stall_stats['stalls']:
+            stall_status += f", longest {stall_stats['longest']:.1f}s, last in {stall_stats['last_blocker']}"
+        batching_status = "on" if FAQ_BATCHING else "off"
+        if FAQ_BATCHING:
+            batching_status += f", {batch_stats['batched_items']} questions in {batch_stats['batches']} batches"
+        rejected = admission_stats['rejected']
+        ttft = time_to_first_text_stats().get('telegram', {})
+        streaming_status = "on" if FAQ_STREAMING else "off"
+        if ttft.get('p50') is not None:
+            streaming_status += f", first text p50 {ttft['p50']:.2f}s"
         
         version_info = f"""
 🤖 **FAQQer Bot Version Information**
@@ -325,6 +260,16 @@ async def version_handler(event):
 • Periodic FAQ content refresh
 • Customer service analysis: {analysis_status}
 • Multi-source FAQ loading (local + remote)
+• Answer cache: {cache_stats['size']} entries, {cache_stats['hits']} hits / {cache_stats['misses']} misses
+• OpenAI connections: {llm_stats['requests']} requests, {llm_stats['reused_connections']} on reused connections
+• Coalesced questions: {flight_stats['coalesced']} joined {flight_stats['executed']} completions
+• FAQ prompt tokens: {faq_usage.get('prompt_tokens', 0)} ({faq_usage.get('cached_tokens', 0)} served from prompt cache), counted with {tokenizer['encoding']}
+• Streaming answers: {streaming_status}
+• Precomputed answers: {table_stats['entries']} questions, {table_stats['hits']} hits
+• Question batching: {batching_status}
+• Event-loop stalls: {stall_status}
+• Answer workers: {workers_status}
+• Request queue: {admission_stats['active']} running, {admission_stats['queued']}/{admission_stats['max_queued']} waiting; rejected {rejected.get('user_rate', 0) + rejected.get('chat_rate', 0)} rate limited, {rejected.get('queue_full', 0) + rejected.get('queue_timeout', 0)} busy
 
 **Commands:**
 • `/faq <question>` - Ask a question
@@ -344,10 +289,12 @@ async def version_handler(event):
         
     except Exception as e:
         logging.error(f"Error in version command: {e}")
+        set_command_outcome('error')
         await event.reply("❌ Failed to retrieve version information.")
 
 # Channel info command handler
 @client.on(events.NewMessage(pattern=r'/channel_info'))
+@instrument_command('channel_info')
 async def channel_info_handler(event):
     try:
         logging.info("Channel info command requested")
@@ -366,10 +313,28 @@ async def channel_info_handler(event):
             await event.reply("❌ Bot is not subscribed to any channels.")
     except Exception as e:
         logging.error(f"Error in channel info command: {e}")
+        set_command_outcome('error')
         await event.reply("❌ Failed to retrieve channel information.")
 
 # Main execution function
 async def main():
+    # Scrape endpoint for Prometheus (METRICS_PORT=0 disables it)
+    start_metrics_server()
+    loop_watchdog.start()
+
+    # With FAQ_WORKERS=N, answers and analysis formatting run in N worker processes
+    await start_answer_workers()
+    try:
+        await run_bot()
+    finally:
+        # Stop the workers with the bot rather than leaving them to notice the closed socket
+        await stop_answer_workers()
+
+async def run_bot():
+    # Load FAQ content before answering anything; remote sources that are slow
+    # or down fall back to their cached copy so this never blocks startup
+    await refresh_faq_content()
+
     # Start the Telegram client
     await client.start(bot_token=bot_token)
     logging.info(f"FAQQer Bot v{FAQQER_VERSION} (Build: {BUILD_DATE}) - Telegram client started successfully")
@@ -381,16 +346,20 @@ async def main():
     print("="*80)
     print("CURRENT FAQ CONTENT:")
     print("="*80)
+    snapshot = faq_corpus.current
+    faq_text = snapshot.faq_text
+    print(f"FAQ Snapshot Version: {snapshot.version}")
     print(f"FAQ Text Length: {len(faq_text)} characters")
-    print(f"Local FAQ Length: {len(local_faq_text)} characters")
-    print(f"Avoidance FAQ Length: {len(faq_avoidance_text)} characters")
+    print(f"Local FAQ Length: {len(snapshot.local_faq_text)} characters")
+    print(f"Avoidance FAQ Length: {len(snapshot.faq_avoidance_text)} characters")
     print("\nFirst 500 characters of FAQ content:")
     print("-" * 50)
     print(faq_text[:500] + "..." if len(faq_text) > 500 else faq_text)
     print("="*80 + "\n")
     
-    # Start the periodic FAQ refresh task
+    # Start the periodic FAQ refresh task and the local FAQ file watcher
     asyncio.create_task(periodic_faq_refresh())
+    asyncio.create_task(faq_corpus.watch_local_files())
     
     # Schedule jobs
     #schedule_block_height_job(client, asyncio.get_event_loop())
@@ -1,21 +1,20 @@
 import os
+import asyncio
 import logging
+import time
 import discord
 from discord import app_commands
 from discord.ext import commands
-import openai
 from dotenv import load_dotenv
-import json
-import requests
+from faq_engine import faq_corpus, find_faq_answer, periodic_faq_refresh, refresh_faq_content  # FAQ answer path shared with the Telegram bot
+from faq_streaming import FAQ_STREAMING, ProgressiveEditor
 
 # Load environment variables from the .env file
 load_dotenv()
 
-# Discord bot token and OpenAI API key
+# Discord bot token (the OpenAI API key is read from OPENAI_API_KEY by the SDK)
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GUILD_ID = int(os.getenv("GUILD_ID", "0"))  # Replace with your server's ID or set in .env
-openai.api_key = OPENAI_API_KEY
 
 # Set up logging configuration
 logging.basicConfig(
@@ -24,72 +23,35 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
-# Load the FAQ content
-faq_file_path = 'faq_prompt.txt'
-avoidance_faq_file_path = 'avoidance_faq_prompt.txt'
-
-with open(faq_file_path, 'r', encoding='utf-8') as faq_file:
-    faq_text = faq_file.read()
-
-with open(avoidance_faq_file_path, 'r', encoding='utf-8') as avoidance_file:
-    faq_avoidance_text = avoidance_file.read()
-
 # Initialize the bot
 intents = discord.Intents.default()
 bot = commands.Bot(command_prefix="!", intents=intents)
 
-# Function to query OpenAI GPT and handle errors
-async def query_openai_gpt(system, faq_avoidance_text, prompt):
-    system_prompt = (
-        f"{system}\n\n"
-        f"Do not talk about the following topics:\n"
-        f"{faq_avoidance_text}\n\n"
-        f"If you do not know the answer with certainty, tell the user that their question will be forwarded to support staff."
-    )
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            temperature=0.4,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-        )
-        result = response.choices[0].message.content
-        logging.info(f"OpenAI response: {result}")
-        return result
-    except openai.error.OpenAIError as e:
-        logging.error(f"OpenAI API error: {e}")
-        return "Sorry, I encountered an error while trying to answer your question. Please try again."
-
-# Function to find FAQ answers
-async def find_faq_answer(question):
-    prompt = f"""
-Search the FAQ for the answer.
-Avoid mentioning banned topics.
-
-Question: {question}
-Answer in JSON format: {{'answer': '<answer>'}}
-"""
-    answer = await query_openai_gpt(faq_text, faq_avoidance_text, prompt)
-    if answer:
-        try:
-            logging.info(f"Raw OpenAI response: {answer}")
-            sanitized_answer = answer.replace("'", '"')  # Ensure valid JSON
-            answer_json = json.loads(sanitized_answer)
-            return answer_json.get('answer', "There was an error processing your request.")
-        except json.JSONDecodeError as e:
-            logging.error(f"Error decoding JSON response: {e}")
-            return "There was an error processing your request."
-    else:
-        return "No answer was found."
+# Load the FAQ corpus before commands are served and keep it fresh, exactly like the Telegram bot
+@bot.event
+async def setup_hook():
+    await refresh_faq_content()
+    asyncio.create_task(periodic_faq_refresh())
+    asyncio.create_task(faq_corpus.watch_local_files())
 
 # Slash command: /faq
 @bot.tree.command(name="faq", description="Ask a FAQ question.")
 async def faq(interaction: discord.Interaction, question: str):
     logging.info(f"Received question: {question}")
+    # Defer (shows "thinking...") right away: Discord drops interactions not
+    # acknowledged within 3 seconds, and an answer can take longer than that
+    started_at = time.monotonic()
+    await interaction.response.defer(thinking=True)
+    if FAQ_STREAMING:
+        # Edit the deferred response as tokens arrive
+        editor = ProgressiveEditor(lambda text: interaction.edit_original_response(content=text), "discord", started_at,
+                                   fallback=interaction.followup.send)
+        answer = await find_faq_answer(question, on_text=editor.update)
+        await editor.finish(answer)
+        return
+
     answer = await find_faq_answer(question)
-    await interaction.response.send_message(answer)
+    await interaction.followup.send(answer)
 
 
 # Slash command: /ask (alias for /faq)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Shared LLM Client
+Long-lived OpenAI clients (sync and async) with keep-alive connection pooling,
+configurable timeouts and retry/backoff on 429/5xx. Every module that talks to
+OpenAI should get its client from here instead of constructing OpenAI() per call.
+
+The backend behind the clients is pluggable: real OpenAI (default), the bundled
+fake server (fake_llm_server.py) for offline load tests and benchmarks, or any
+other OpenAI-compatible endpoint. Call sites pass their model through llm_model().
+"""
+
+import logging
+import os
+import threading
+import weakref
+from collections import namedtuple
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+from metrics import record_openai_tokens
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Pool and timeout settings (override through the environment)
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '20'))                  # Max open connections per client
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_KEEPALIVE_CONNECTIONS', '10'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '120'))  # Seconds an idle connection is kept
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '10'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '120'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))               # SDK retries 408/409/429/5xx with exponential backoff
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Backend settings
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')                       # 'openai', 'fake' or 'compatible'
+LLM_BASE_URL = os.getenv('LLM_BASE_URL')                               # Endpoint of a 'compatible' backend
+LLM_API_KEY = os.getenv('LLM_API_KEY')
+LLM_MODEL = os.getenv('LLM_MODEL')                                     # Overrides the model of every call site
+FAKE_LLM_URL = os.getenv('FAKE_LLM_URL', 'http://127.0.0.1:8089/v1')
+
+# base_url / api_key of None mean the SDK defaults (OPENAI_BASE_URL / OPENAI_API_KEY)
+LlmBackend = namedtuple('LlmBackend', 'name base_url api_key model')
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+_backend = None
+
+
+def backend_from_env():
+    """The backend selected by LLM_BACKEND"""
+    if LLM_BACKEND == 'openai':
+        return LlmBackend('openai', LLM_BASE_URL, LLM_API_KEY, LLM_MODEL)
+    if LLM_BACKEND == 'fake':
+        return LlmBackend('fake', FAKE_LLM_URL, 'fake-key', LLM_MODEL)
+    if LLM_BACKEND == 'compatible':
+        if not LLM_BASE_URL:
+            raise ValueError("LLM_BACKEND=compatible requires LLM_BASE_URL")
+        return LlmBackend('compatible', LLM_BASE_URL, LLM_API_KEY or 'none', LLM_MODEL)
+    raise ValueError(f"Unknown LLM_BACKEND '{LLM_BACKEND}' (use openai, fake or compatible)")
+
+
+def get_backend():
+    """The backend the shared clients talk to"""
+    global _backend
+    with _client_lock:
+        if _backend is None:
+            _backend = backend_from_env()
+        return _backend
+
+
+def set_backend(backend):
+    """
+    Switch every call site to another backend (e.g. a fake server started by a benchmark).
+    The shared clients are recreated on next use.
+    """
+    global _backend, _client, _async_client
+    with _client_lock:
+        _backend = backend
+        _client = None
+        _async_client = None
+    logging.info(f"LLM backend set to {backend.name} ({backend.base_url or 'default endpoint'})")
+
+
+def llm_model(default):
+    """The model to request: the backend's override if it has one, else the call site's default"""
+    return get_backend().model or default
+
+
+class _ConnectionStats:
+    """Counts requests and how many of them reused an already open connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen_streams = weakref.WeakSet()
+        self.requests = 0
+        self.new_connections = 0
+        self.retryable_responses = 0
+
+    def record(self, response):
+        stream = response.extensions.get('network_stream')
+        with self._lock:
+            self.requests += 1
+            if stream is not None and stream not in self._seen_streams:
+                self._seen_streams.add(stream)
+                self.new_connections += 1
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                self.retryable_responses += 1
+
+    def snapshot(self):
+        with self._lock:
+            reused = self.requests - self.new_connections
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': reused,
+                'reuse_ratio': reused / self.requests if self.requests else 0.0,
+                'retryable_responses': self.retryable_responses,
+            }
+
+
+_stats = _ConnectionStats()
+
+# Token usage per call site: label -> counters
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+def _record_response(response):
+    _stats.record(response)
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        logging.warning(f"LLM backend returned {response.status_code}, SDK will back off and retry")
+
+
+async def _record_response_async(response):
+    _record_response(response)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=LLM_POOL_SIZE,
+        max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout():
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def get_openai_client():
+    """Return the process-wide synchronous OpenAI client"""
+    global _client
+    backend = get_backend()
+    with _client_lock:
+        if _client is None:
+            http_client = httpx.Client(
+                limits=_limits(),
+                timeout=_timeout(),
+                event_hooks={'response': [_record_response]},
+            )
+            _client = OpenAI(http_client=http_client, max_retries=LLM_MAX_RETRIES, timeout=_timeout(),
+                             base_url=backend.base_url, api_key=backend.api_key)
+            logging.info(f"Created shared OpenAI client for {backend.name} backend "
+                         f"(pool size {LLM_POOL_SIZE}, retries {LLM_MAX_RETRIES})")
+        return _client
+
+
+def get_async_openai_client():
+    """Return the process-wide AsyncOpenAI client"""
+    global _async_client
+    backend = get_backend()
+    with _client_lock:
+        if _async_client is None:
+            http_client = httpx.AsyncClient(
+                limits=_limits(),
+                timeout=_timeout(),
+                event_hooks={'response': [_record_response_async]},
+            )
+            _async_client = AsyncOpenAI(http_client=http_client, max_retries=LLM_MAX_RETRIES, timeout=_timeout(),
+                                        base_url=backend.base_url, api_key=backend.api_key)
+            logging.info(f"Created shared AsyncOpenAI client for {backend.name} backend "
+                         f"(pool size {LLM_POOL_SIZE}, retries {LLM_MAX_RETRIES})")
+        return _async_client
+
+
+def connection_stats():
+    """Request and connection reuse counters across both shared clients"""
+    return _stats.snapshot()
+
+
+def _cached_tokens(usage):
+    # Older SDKs keep prompt_tokens_details as a plain dict, newer ones as a model
+    details = getattr(usage, 'prompt_tokens_details', None)
+    if isinstance(details, dict):
+        return details.get('cached_tokens') or 0
+    return getattr(details, 'cached_tokens', 0) or 0
+
+
+def record_usage(label, usage):
+    """Record the token usage of one completion, including tokens served from the provider's prompt cache"""
+    if usage is None:
+        return
+    cached = _cached_tokens(usage)
+    with _usage_lock:
+        counters = _usage.setdefault(label, {
+            'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0,
+        })
+        counters['requests'] += 1
+        counters['prompt_tokens'] += usage.prompt_tokens or 0
+        counters['cached_tokens'] += cached
+        counters['completion_tokens'] += usage.completion_tokens or 0
+    record_openai_tokens(label, usage.prompt_tokens or 0, cached, usage.completion_tokens or 0)
+    logging.info(f"OpenAI usage ({label}): {usage.prompt_tokens} prompt tokens "
+                 f"({cached} cached), {usage.completion_tokens} completion tokens")
+
+
+def usage_stats():
+    """Token usage counters per label, with the share of prompt tokens served from cache"""
+    with _usage_lock:
+        stats = {}
+        for label, counters in _usage.items():
+            stats[label] = dict(counters)
+            prompt_tokens = counters['prompt_tokens']
+            stats[label]['cached_ratio'] = counters['cached_tokens'] / prompt_tokens if prompt_tokens else 0.0
+        return stats
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Event-loop Stall Watchdog
+A heartbeat task on the event loop samples loop lag; a watchdog thread checks
+the heartbeat and, when the loop has been stuck for longer than
+LOOP_STALL_THRESHOLD, captures the stack of the loop thread. The frame in this
+repository closest to the top of that stack is the blocking call: it is logged
+with the full stack and counted in faqqer_event_loop_stalls_total{blocker=...}.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import EVENT_LOOP_LAG, EVENT_LOOP_LAG_LAST, LOOP_STALL_DURATION, LOOP_STALLS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Watchdog settings
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', '1.0'))   # Seconds without a heartbeat
+LOOP_HEARTBEAT_INTERVAL = 0.5          # Seconds between heartbeats (and lag samples)
+LOOP_WATCHDOG_INTERVAL = 0.1           # Seconds between watchdog checks
+STALL_STACK_LIMIT = 30                 # Innermost frames logged per stall
+
+
+def _is_repo_frame(frame):
+    filename = os.path.abspath(frame.f_code.co_filename)
+    return filename.startswith(BASE_DIR + os.sep) and os.sep + 'site-packages' + os.sep not in filename
+
+
+def _frame_label(frame):
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def find_blocker(frame):
+    """'module:function' of the innermost frame in this repo's code (else the innermost frame)"""
+    innermost = frame
+    while frame is not None:
+        if _is_repo_frame(frame):
+            return _frame_label(frame), frame
+        frame = frame.f_back
+    return _frame_label(innermost), innermost
+
+
+class LoopWatchdog:
+    """Detects event-loop stalls and reports the call that caused them"""
+
+    def __init__(self, threshold=LOOP_STALL_THRESHOLD, interval=LOOP_HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._beat = time.monotonic()
+        self._loop_thread_id = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.stalls = 0
+        self.longest = 0.0
+        self.last_blocker = None
+        self.blockers = {}          # blocker -> stall count
+
+    def start(self):
+        """Start the heartbeat task and the watchdog thread; call from the event loop"""
+        if self._thread is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._heartbeat_task = asyncio.ensure_future(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logging.info(f"Event-loop watchdog started (stall threshold {self.threshold}s)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._heartbeat_task.cancel()
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            EVENT_LOOP_LAG.observe(lag)
+            EVENT_LOOP_LAG_LAST.set(lag)
+
+    def _watch(self):
+        stalled_beat = None     # Heartbeat the current stall started after
+        blocker = None
+        while not self._stop.wait(LOOP_WATCHDOG_INTERVAL):
+            beat = self._beat
+            # The heartbeat sleeps for `interval`, so only time beyond that is a stall
+            stalled_for = time.monotonic() - beat - self.interval
+            if stalled_beat is not None and beat != stalled_beat:
+                self._stall_ended(blocker, time.monotonic() - stalled_beat - self.interval)
+                stalled_beat = blocker = None
+            if stalled_beat is None and stalled_for > self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                # The loop may have moved on while the frame was being fetched
+                if frame is None or self._beat != beat:
+                    continue
+                stalled_beat = beat
+                blocker = self._report_stall(frame, stalled_for)
+
+    def _report_stall(self, frame, stalled_for):
+        blocker, blocking_frame = find_blocker(frame)
+        stack = ''.join(traceback.format_stack(frame, limit=STALL_STACK_LIMIT))
+        self.stalls += 1
+        self.last_blocker = blocker
+        self.blockers[blocker] = self.blockers.get(blocker, 0) + 1
+        LOOP_STALLS.labels(blocker).inc()
+        logging.warning(f"Event loop stalled for {stalled_for:.1f}s in {blocker} "
+                        f"({blocking_frame.f_code.co_filename}:{blocking_frame.f_lineno}); "
+                        f"loop thread stack:\n{stack}")
+        return blocker
+
+    def _stall_ended(self, blocker, duration):
+        self.longest = max(self.longest, duration)
+        LOOP_STALL_DURATION.labels(blocker).observe(duration)
+        logging.warning(f"Event loop recovered after a {duration:.1f}s stall in {blocker}")
+
+    def stats(self):
+        return {
+            'stalls': self.stalls,
+            'longest': round(self.longest, 2),
+            'last_blocker': self.last_blocker,
+            'blockers': dict(self.blockers),
+        }
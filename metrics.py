@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Bot Metrics
+Prometheus metrics for the bot process, served by a small embedded HTTP server
+(http://METRICS_ADDR:METRICS_PORT/metrics). Covers per-command counts and latency,
+OpenAI latency and token usage, the FAQ corpus and its refreshes, the hash power
+job, APScheduler job lag, event-loop lag and stalls (sampled by loop_watchdog.py)
+and the answer worker pool. Answer worker processes (FAQ_WORKERS) export nothing
+themselves: they queue their answer-path updates, which the bot replays into its
+own metrics (see answer_workers.py).
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Server settings
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))          # 0 disables the endpoint
+METRICS_ADDR = os.getenv('METRICS_ADDR', '127.0.0.1')
+
+# Latency buckets in seconds: commands range from cached answers to multi-minute analyses
+COMMAND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+OPENAI_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+COMMAND_REQUESTS = Counter('faqqer_command_requests_total', 'Bot commands handled', ['command', 'outcome'])
+COMMAND_LATENCY = Histogram('faqqer_command_latency_seconds', 'Time to handle a bot command', ['command'],
+                            buckets=COMMAND_BUCKETS)
+
+OPENAI_REQUESTS = Counter('faqqer_openai_requests_total', 'OpenAI completions requested', ['call_site', 'outcome'])
+OPENAI_LATENCY = Histogram('faqqer_openai_latency_seconds', 'OpenAI completion latency (including retries)',
+                           ['call_site'], buckets=OPENAI_BUCKETS)
+OPENAI_TOKENS = Counter('faqqer_openai_tokens_total', 'OpenAI tokens used', ['call_site', 'kind'])
+
+FAQ_CORPUS_CHARS = Gauge('faqqer_faq_corpus_chars', 'Characters in the current FAQ corpus')
+FAQ_CORPUS_SECTIONS = Gauge('faqqer_faq_corpus_sections', 'Indexed sections in the current FAQ corpus')
+FAQ_CORPUS_SOURCES = Gauge('faqqer_faq_corpus_sources', 'Sources in the current FAQ corpus', ['kind'])
+FAQ_SNAPSHOT_VERSION = Gauge('faqqer_faq_snapshot_version', 'Version of the current FAQ snapshot')
+TOPIC_FILTER_MATCHES = Counter('faqqer_banned_topic_matches_total', 'Questions deflected by the banned-topic pre-filter',
+                               ['topic'])
+FAQ_REFRESH_DURATION = Histogram('faqqer_faq_refresh_seconds', 'FAQ corpus refresh duration', ['outcome'],
+                                 buckets=OPENAI_BUCKETS)
+
+HASH_POWER_RUNS = Counter('faqqer_hash_power_runs_total', 'Hash power job runs', ['outcome'])
+HASH_POWER_LATENCY = Histogram('faqqer_hash_power_latency_seconds', 'Hash power job duration',
+                               buckets=OPENAI_BUCKETS)
+
+SCHEDULER_JOB_LAG = Histogram('faqqer_scheduler_job_lag_seconds',
+                              'Delay between a scheduled job run time and its submission', ['job'],
+                              buckets=LAG_BUCKETS)
+SCHEDULER_JOB_EVENTS = Counter('faqqer_scheduler_job_events_total', 'Missed and failed scheduler runs',
+                               ['job', 'event'])
+
+EVENT_LOOP_LAG = Histogram('faqqer_event_loop_lag_seconds', 'How late the event loop wakes from a short sleep',
+                           buckets=LAG_BUCKETS)
+EVENT_LOOP_LAG_LAST = Gauge('faqqer_event_loop_lag_last_seconds', 'Most recent event-loop lag sample')
+LOOP_STALLS = Counter('faqqer_event_loop_stalls_total', 'Event-loop stalls over the watchdog threshold',
+                      ['blocker'])
+LOOP_STALL_DURATION = Histogram('faqqer_event_loop_stall_seconds', 'How long each event-loop stall lasted',
+                                ['blocker'], buckets=OPENAI_BUCKETS)
+
+
+WORKERS_ALIVE = Gauge('faqqer_answer_workers_alive', 'Answer worker processes connected and serving')
+WORKER_IN_FLIGHT = Gauge('faqqer_answer_worker_in_flight', 'Requests held by answer workers')
+WORKER_RESTARTS = Counter('faqqer_answer_worker_restarts_total', 'Answer workers replaced', ['reason'])
+WORKER_RECOVERED = Counter('faqqer_answer_worker_recovered_total', 'Requests retried after their worker died')
+
+# Metrics updated on the answer path, which runs in the answer workers when there are any
+FORWARDED_METRICS = {
+    'openai_requests': OPENAI_REQUESTS,
+    'openai_latency': OPENAI_LATENCY,
+    'openai_tokens': OPENAI_TOKENS,
+    'topic_filter_matches': TOPIC_FILTER_MATCHES,
+}
+_forwarded_updates = None      # (metric, labels, method, value) queued for the bot, in worker processes
+_forwarded_lock = threading.Lock()
+
+
+def forward_metrics():
+    """In an answer worker: queue answer-path metric updates for take_forwarded_metrics()"""
+    global _forwarded_updates
+    with _forwarded_lock:
+        _forwarded_updates = []
+
+
+def take_forwarded_metrics():
+    """The metric updates queued since the last call"""
+    global _forwarded_updates
+    with _forwarded_lock:
+        if not _forwarded_updates:
+            return []
+        updates, _forwarded_updates = _forwarded_updates, []
+        return updates
+
+
+def apply_forwarded_metrics(updates):
+    """In the bot process: replay updates an answer worker queued"""
+    for name, labels, method, value in updates:
+        getattr(FORWARDED_METRICS[name].labels(*labels), method)(value)
+
+
+def _update(name, labels, method, value=1):
+    getattr(FORWARDED_METRICS[name].labels(*labels), method)(value)
+    if _forwarded_updates is not None:
+        with _forwarded_lock:
+            if _forwarded_updates is not None:
+                _forwarded_updates.append((name, labels, method, value))
+
+
+# Outcome a handler reported for the command it is handling (see set_command_outcome)
+_command_outcome = contextvars.ContextVar('command_outcome', default=None)
+
+
+def set_command_outcome(outcome):
+    """
+    Label the command being handled with outcome ('rejected', 'error') although its
+    handler returns normally, as handlers that reply with an error message do
+    """
+    _command_outcome.set(outcome)
+
+
+def instrument_command(command):
+    """
+    Decorator for Telethon handlers: counts calls by outcome and records their latency.
+    The outcome is 'ok' unless the handler raised, was cancelled or set another one.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            outcome = 'error'
+            token = _command_outcome.set(None)
+            try:
+                result = await handler(*args, **kwargs)
+                outcome = _command_outcome.get() or 'ok'
+                return result
+            except asyncio.CancelledError:
+                outcome = 'cancelled'
+                raise
+            finally:
+                _command_outcome.reset(token)
+                COMMAND_REQUESTS.labels(command, outcome).inc()
+                COMMAND_LATENCY.labels(command).observe(time.monotonic() - started)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_openai(call_site):
+    """Time one OpenAI completion (streamed or not) and count it by outcome"""
+    started = time.monotonic()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        _update('openai_requests', (call_site, outcome), 'inc')
+        _update('openai_latency', (call_site,), 'observe', time.monotonic() - started)
+
+
+def record_openai_tokens(call_site, prompt_tokens, cached_tokens, completion_tokens):
+    _update('openai_tokens', (call_site, 'prompt'), 'inc', prompt_tokens)
+    _update('openai_tokens', (call_site, 'cached'), 'inc', cached_tokens)
+    _update('openai_tokens', (call_site, 'completion'), 'inc', completion_tokens)
+
+
+def record_topic_match(topic):
+    _update('topic_filter_matches', (topic,), 'inc')
+
+
+def record_faq_snapshot(snapshot):
+    """FAQ snapshot listener: publish the size of the corpus now being served"""
+    FAQ_CORPUS_CHARS.set(len(snapshot.faq_text))
+    FAQ_CORPUS_SECTIONS.set(len(snapshot.index))
+    FAQ_CORPUS_SOURCES.labels('remote').set(len(snapshot.remote_sources))
+    FAQ_CORPUS_SOURCES.labels('local').set(len(snapshot.local_sources))
+    FAQ_SNAPSHOT_VERSION.set(snapshot.version)
+
+
+def watch_scheduler(scheduler):
+    """Record how late APScheduler submits each job, and missed or failed runs"""
+    def on_event(event):
+        if event.code == EVENT_JOB_SUBMITTED:
+            now = time.time()
+            for run_time in event.scheduled_run_times:
+                SCHEDULER_JOB_LAG.labels(event.job_id).observe(max(0.0, now - run_time.timestamp()))
+        elif event.code == EVENT_JOB_MISSED:
+            SCHEDULER_JOB_EVENTS.labels(event.job_id, 'missed').inc()
+            logging.warning(f"Scheduler job {event.job_id} missed its run time")
+        elif event.code == EVENT_JOB_ERROR:
+            SCHEDULER_JOB_EVENTS.labels(event.job_id, 'error').inc()
+
+    scheduler.add_listener(on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_ERROR)
+
+
+def start_metrics_server(port=METRICS_PORT, addr=METRICS_ADDR):
+    """Serve /metrics on a background thread; returns False if disabled or the port is taken"""
+    if not port:
+        logging.info("Metrics endpoint disabled (METRICS_PORT=0)")
+        return False
+    try:
+        start_http_server(port, addr=addr)
+    except OSError as e:
+        logging.error(f"Could not start metrics endpoint on {addr}:{port}: {e}")
+        return False
+    logging.info(f"Metrics endpoint listening on http://{addr}:{port}/metrics")
+    return True
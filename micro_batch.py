@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Micro-batching
+Collects items submitted within a short window and processes them with one batch
+call, fanning the results back out to the waiting callers. Items the batch call
+could not handle (or every item, if it failed) are processed one at a time instead.
+"""
+
+import asyncio
+import logging
+
+
+class MicroBatcher:
+    """
+    Groups concurrent submissions by key into batches of up to max_size items.
+    run_batch(items) must return one result per item, or None for items it could
+    not handle; run_one(item) handles a single item and is the fallback.
+    """
+
+    def __init__(self, name, run_batch, run_one, window, max_size):
+        self.name = name
+        self.run_batch = run_batch
+        self.run_one = run_one
+        self.window = window
+        self.max_size = max_size
+        self._pending = {}      # key -> list of (item, future) waiting for the window to close
+        self._timers = {}       # key -> TimerHandle that flushes the pending batch
+        self._running = set()   # Batch tasks, referenced so they aren't garbage collected
+        self.batches = 0        # Batch calls made
+        self.batched_items = 0  # Items answered by a batch call
+        self.singles = 0        # Items that were alone in their window
+        self.fallbacks = 0      # Items retried one at a time after a batch call
+        self.failed_batches = 0
+
+    async def submit(self, item, key=None):
+        """Queue item for the next batch with this key and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self.max_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        # Shield so a cancelled caller doesn't cancel the result slot the batch will fill
+        return await asyncio.shield(future)
+
+    def _flush(self, key):
+        batch = self._pending.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        if len(batch) == 1:
+            self.singles += 1
+            results = [None]
+        else:
+            self.batches += 1
+            try:
+                results = await self.run_batch(items)
+                if len(results) != len(items):
+                    raise ValueError(f"expected {len(items)} results, got {len(results)}")
+            except Exception as e:
+                self.failed_batches += 1
+                logging.error(f"{self.name}: batch of {len(items)} failed ({type(e).__name__}: {e}), "
+                              f"falling back to one call per item")
+                results = [None] * len(items)
+
+        retry = []
+        for (item, future), result in zip(batch, results):
+            if result is None:
+                retry.append((item, future))
+            else:
+                self.batched_items += 1
+                if not future.done():
+                    future.set_result(result)
+
+        if len(batch) > 1 and retry:
+            self.fallbacks += len(retry)
+            logging.info(f"{self.name}: retrying {len(retry)} of {len(batch)} items one at a time")
+        await asyncio.gather(*(self._run_one(item, future) for item, future in retry))
+
+    async def _run_one(self, item, future):
+        try:
+            result = await self.run_one(item)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            else:
+                logging.error(f"{self.name}: {type(e).__name__}: {e}")
+            return
+        if not future.done():
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            'pending': sum(len(batch) for batch in self._pending.values()),
+            'batches': self.batches,
+            'batched_items': self.batched_items,
+            'singles': self.singles,
+            'fallbacks': self.fallbacks,
+            'failed_batches': self.failed_batches,
+        }
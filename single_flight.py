@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Single-flight Coalescing
+Concurrent callers asking for the same key share one in-flight call and all
+receive its result (or its exception).
+"""
+
+import asyncio
+import logging
+
+
+class SingleFlight:
+    """Deduplicates concurrent async calls by key"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}        # key -> asyncio.Task of the in-flight call
+        self.executed = 0       # Calls that actually ran
+        self.coalesced = 0      # Callers that joined an in-flight call instead
+
+    async def do(self, key, make_call):
+        """
+        Await make_call() for this key, or join the call already in flight.
+        make_call is a zero-argument function returning a coroutine.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logging.info(f"{self.name}: joined in-flight call ({len(self._calls)} in flight)")
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(make_call())
+            self._calls[key] = task
+            task.add_done_callback(lambda finished: self._forget(key, finished))
+
+        # Shield so one waiter being cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key, finished):
+        if self._calls.get(key) is finished:
+            del self._calls[key]
+        # Mark the exception as retrieved if every waiter was cancelled
+        if not finished.cancelled():
+            finished.exception()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Tests for admission control: token-bucket rate limits and the priority queue
+"""
+
+import asyncio
+
+import pytest
+
+from admission_control import (AdmissionController, AdmissionRejected, CommandPolicy, TokenBucket,
+                               analysis_cost)
+
+POLICIES = {
+    'faq': CommandPolicy(priority=0, user_rate=1, user_burst=2, chat_rate=1, chat_burst=3),
+    'analyze_support': CommandPolicy(priority=2, user_rate=1, user_burst=10, chat_rate=1, chat_burst=10),
+}
+
+
+async def run_admitted(controller, command, user_id, chat_id=1, cost=1):
+    async with controller.admit(command, user_id, chat_id, cost):
+        pass
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=0.5, burst=2)
+    now = bucket.updated_at
+    bucket.take(2)
+    assert bucket.wait_time(1, now) == pytest.approx(2.0)
+    assert bucket.wait_time(1, now + 2) == 0.0
+    assert bucket.wait_time(5, now + 100) == 0.0        # Costs above the burst are capped at it
+
+
+def test_user_rate_limit_rejects_after_burst():
+    controller = AdmissionController(policies=POLICIES)
+
+    async def scenario():
+        await run_admitted(controller, 'faq', user_id=7)
+        await run_admitted(controller, 'faq', user_id=7)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await run_admitted(controller, 'faq', user_id=7)
+        await run_admitted(controller, 'faq', user_id=8)     # Other users have their own bucket
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == 'user_rate'
+    assert 0 < rejected.retry_after <= 1
+    assert rejected.notify
+    assert controller.stats()['rejected'] == {'user_rate': 1}
+    assert controller.stats()['admitted'] == {'faq': 3}
+
+
+def test_chat_rejection_does_not_charge_the_user():
+    controller = AdmissionController(policies=POLICIES)
+
+    async def scenario():
+        for user_id in (1, 2, 3):
+            await run_admitted(controller, 'faq', user_id)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await run_admitted(controller, 'faq', user_id=4)
+        return rejected.value
+
+    assert asyncio.run(scenario()).reason == 'chat_rate'
+    assert controller._bucket('faq', 'user', 4, 1, 2).tokens == pytest.approx(2, abs=0.1)
+
+
+def test_repeated_rejections_notify_the_user_once():
+    controller = AdmissionController(policies=POLICIES)
+
+    async def scenario():
+        await run_admitted(controller, 'faq', user_id=7)
+        await run_admitted(controller, 'faq', user_id=7)
+        notices = []
+        for _ in range(3):
+            with pytest.raises(AdmissionRejected) as rejected:
+                await run_admitted(controller, 'faq', user_id=7)
+            notices.append(rejected.value.notify)
+        return notices
+
+    assert asyncio.run(scenario()) == [True, False, False]
+
+
+def test_queued_commands_run_in_priority_order():
+    controller = AdmissionController(max_active=1, policies=POLICIES)
+    order = []
+
+    async def command(name, user_id):
+        async with controller.admit(name, user_id, chat_id=user_id):
+            order.append(name)
+
+    async def scenario():
+        async with controller.admit('faq', user_id=1, chat_id=1):
+            waiting = [asyncio.ensure_future(command('analyze_support', 2)),
+                       asyncio.ensure_future(command('analyze_support', 3)),
+                       asyncio.ensure_future(command('faq', 4))]
+            await asyncio.sleep(0)
+            assert controller.stats()['queued_by_command'] == {'analyze_support': 2, 'faq': 1}
+        await asyncio.gather(*waiting)
+
+    asyncio.run(scenario())
+    assert order == ['faq', 'analyze_support', 'analyze_support']
+    assert controller.stats()['active'] == 0
+
+
+def test_full_queue_sheds_without_charging_the_rate_limit():
+    controller = AdmissionController(max_active=1, max_queued=1, policies=POLICIES)
+
+    async def scenario():
+        async with controller.admit('faq', user_id=1, chat_id=1):
+            queued = asyncio.ensure_future(run_admitted(controller, 'faq', user_id=2, chat_id=2))
+            await asyncio.sleep(0)
+            with pytest.raises(AdmissionRejected) as rejected:
+                await run_admitted(controller, 'faq', user_id=3, chat_id=3)
+        await queued
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == 'queue_full'
+    assert controller._bucket('faq', 'user', 3, 1, 2).tokens == pytest.approx(2, abs=0.1)
+
+
+def test_queue_timeout_sheds_and_frees_the_place():
+    controller = AdmissionController(max_active=1, queue_timeout=0.05, policies=POLICIES)
+
+    async def scenario():
+        async with controller.admit('faq', user_id=1, chat_id=1):
+            with pytest.raises(AdmissionRejected) as rejected:
+                await run_admitted(controller, 'faq', user_id=2, chat_id=2)
+            assert controller.stats()['queued'] == 0
+        await run_admitted(controller, 'faq', user_id=3, chat_id=3)
+        return rejected.value
+
+    assert asyncio.run(scenario()).reason == 'queue_timeout'
+    assert controller.stats()['active'] == 0
+
+
+def test_analysis_cost_grows_with_hours():
+    assert analysis_cost(1) == 1
+    assert analysis_cost(6) == 1
+    assert analysis_cost(7) == 2
+    assert analysis_cost(48) == 8
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Tests for the FAQ answer cache: rewordings hit, questions about a different thing miss
+"""
+
+import pytest
+
+from answer_cache import AnswerCache
+
+
+@pytest.fixture
+def cache():
+    cache = AnswerCache()
+    cache.put("Why is my miner stuck at 0 hashrate on GPU?", "GPU answer")
+    cache.put("When will testnet launch?", "Testnet launches in May")
+    return cache
+
+
+@pytest.mark.parametrize('question, answer', [
+    ("why is my miner stuck at 0 hashrate on GPU", "GPU answer"),
+    ("Why is my miner stuck at 0 hashrate on the GPU?", "GPU answer"),
+    ("When will the testnet launch?", "Testnet launches in May"),
+])
+def test_rewordings_hit(cache, question, answer):
+    assert cache.get(question) == answer
+
+
+@pytest.mark.parametrize('question', [
+    "Why is my miner stuck at 0 hashrate on CPU?",
+    "Why is my miner stuck at 10 hashrate on GPU?",
+    "When will mainnet launch?",
+    "When will testnet end?",
+])
+def test_one_term_difference_misses(cache, question):
+    assert cache.get(question) is None
+    assert cache.stats()['near_hits'] == 0
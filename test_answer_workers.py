@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the answer worker pool, run with real worker processes against the local fake LLM server
+"""
+
+import asyncio
+
+import pytest
+
+import answer_workers
+from metrics import OPENAI_REQUESTS, TOPIC_FILTER_MATCHES
+
+BANNED_QUESTION = "What is the price of XTM?"
+BANNED_TOPIC = "The money value of XTM or tXTM or gems"
+
+
+def sample(metric, *labels):
+    return metric.labels(*labels)._value.get()
+
+
+async def started_pool(size):
+    pool = await answer_workers.start_answer_workers(size)
+    for _ in range(300):
+        if pool.stats()['alive'] == size:
+            return pool
+        await asyncio.sleep(0.1)
+    raise AssertionError("answer workers did not start")
+
+
+def test_worker_answers_reach_bot_metrics_and_stats(fake_llm):
+    openai_before = sample(OPENAI_REQUESTS, 'faq', 'ok')
+    banned_before = sample(TOPIC_FILTER_MATCHES, BANNED_TOPIC)
+    local = answer_workers.answer_stats()
+
+    async def scenario():
+        await started_pool(1)
+        try:
+            answer = await answer_workers.run_task('faq', "How do I set up a Tari wallet for mining?")
+            deflected = await answer_workers.run_task('faq', BANNED_QUESTION)
+            return answer, deflected, answer_workers.answer_stats()
+        finally:
+            await answer_workers.stop_answer_workers()
+
+    answer, deflected, stats = asyncio.run(scenario())
+
+    assert answer and deflected
+    assert sample(OPENAI_REQUESTS, 'faq', 'ok') == openai_before + 1
+    assert sample(TOPIC_FILTER_MATCHES, BANNED_TOPIC) == banned_before + 1
+    assert stats['answer_cache']['misses'] == local['answer_cache']['misses'] + 1
+    assert stats['faq_flight']['executed'] == local['faq_flight']['executed'] + 1
+    faq_usage = stats['llm_usage']['faq']
+    assert faq_usage['requests'] == local['llm_usage'].get('faq', {}).get('requests', 0) + 1
+    assert faq_usage['cached_ratio'] == faq_usage['cached_tokens'] / faq_usage['prompt_tokens']
+
+
+def test_without_workers_tasks_run_in_process(fake_llm, local_snapshot, monkeypatch):
+    import faq_engine
+    monkeypatch.setattr(faq_engine.faq_corpus, 'current', local_snapshot)
+
+    answer = asyncio.run(answer_workers.run_task('faq', "How do I bridge XTM to wXTM? (in process)"))
+
+    assert answer
+    assert answer_workers.worker_stats() is None
+    assert fake_llm.state.counts['completions'] == 1
+
+
+def test_streamed_text_is_relayed_from_the_worker(fake_llm):
+    texts = []
+
+    async def on_text(text):
+        texts.append(text)
+
+    async def scenario():
+        await started_pool(1)
+        try:
+            return await answer_workers.run_task('faq', "How do I restore my wallet from seed words?",
+                                                 on_text=on_text)
+        finally:
+            await answer_workers.stop_answer_workers()
+
+    answer = asyncio.run(scenario())
+
+    assert texts and texts[-1] == answer
+    assert all(answer.startswith(text) for text in texts)
+
+
+def test_killed_worker_is_replaced_and_its_request_retried(fake_llm):
+    fake_llm.config.sample_latency = lambda: 1.0
+
+    async def scenario():
+        pool = await started_pool(1)
+        try:
+            request = asyncio.ensure_future(answer_workers.run_task('faq', "Why is my hash rate so low?"))
+            while pool.stats()['in_flight'] == 0:
+                await asyncio.sleep(0.05)
+            fake_llm.config.sample_latency = lambda: 0.01
+            next(iter(pool._workers.values())).process.kill()
+            answer = await asyncio.wait_for(request, timeout=60)
+            return answer, pool.stats()
+        finally:
+            await answer_workers.stop_answer_workers()
+
+    answer, stats = asyncio.run(scenario())
+
+    assert answer
+    assert stats['restarts'] == 1
+    assert stats['recovered'] == 1
+    assert stats['completed'] == 1 and stats['failed'] == 0
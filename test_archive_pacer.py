@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for the archive fetch pacer, run on a fake clock
+"""
+
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+
+import archive_pacer
+from archive_pacer import PACER_MAX_FLOOD_RETRIES, AdaptivePacer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic time that asyncio.sleep advances instantly"""
+    now = [1000.0]
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        now[0] += max(0.0, delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(archive_pacer.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(archive_pacer.asyncio, 'sleep', sleep)
+    return now
+
+
+class Telegram:
+    """Answers requests, raising a flood wait for the listed attempts; records when each arrived"""
+
+    def __init__(self, clock, flood_waits=()):
+        self.clock = clock
+        self.flood_waits = dict(flood_waits)    # attempt number -> seconds
+        self.sent_at = []
+
+    async def request(self, name):
+        attempt = len(self.sent_at)
+        self.sent_at.append((self.clock[0], name))
+        if attempt in self.flood_waits:
+            raise FloodWaitError(request=None, capture=self.flood_waits[attempt])
+        return f"page for {name}"
+
+
+def test_successes_speed_the_pace_up_to_the_minimum(clock):
+    pacer = AdaptivePacer(interval=1.0, min_interval=0.1)
+    telegram = Telegram(clock)
+
+    async def scenario():
+        for _ in range(30):
+            assert await pacer.call('tari', telegram.request, 'tari') == "page for tari"
+    asyncio.run(scenario())
+
+    gaps = [b[0] - a[0] for a, b in zip(telegram.sent_at, telegram.sent_at[1:])]
+    assert gaps[0] == pytest.approx(1.0)
+    assert gaps == sorted(gaps, reverse=True)
+    assert pacer.interval == pytest.approx(0.1)
+    assert pacer.stats()['channels']['tari']['requests'] == 30
+
+
+def test_flood_wait_is_honoured_retried_and_slows_the_pace(clock):
+    pacer = AdaptivePacer(interval=0.5, min_interval=0.1)
+    telegram = Telegram(clock, flood_waits={1: 7})
+
+    async def scenario():
+        await pacer.call('tari', telegram.request, 'tari')
+        return await pacer.call('tari', telegram.request, 'tari')
+    assert asyncio.run(scenario()) == "page for tari"
+
+    flooded_at, retried_at = telegram.sent_at[1][0], telegram.sent_at[2][0]
+    assert retried_at - flooded_at >= 7
+    # Backed off to the initial pace, then sped up once by the successful retry
+    assert pacer.interval == pytest.approx(archive_pacer.PACER_INITIAL_INTERVAL * archive_pacer.PACER_SPEEDUP)
+    counters = pacer.stats()['channels']['tari']
+    assert counters['flood_waits'] == 1
+    assert counters['flood_wait_seconds'] == 7
+    assert counters['requests'] == 2
+
+
+def test_flood_wait_holds_back_every_channel(clock):
+    pacer = AdaptivePacer(interval=0.1, min_interval=0.1)
+    telegram = Telegram(clock, flood_waits={0: 30})
+
+    async def scenario():
+        await asyncio.gather(pacer.call('tari', telegram.request, 'tari'),
+                             pacer.call('other', telegram.request, 'other'))
+    asyncio.run(scenario())
+
+    first_sent = telegram.sent_at[0][0]
+    assert all(sent_at - first_sent >= 30 for sent_at, _ in telegram.sent_at[1:])
+
+
+def test_concurrent_channels_share_one_pace(clock):
+    pacer = AdaptivePacer(interval=1.0, min_interval=1.0)
+    telegram = Telegram(clock)
+
+    async def channel(name):
+        for _ in range(3):
+            await pacer.call(name, telegram.request, name)
+
+    async def scenario():
+        await asyncio.wait_for(asyncio.gather(channel('a'), channel('b')), timeout=5)
+    asyncio.run(scenario())
+
+    times = [sent_at for sent_at, _ in telegram.sent_at]
+    assert all(b - a >= 1.0 for a, b in zip(times, times[1:]))
+    assert {name for _, name in telegram.sent_at} == {'a', 'b'}
+
+
+def test_gives_up_after_repeated_flood_waits(clock):
+    pacer = AdaptivePacer(interval=0.1, max_interval=2.0)
+    telegram = Telegram(clock, flood_waits={attempt: 1 for attempt in range(PACER_MAX_FLOOD_RETRIES + 1)})
+
+    with pytest.raises(FloodWaitError):
+        asyncio.run(pacer.call('tari', telegram.request, 'tari'))
+
+    assert len(telegram.sent_at) == PACER_MAX_FLOOD_RETRIES + 1
+    assert pacer.interval == 2.0
+
+
+def test_message_counts_are_reported_per_channel(clock):
+    pacer = AdaptivePacer()
+    pacer.count_messages('tari', 100)
+    pacer.count_messages('tari', 20)
+    pacer.count_messages('other', 5)
+
+    channels = pacer.stats()['channels']
+    assert channels['tari']['messages'] == 120
+    assert channels['other']['messages'] == 5
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Tests for the precomputed answer table: paraphrases cluster, different questions do not
+"""
+
+from faq_answer_table import AnswerTable, cluster_questions
+
+ASKED = [
+    ('alice', "When will mainnet launch?"),
+    ('bob', "When will the mainnet launch?"),
+    ('carol', "when will mainnet launch"),
+    ('dave', "When will testnet launch?"),
+    ('erin', "When will the testnet launch?"),
+    ('frank', "When will testnet end?"),
+]
+
+
+def test_questions_differing_in_one_key_term_are_not_merged():
+    clusters = cluster_questions(ASKED)
+    by_question = {cluster['question']: cluster for cluster in clusters}
+
+    assert len(clusters) == 3
+    assert by_question["When will mainnet launch?"]['askers'] == 3
+    assert by_question["When will testnet launch?"]['askers'] == 2
+    assert by_question["When will testnet end?"]['askers'] == 1
+    for cluster in clusters:
+        assert len({'mainnet' in p for p in cluster['paraphrases']}) == 1
+
+
+def test_lookup_ignores_paraphrases_asking_something_else():
+    # A table mined with looser clustering put mainnet wordings in the testnet cluster
+    table = AnswerTable('hash', [{
+        'question': "When will testnet launch?",
+        'paraphrases': ["when will testnet launch", "when will mainnet launch"],
+        'asks': 3, 'askers': 3,
+        'answer': "Testnet launches in May",
+    }])
+
+    assert table.lookup("When will testnet launch?") == "Testnet launches in May"
+    assert table.lookup("When will mainnet launch?") is None
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental archiving and sender resolution, run against a fake Telegram client and clock
+"""
+
+import asyncio
+import functools
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from telethon.tl.types import User
+
+START = datetime(2026, 1, 1, 0, 0)          # Naive UTC, like datetime.utcnow()
+
+
+class FakeMessage:
+    def __init__(self, message_id, date, sender, text=None, reply_to=None, sender_attached=True):
+        self.id = message_id
+        self.date = date.replace(tzinfo=timezone.utc)
+        self.sender = sender if sender_attached else None
+        self.sender_id = sender.id
+        self.text = text or f"message {message_id}"
+        self.reply_to_msg_id = reply_to
+        self.media = None
+        self.downloads = 0
+
+    async def download_media(self, file):
+        self.downloads += 1
+        path = os.path.join(file, f"photo{self.id}.jpg")
+        with open(path, 'wb') as f:
+            f.write(b"jpeg")
+        return path
+
+
+class FakeClient:
+    """The get_messages/get_entity subset faq_archiver uses, over messages dated up to the fake clock"""
+
+    def __init__(self, clock, messages, senders=(), unresolvable=()):
+        self.clock = clock
+        self.messages = messages
+        self.senders = {sender.id: sender for sender in senders}
+        self.unresolvable = set(unresolvable)
+        self.entity_calls = []
+
+    def visible(self):
+        return [msg for msg in self.messages if msg.date.replace(tzinfo=None) <= self.clock.now]
+
+    async def start(self, phone=None):
+        pass
+
+    async def get_messages(self, channel, limit=100, offset_id=0, offset_date=None, min_id=0, max_id=0,
+                           reverse=False, ids=None):
+        await asyncio.sleep(0)          # Let concurrent runs interleave, as a real request would
+        messages = self.visible()
+        if ids is not None:
+            by_id = {msg.id: msg for msg in messages}
+            return [by_id.get(message_id) for message_id in ids]
+        assert reverse
+        return [msg for msg in messages
+                if msg.id > max(min_id, offset_id) and (not max_id or msg.id < max_id)
+                and (offset_date is None or msg.date > offset_date)][:limit]
+
+    async def get_entity(self, ids):
+        self.entity_calls.append(list(ids))
+        if self.unresolvable & set(ids):
+            raise ValueError(f"Could not find the input entity for {sorted(self.unresolvable & set(ids))}")
+        return [self.senders[sender_id] for sender_id in ids]
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def datetime(self):
+        clock = self
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return clock.now
+        return FakeDatetime
+
+
+def make_users(count):
+    return [User(id=100 + i, username=f"user{i}", access_hash=1) for i in range(count)]
+
+
+def half_hourly_messages(hours, users=None, sender_attached=True):
+    users = users or make_users(5)
+    return [FakeMessage(i + 1, START + timedelta(minutes=30 * i), users[i % len(users)],
+                        sender_attached=sender_attached)
+            for i in range(hours * 2)]
+
+
+@pytest.fixture
+def archiver(telethon_import, monkeypatch):
+    import archive_store
+    from archive_pacer import AdaptivePacer
+    faq_archiver = telethon_import('faq_archiver')
+
+    clock = FakeClock(START)
+    monkeypatch.setattr(faq_archiver, 'datetime', clock.datetime())
+    monkeypatch.setattr(archive_store, 'datetime', clock.datetime())
+    monkeypatch.setattr(faq_archiver, 'AdaptivePacer', functools.partial(AdaptivePacer, 0, 0))
+    return faq_archiver, clock
+
+
+def run(faq_archiver, hours, output_dir, **kwargs):
+    return asyncio.run(faq_archiver.archive_channels(channels=['tari'], hours_history=hours, output_dir=output_dir,
+                                                     **kwargs))
+
+
+def stored_ids(output_dir):
+    from archive_store import ChannelStore
+    return [record['id'] for record in ChannelStore(output_dir).records('tari')]
+
+
+def test_widened_window_after_time_gap_matches_rebuild(archiver):
+    faq_archiver, clock = archiver
+    faq_archiver.client = FakeClient(clock, half_hourly_messages(100))
+    clock.now = START + timedelta(hours=40, minutes=10)
+
+    run(faq_archiver, 3, 'incremental')
+    clock.now += timedelta(hours=30)
+    incremental = run(faq_archiver, 48, 'incremental')
+    rebuilt = run(faq_archiver, 48, 'rebuilt', rebuild_window=True)
+
+    assert incremental['total_messages'] == rebuilt['total_messages'] == 96
+    assert stored_ids('incremental') == stored_ids('rebuilt')
+
+
+def test_narrow_runs_across_a_gap_then_wide_window(archiver):
+    faq_archiver, clock = archiver
+    faq_archiver.client = FakeClient(clock, half_hourly_messages(100))
+    clock.now = START + timedelta(hours=40, minutes=10)
+
+    run(faq_archiver, 3, 'incremental')
+    clock.now += timedelta(hours=30)
+    narrow = run(faq_archiver, 3, 'incremental')
+    assert narrow['total_messages'] == 6
+    clock.now += timedelta(hours=1)
+    wide = run(faq_archiver, 48, 'incremental')
+    rebuilt = run(faq_archiver, 48, 'rebuilt', rebuild_window=True)
+
+    assert wide['total_messages'] == rebuilt['total_messages'] == 96
+    ids = stored_ids('incremental')
+    assert ids == sorted(set(ids))
+    window = stored_ids('rebuilt')
+    assert [i for i in ids if i >= window[0]] == window
+
+
+def test_concurrent_runs_into_one_output_dir_take_turns(archiver):
+    faq_archiver, clock = archiver
+    faq_archiver.client = FakeClient(clock, half_hourly_messages(100))
+    clock.now = START + timedelta(hours=40, minutes=10)
+
+    async def both():
+        return await asyncio.gather(
+            faq_archiver.archive_channels(channels=['tari'], hours_history=24, output_dir='shared'),
+            faq_archiver.archive_channels(channels=['tari'], hours_history=48, output_dir='shared'))
+    narrow, wide = asyncio.run(both())
+    rebuilt = run(faq_archiver, 48, 'rebuilt', rebuild_window=True)
+
+    assert narrow['total_messages'] == 48
+    assert wide['total_messages'] == rebuilt['total_messages'] == 81
+    assert stored_ids('shared') == stored_ids('rebuilt')
+    from archive_store import STORE_DIRNAME
+    assert not [name for name in os.listdir(os.path.join('shared', STORE_DIRNAME)) if name.endswith('.tmp')]
+
+
+def output_users(output_dir):
+    with open(os.path.join(output_dir, 'combined_channel_history.txt'), 'r', encoding='utf-8') as f:
+        return {line.split(' | ')[1][len('User: '):] for line in f if line.startswith('Channel: ')}
+
+
+def test_attached_senders_refresh_cached_usernames(archiver):
+    faq_archiver, clock = archiver
+    users = make_users(2)
+    messages = half_hourly_messages(10, users)
+    faq_archiver.client = FakeClient(clock, messages)
+    clock.now = START + timedelta(hours=5, minutes=10)
+    run(faq_archiver, 24, 'out')
+    assert output_users('out') == {'user0', 'user1'}
+
+    renamed = User(id=users[0].id, username='renamed0', access_hash=1)
+    for msg in messages:
+        if msg.sender_id == renamed.id:
+            msg.sender = renamed
+    clock.now += timedelta(hours=4)
+    run(faq_archiver, 24, 'out')
+
+    assert output_users('out') == {'renamed0', 'user1'}
+    assert faq_archiver.client.entity_calls == []
+
+
+def test_unresolvable_sender_only_loses_itself(archiver):
+    faq_archiver, clock = archiver
+    users = make_users(8)
+    faq_archiver.client = FakeClient(clock, half_hourly_messages(10, users, sender_attached=False),
+                                     senders=users, unresolvable={users[3].id})
+    clock.now = START + timedelta(hours=5, minutes=10)
+    stats = run(faq_archiver, 24, 'out')
+
+    assert output_users('out') == {f"user{i}" for i in range(8) if i != 3} | {'None'}
+    assert stats['sender_cache']['size'] == 7
+    assert faq_archiver.client.entity_calls[0] == sorted(user.id for user in users)
+
+
+def test_reply_index_missing_spans_query_chunks(tmp_path, monkeypatch):
+    import archive_store
+    monkeypatch.setattr(archive_store, 'REPLY_LOOKUP_CHUNK', 3)
+    replies = archive_store.ReplyIndex(str(tmp_path / 'replies.sqlite3'))
+    replies.add('tari', [(i, '2026-01-01 00:00:00', f"message {i}") for i in range(0, 20, 2)])
+    replies.add('other', [(1, '2026-01-01 00:00:00', "message 1")])
+
+    assert replies.missing('tari', range(1, 12)) == {1, 3, 5, 7, 9, 11}
+    assert replies.missing('tari', []) == set()
+    replies.close()
+
+
+def test_failed_output_still_saves_and_closes_the_store(archiver, monkeypatch):
+    faq_archiver, clock = archiver
+    import archive_store
+    faq_archiver.client = FakeClient(clock, half_hourly_messages(10))
+    clock.now = START + timedelta(hours=5, minutes=10)
+    closed = []
+    monkeypatch.setattr(archive_store.ReplyIndex, 'close', lambda self: closed.append(self.path))
+
+    async def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(faq_archiver, 'write_combined_text_history', fail)
+
+    with pytest.raises(OSError):
+        run(faq_archiver, 24, 'out')
+    assert len(closed) == 1
+    assert os.path.exists(os.path.join('out', archive_store.STORE_DIRNAME, 'senders.json'))
+
+
+def test_unresolvable_sender_is_retried_only_after_the_retry_period(archiver):
+    faq_archiver, clock = archiver
+    from archive_store import SENDER_RETRY_HOURS
+    users = make_users(4)
+    faq_archiver.client = FakeClient(clock, half_hourly_messages(60, users, sender_attached=False),
+                                     senders=users, unresolvable={users[3].id})
+    clock.now = START + timedelta(hours=5, minutes=10)
+    run(faq_archiver, 24, 'out')
+    looked_up = len(faq_archiver.client.entity_calls)
+
+    clock.now += timedelta(hours=2)
+    stats = run(faq_archiver, 24, 'out')
+    assert faq_archiver.client.entity_calls[looked_up:] == []
+    assert stats['sender_cache']['skipped'] == 1
+    assert stats['sender_cache']['failed'] == 1
+
+    clock.now += timedelta(hours=SENDER_RETRY_HOURS)
+    run(faq_archiver, 24, 'out')
+    assert faq_archiver.client.entity_calls[looked_up:] == [[users[3].id]]
+
+
+def test_only_paced_requests_raise_flood_waits(telethon_import):
+    from archive_pacer import AdaptivePacer
+    faq_archiver = telethon_import('faq_archiver')
+
+    async def scenario():
+        client = faq_archiver.ArchiveClient('paced_test', 1, 'test')
+
+        async def threshold():
+            return client.flood_sleep_threshold
+        return await threshold(), await AdaptivePacer(0, 0).call('tari', threshold), await threshold()
+
+    assert asyncio.run(scenario()) == (60, 0, 60)
+
+
+def test_html_run_downloads_media_missing_from_text_mode_records(archiver):
+    faq_archiver, clock = archiver
+    messages = half_hourly_messages(5)
+    for msg in messages[::3]:
+        msg.media = object()
+    faq_archiver.client = FakeClient(clock, messages)
+    clock.now = START + timedelta(hours=5, minutes=10)
+    run(faq_archiver, 24, 'out')
+    assert all(msg.downloads == 0 for msg in messages)
+
+    for _ in range(2):
+        run(faq_archiver, 24, 'out', output_as_text=False, media_folder='media')
+
+    from archive_store import ChannelStore
+    with_media = [record for record in ChannelStore('out').records('tari') if record['media']]
+    assert [record['id'] for record in with_media] == [msg.id for msg in messages[::3]]
+    assert all(os.path.exists(record['media_path']) for record in with_media)
+    assert all(msg.downloads == 1 for msg in messages[::3])
+    with open(os.path.join('out', 'combined_channel_history.html'), 'r', encoding='utf-8') as f:
+        assert f.read().count('<img src="media/photo') == len(with_media)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tests for BM25 retrieval of FAQ sections and the prompt context built from them
+"""
+
+import asyncio
+
+from faq_retrieval import (CONTEXT_SEPARATOR, MAX_SECTION_CHARS, FaqIndex, split_sections, split_sources,
+                           tokenize)
+from token_budget import count_tokens
+
+CORPUS = """
+=== Content from wallet.txt ===
+
+## How do I back up my wallet?
+Write down the seed words shown in Settings and keep them offline.
+
+## How do I restore a wallet?
+Open Tari Universe, choose Restore and enter your seed words.
+
+=== Content from mining.txt ===
+
+Q. Why is my hash rate low?
+Close other GPU heavy programs and check that GPU mining is enabled.
+
+Q. Can I mine on a laptop?
+Yes, but keep it plugged in and watch the temperature.
+"""
+
+
+def test_tokenize_drops_stopwords_and_plurals():
+    assert tokenize("How do I restore my Wallets?") == ['restore', 'wallet']
+    assert tokenize("the glass") == ['glass']
+
+
+def test_corpus_is_split_into_sources_and_sections():
+    sources = split_sources(CORPUS)
+    assert [name for name, _ in sources] == ['wallet.txt', 'mining.txt']
+    assert [section.splitlines()[0] for section in split_sections(sources[1][1])] == \
+        ["Q. Why is my hash rate low?", "Q. Can I mine on a laptop?"]
+
+
+def test_oversized_sections_are_split_on_paragraphs():
+    paragraph = "Mining pools share block rewards between miners. " * 10
+    text = "## Pools\n" + "\n\n".join([paragraph] * 8)
+
+    sections = split_sections(text)
+
+    assert len(sections) > 1
+    assert all(len(section) <= MAX_SECTION_CHARS for section in sections)
+
+
+def test_best_matching_section_ranks_first():
+    index = FaqIndex(CORPUS)
+
+    results = index.search("my hash rate is low")
+
+    assert len(index) == 4
+    assert results[0][1] == 'mining.txt'
+    assert results[0][2].startswith("Q. Why is my hash rate low?")
+    assert [score for score, _, _ in results] == sorted((score for score, _, _ in results), reverse=True)
+
+
+def test_context_holds_only_matching_sections_in_corpus_order():
+    index = FaqIndex(CORPUS)
+
+    context = index.build_context("restore or back up wallet seed words")
+
+    blocks = context.split(CONTEXT_SEPARATOR)
+    assert [block.splitlines()[1] for block in blocks] == ["## How do I back up my wallet?",
+                                                           "## How do I restore a wallet?"]
+    assert all(block.startswith("[wallet.txt]\n") for block in blocks)
+
+
+def test_context_respects_the_token_budget():
+    index = FaqIndex(CORPUS)
+    first = index.build_context("wallet seed words", top_k=1)
+
+    assert index.build_context("wallet seed words", token_budget=count_tokens(first)) == first
+    assert index.build_context("wallet seed words", token_budget=1) is None
+
+
+def test_unmatched_question_has_no_context_and_falls_back_to_the_full_corpus():
+    index = FaqIndex(CORPUS)
+
+    assert index.search("Как установить кошелёк?") == []
+    assert index.build_context("Как установить кошелёк?") is None
+    assert len(index.build_full_context().split(CONTEXT_SEPARATOR)) == 4
+    assert len(index.build_full_context(token_budget=30).split(CONTEXT_SEPARATOR)) < 4
+
+
+def test_batch_context_gives_every_question_its_best_section():
+    index = FaqIndex(CORPUS)
+
+    context = index.build_batch_context(["restore wallet", "mine laptop temperature"], top_k=1)
+
+    assert "## How do I restore a wallet?" in context
+    assert "Q. Can I mine on a laptop?" in context
+    assert index.build_batch_context(["xyzzy", "plugh"]) is None
+
+
+def test_sections_repeated_in_the_corpus_are_indexed_once():
+    index = FaqIndex(CORPUS + "\n\n" + CORPUS.split("=== Content from mining.txt ===")[1])
+    assert len(index) == 4
+
+
+def test_faq_request_without_retrieval_hits_sends_the_full_corpus(local_snapshot, monkeypatch):
+    import faq_engine
+    contexts = []
+
+    async def query_openai_gpt(system, faq_avoidance_text, prompt, on_text=None):
+        contexts.append(system)
+        return '{"answer": "ok"}'
+    monkeypatch.setattr(faq_engine, 'query_openai_gpt', query_openai_gpt)
+
+    asyncio.run(faq_engine.request_faq_answer("How do I bridge XTM to wXTM?", local_snapshot))
+    asyncio.run(faq_engine.request_faq_answer("Как установить кошелёк?", local_snapshot))
+
+    matched, fallback = contexts
+    assert len(matched) < len(fallback)
+    assert fallback == local_snapshot.index.build_full_context()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for versioned FAQ corpus snapshots: incremental rebuilds, atomic swaps and listeners
+"""
+
+import asyncio
+
+import pytest
+
+import faq_snapshot
+from faq_snapshot import FaqCorpus
+
+WALLET_FAQ = "## How do I back up my wallet?\nWrite down the seed words and keep them offline.\n"
+MINING_FAQ = "Q. Why is my hash rate low?\nClose other GPU heavy programs.\n"
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    faqs = tmp_path / 'faqs'
+    faqs.mkdir()
+    (faqs / 'wallet.txt').write_text(WALLET_FAQ, encoding='utf-8')
+    (faqs / 'mining.txt').write_text(MINING_FAQ, encoding='utf-8')
+    (faqs / 'faq_prompt.txt').write_text("Always answer politely.", encoding='utf-8')
+    (tmp_path / 'avoidance.txt').write_text("price predictions", encoding='utf-8')
+    return FaqCorpus(str(faqs), str(faqs / 'faq_prompt.txt'), str(tmp_path / 'avoidance.txt'))
+
+
+def refresh(corpus):
+    return asyncio.run(corpus.refresh(fetch_remote=False))
+
+
+def edit(corpus, name, text):
+    with open(f"{corpus.faqs_folder}/{name}", 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_first_refresh_loads_every_local_source(corpus):
+    snapshot = refresh(corpus)
+
+    assert snapshot.version == 1
+    assert corpus.current is snapshot
+    assert [source.name for source in snapshot.sources] == ['faq_prompt.txt', 'mining.txt', 'wallet.txt']
+    assert "=== Content from wallet.txt ===" in snapshot.faq_text
+    assert snapshot.faq_avoidance_text == "price predictions"
+    assert snapshot.index.search("hash rate")[0][1] == 'mining.txt'
+
+
+def test_unchanged_corpus_keeps_the_current_version(corpus):
+    first = refresh(corpus)
+
+    assert refresh(corpus) is first
+    assert corpus.current.version == 1
+
+
+def test_only_changed_sources_are_rebuilt(corpus):
+    first = refresh(corpus)
+    edit(corpus, 'mining.txt', MINING_FAQ + "\nQ. Can I mine on a laptop?\nYes.\n")
+
+    second = refresh(corpus)
+
+    old, new = ({source.name: source for source in snapshot.sources} for snapshot in (first, second))
+    assert second.version == 2
+    assert new['wallet.txt'] is old['wallet.txt']
+    assert new['mining.txt'] is not old['mining.txt']
+    assert "laptop" in second.faq_text
+
+
+def test_held_snapshot_is_untouched_by_a_swap(corpus):
+    held = refresh(corpus)
+    faq_text, sources = held.faq_text, held.sources
+    edit(corpus, 'wallet.txt', "## Wallets\nThe wallet moved.\n")
+
+    refresh(corpus)
+
+    assert corpus.current is not held
+    assert held.version == 1
+    assert held.faq_text == faq_text
+    assert held.sources == sources
+    assert "The wallet moved." not in held.faq_text
+
+
+def test_avoidance_change_makes_a_new_version(corpus, tmp_path):
+    refresh(corpus)
+    (tmp_path / 'avoidance.txt').write_text("price predictions\nairdrops", encoding='utf-8')
+
+    assert refresh(corpus).version == 2
+
+
+def test_listeners_get_each_new_snapshot_and_errors_are_contained(corpus):
+    seen = []
+
+    def broken(snapshot):
+        raise RuntimeError("listener failed")
+    corpus.add_listener(broken)
+    corpus.add_listener(seen.append)
+
+    first = refresh(corpus)
+    refresh(corpus)                                # Unchanged: no notification
+    edit(corpus, 'wallet.txt', WALLET_FAQ + "\nUpdated.\n")
+    second = refresh(corpus)
+
+    assert seen == [first, second]
+
+
+def test_missing_faqs_folder_keeps_the_current_snapshot(tmp_path):
+    corpus = FaqCorpus(str(tmp_path / 'missing'), str(tmp_path / 'prompt.txt'), str(tmp_path / 'avoid.txt'))
+
+    assert refresh(corpus) is faq_snapshot.EMPTY_SNAPSHOT
+
+
+def test_edited_files_are_picked_up_by_the_watcher(corpus, monkeypatch):
+    monkeypatch.setattr(faq_snapshot, 'WATCH_POLL_INTERVAL', 0.05)
+    refresh(corpus)
+
+    async def scenario():
+        swapped = asyncio.Event()
+        corpus.add_listener(lambda snapshot: swapped.set())
+        watcher = asyncio.create_task(corpus.watch_local_files(debounce=0.05))
+        await asyncio.sleep(0.1)
+        edit(corpus, 'wallet.txt', WALLET_FAQ + "\nEdited while running.\n")
+        try:
+            await asyncio.wait_for(swapped.wait(), timeout=5)
+        finally:
+            watcher.cancel()
+    asyncio.run(scenario())
+
+    assert corpus.current.version == 2
+    assert "Edited while running." in corpus.current.faq_text
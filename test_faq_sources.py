@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Tests for remote FAQ sources: conditional revalidation and the on-disk cache
+"""
+
+import asyncio
+import functools
+
+import httpx
+import pytest
+
+import faq_sources
+from faq_sources import fetch_remote_source, fetch_remote_sources, load_cached_source
+
+URL = "https://example.com/faq.md"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(faq_sources, 'REMOTE_CACHE_DIR', str(tmp_path / 'faq_cache'))
+    return tmp_path
+
+
+class Server:
+    """A scripted origin: the next responses to give, and the requests it received"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def handle(self, request):
+        self.requests.append(request)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def fetch(self, url=URL):
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(self.handle)) as session:
+                return await fetch_remote_source(session, url)
+        return asyncio.run(run())
+
+
+def ok(body, **headers):
+    return httpx.Response(200, text=body, headers=headers)
+
+
+def test_fresh_body_is_cached_with_its_validators():
+    server = Server(ok("# FAQ v1", etag='"v1"', **{'last-modified': 'Mon, 05 Jan 2026 10:00:00 GMT'}))
+
+    assert server.fetch() == "# FAQ v1"
+
+    body, meta = load_cached_source(URL)
+    assert body == "# FAQ v1"
+    assert meta['etag'] == '"v1"'
+    assert meta['last_modified'] == 'Mon, 05 Jan 2026 10:00:00 GMT'
+    assert 'if-none-match' not in server.requests[0].headers
+
+
+def test_unchanged_source_is_revalidated_and_served_from_cache():
+    server = Server(ok("# FAQ v1", etag='"v1"', **{'last-modified': 'Mon, 05 Jan 2026 10:00:00 GMT'}),
+                    httpx.Response(304))
+    server.fetch()
+
+    assert server.fetch() == "# FAQ v1"
+    assert server.requests[1].headers['if-none-match'] == '"v1"'
+    assert server.requests[1].headers['if-modified-since'] == 'Mon, 05 Jan 2026 10:00:00 GMT'
+
+
+def test_changed_source_replaces_the_cached_copy():
+    server = Server(ok("# FAQ v1", etag='"v1"'), ok("# FAQ v2", etag='"v2"'))
+    server.fetch()
+
+    assert server.fetch() == "# FAQ v2"
+    assert load_cached_source(URL)[0] == "# FAQ v2"
+
+
+@pytest.mark.parametrize('failure', [httpx.ConnectError("unreachable"), httpx.Response(500)])
+def test_failed_fetch_falls_back_to_the_cached_copy(failure):
+    server = Server(ok("# FAQ v1"), failure)
+    server.fetch()
+
+    assert server.fetch() == "# FAQ v1"
+
+
+def test_failed_fetch_without_cache_gives_nothing():
+    assert Server(httpx.ConnectError("unreachable")).fetch() is None
+    assert Server(httpx.Response(404)).fetch() is None
+
+
+def test_html_pages_are_skipped_and_not_cached():
+    server = Server(ok("<!DOCTYPE html><html><body>Docs</body></html>", **{'content-type': 'text/html'}))
+
+    assert server.fetch() is None
+    assert load_cached_source(URL) == (None, {})
+
+
+def write_url_files(directory, urls):
+    paths = []
+    for i, url in enumerate(urls):
+        path = directory / f"source{i}.url"
+        path.write_text(url + "\n", encoding='utf-8')
+        paths.append(str(path))
+    return paths
+
+
+def test_sources_are_fetched_concurrently_in_order(cache_dir, monkeypatch):
+    urls = [f"https://example.com/faq{i}.md" for i in range(3)]
+    in_flight, most_in_flight = 0, 0
+
+    async def handle(request):
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if request.url.path == '/faq1.md':
+            return httpx.Response(503)
+        return ok(f"body of {request.url.path}")
+
+    monkeypatch.setattr(faq_sources.httpx, 'AsyncClient',
+                        functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handle)))
+    url_files = write_url_files(cache_dir, urls) + [str(cache_dir / 'missing.url')]
+
+    results = asyncio.run(fetch_remote_sources(url_files))
+
+    assert [(url, body) for _, url, body in results] == [
+        (urls[0], "body of /faq0.md"), (urls[1], None), (urls[2], "body of /faq2.md")]
+    assert most_in_flight == 3
+
+
+def test_cached_only_reads_the_disk_cache_without_fetching(cache_dir, monkeypatch):
+    urls = ["https://example.com/cached.md", "https://example.com/never-fetched.md"]
+    Server(ok("cached body")).fetch(urls[0])
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("cached_only must not open an HTTP session")
+    monkeypatch.setattr(faq_sources.httpx, 'AsyncClient', no_network)
+
+    results = asyncio.run(fetch_remote_sources(write_url_files(cache_dir, urls), cached_only=True))
+
+    assert [body for _, _, body in results] == ["cached body", None]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tests for streamed answers: incremental answer parsing and throttled message edits
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import faq_streaming
+from faq_streaming import AnswerStreamParser, ProgressiveEditor
+
+
+def feed_all(chunks):
+    parser = AnswerStreamParser()
+    seen = []
+    for chunk in chunks:
+        if parser.feed(chunk):
+            seen.append(parser.text)
+    return parser, seen
+
+
+@pytest.mark.parametrize('answer', [
+    "Plain answer",
+    'Quotes "inside", a back\\slash and\nnew lines\ttabs',
+    "Non-ASCII: café, Привет, 挖矿, emoji 🚀",
+])
+def test_answer_is_decoded_from_single_character_chunks(answer):
+    raw = json.dumps({'answer': answer})
+
+    parser, seen = feed_all(raw)
+
+    assert parser.text == answer
+    assert parser.done
+    assert seen[-1] == answer
+    assert all(answer.startswith(text) for text in seen)
+
+
+@pytest.mark.parametrize('split', range(1, 13))
+def test_escapes_split_across_chunks_are_held_back(split):
+    raw = '{"answer": "\\ud83d\\ude80 \\u00e9\\n"}'
+
+    parser, seen = feed_all([raw[:10 + split], raw[10 + split:]])
+
+    assert parser.text == "🚀 é\n"
+    assert all(not text or "\\" not in text for text in seen)
+
+
+def test_single_quoted_wrapper_and_leading_keys():
+    parser, _ = feed_all(["{'confidence': 1, 'ans", "wer': 'It\\'s ", "ready'}"])
+
+    assert parser.text == "It's ready"
+    assert parser.done
+
+
+def test_nothing_is_decoded_before_the_answer_key_or_after_it_closes():
+    parser = AnswerStreamParser()
+
+    assert not parser.feed('{"ans')
+    assert parser.text == ""
+    assert parser.feed('wer": "Hi"')
+    assert not parser.feed(', "answer": "again"}')
+    assert parser.text == "Hi"
+
+
+class Message:
+    """Collects the edits made to one message; optionally fails the first few"""
+
+    def __init__(self, failures=0, error=None):
+        self.edits = []
+        self.failures = failures
+        self.error = error or RuntimeError("edit rejected")
+        self.replies = []
+
+    async def edit(self, text):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.edits.append(text)
+
+    async def reply(self, text):
+        self.replies.append(text)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+
+    async def sleep(delay):
+        slept.append(delay)
+    monkeypatch.setattr(faq_streaming.asyncio, 'sleep', sleep)
+    return slept
+
+
+def test_updates_are_throttled_and_finish_always_shows_the_answer(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(faq_streaming.time, 'monotonic', lambda: clock[0])
+    message = Message()
+    editor = ProgressiveEditor(message.edit, 'test', started_at=99.0, min_interval=1.5)
+
+    async def scenario():
+        await editor.update("The")
+        clock[0] += 0.5
+        await editor.update("The answer")          # Too soon after the last edit
+        clock[0] += 1.5
+        await editor.update("The answer is")
+        await editor.finish("The answer is 42")
+    asyncio.run(scenario())
+
+    assert message.edits == ["The ▌", "The answer is ▌", "The answer is 42"]
+    assert faq_streaming.time_to_first_text_stats()['test']['last'] == pytest.approx(1.0)
+
+
+def test_failed_update_is_not_counted_as_shown():
+    message = Message(failures=1)
+    editor = ProgressiveEditor(message.edit, 'test', started_at=0.0, min_interval=0)
+
+    async def scenario():
+        await editor.update("Partial")
+        await editor.update("Partial")
+        await editor.finish("Partial")
+        await editor.finish("Partial")
+    asyncio.run(scenario())
+
+    assert message.edits == ["Partial ▌", "Partial"]
+
+
+def test_final_edit_waits_out_a_flood_wait_and_retries(sleeps):
+    from telethon.errors import FloodWaitError
+    message = Message(failures=1, error=FloodWaitError(request=None, capture=4))
+    editor = ProgressiveEditor(message.edit, 'test', started_at=0.0, fallback=message.reply)
+
+    asyncio.run(editor.finish("The answer"))
+
+    assert sleeps == [4]
+    assert message.edits == ["The answer"]
+    assert message.replies == []
+
+
+def test_final_text_is_sent_as_a_new_message_when_editing_keeps_failing(sleeps):
+    message = Message(failures=2)
+    editor = ProgressiveEditor(message.edit, 'test', started_at=0.0, fallback=message.reply)
+
+    asyncio.run(editor.finish("The answer"))
+
+    assert sleeps == [faq_streaming.STREAM_FINAL_RETRY_DELAY]
+    assert message.edits == []
+    assert message.replies == ["The answer"]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Tests for command metrics: outcome labels of instrumented handlers
+"""
+
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from metrics import instrument_command, set_command_outcome
+
+
+def command_count(command, outcome):
+    return REGISTRY.get_sample_value('faqqer_command_requests_total',
+                                     {'command': command, 'outcome': outcome}) or 0
+
+
+def test_handlers_are_labelled_by_the_outcome_they_report():
+    @instrument_command('test_outcome')
+    async def handler(outcome=None):
+        if outcome is not None:
+            set_command_outcome(outcome)
+        return "replied"
+
+    async def scenario():
+        await handler()
+        await handler('rejected')
+        await handler('error')
+        await handler()
+    before = {outcome: command_count('test_outcome', outcome) for outcome in ('ok', 'rejected', 'error')}
+    asyncio.run(scenario())
+
+    assert {outcome: command_count('test_outcome', outcome) - count for outcome, count in before.items()} == \
+        {'ok': 2, 'rejected': 1, 'error': 1}
+
+
+def test_raising_and_cancelled_handlers_are_labelled():
+    @instrument_command('test_failure')
+    async def handler(error):
+        raise error
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(handler(RuntimeError("boom")))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(handler(asyncio.CancelledError()))
+
+    assert command_count('test_failure', 'error') == 1
+    assert command_count('test_failure', 'cancelled') == 1
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for micro-batching of concurrent submissions and the batched FAQ completion
+"""
+
+import asyncio
+
+import pytest
+
+from micro_batch import MicroBatcher
+
+
+class Recorder:
+    """Batch and single handlers that record their calls; batch answers come back upper-cased"""
+
+    def __init__(self, unanswered=(), batch_error=None):
+        self.unanswered = set(unanswered)
+        self.batch_error = batch_error
+        self.batch_calls = []
+        self.single_calls = []
+
+    async def run_batch(self, items):
+        self.batch_calls.append(list(items))
+        if self.batch_error is not None:
+            raise self.batch_error
+        return [None if item in self.unanswered else item.upper() for item in items]
+
+    async def run_one(self, item):
+        self.single_calls.append(item)
+        if item == 'boom':
+            raise RuntimeError("single call failed")
+        return f"single {item}"
+
+
+def batcher(recorder, window=0.01, max_size=8):
+    return MicroBatcher("test", recorder.run_batch, recorder.run_one, window=window, max_size=max_size)
+
+
+async def submit_all(micro_batcher, items, key=None):
+    return await asyncio.gather(*(micro_batcher.submit(item, key) for item in items), return_exceptions=True)
+
+
+def test_items_in_one_window_share_a_batch_call():
+    recorder = Recorder()
+    micro_batcher = batcher(recorder)
+
+    results = asyncio.run(submit_all(micro_batcher, ['a', 'b', 'c']))
+
+    assert results == ['A', 'B', 'C']
+    assert recorder.batch_calls == [['a', 'b', 'c']]
+    assert recorder.single_calls == []
+    assert micro_batcher.stats()['batched_items'] == 3
+
+
+def test_lone_item_skips_the_batch_call():
+    recorder = Recorder()
+    micro_batcher = batcher(recorder)
+
+    assert asyncio.run(submit_all(micro_batcher, ['a'])) == ['single a']
+    assert recorder.batch_calls == []
+    assert micro_batcher.stats()['singles'] == 1
+
+
+def test_unanswered_items_fall_back_to_single_calls():
+    recorder = Recorder(unanswered={'b'})
+    micro_batcher = batcher(recorder)
+
+    assert asyncio.run(submit_all(micro_batcher, ['a', 'b', 'c'])) == ['A', 'single b', 'C']
+    assert recorder.single_calls == ['b']
+    assert micro_batcher.stats()['fallbacks'] == 1
+
+
+def test_failed_batch_answers_every_item_alone():
+    recorder = Recorder(batch_error=ValueError("malformed reply"))
+    micro_batcher = batcher(recorder)
+
+    results = asyncio.run(submit_all(micro_batcher, ['a', 'boom']))
+
+    assert results[0] == 'single a'
+    assert isinstance(results[1], RuntimeError)
+    assert micro_batcher.stats()['failed_batches'] == 1
+    assert micro_batcher.stats()['fallbacks'] == 2
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    recorder = Recorder()
+    micro_batcher = batcher(recorder, window=60, max_size=2)
+
+    async def scenario():
+        return await asyncio.wait_for(submit_all(micro_batcher, ['a', 'b']), timeout=5)
+
+    assert asyncio.run(scenario()) == ['A', 'B']
+
+
+def test_batches_are_split_by_key():
+    recorder = Recorder()
+    micro_batcher = batcher(recorder)
+
+    async def scenario():
+        return await asyncio.gather(submit_all(micro_batcher, ['a', 'b'], key=1),
+                                    submit_all(micro_batcher, ['c', 'd'], key=2))
+
+    assert asyncio.run(scenario()) == [['A', 'B'], ['C', 'D']]
+    assert sorted(recorder.batch_calls) == [['a', 'b'], ['c', 'd']]
+
+
+@pytest.mark.parametrize('results', [['A'], ['A', 'B', 'C']])
+def test_wrong_result_count_falls_back(results):
+    recorder = Recorder()
+    micro_batcher = batcher(recorder)
+
+    async def run_batch(items):
+        return results
+    micro_batcher.run_batch = run_batch
+
+    assert asyncio.run(submit_all(micro_batcher, ['a', 'b'])) == ['single a', 'single b']
+    assert micro_batcher.stats()['failed_batches'] == 1
+
+
+def test_faq_batch_answers_matched_questions_in_one_completion(fake_llm, local_snapshot):
+    import faq_engine
+    questions = ["How do I bridge XTM to wXTM?", "Why don't I see my wXTM in MetaMask?"]
+
+    results = asyncio.run(faq_engine.answer_faq_batch([(question, local_snapshot) for question in questions]))
+
+    assert [question in answer for question, answer in zip(questions, results)] == [True, True]
+    assert fake_llm.state.counts['completions'] == 1
+
+
+def test_faq_batch_leaves_questions_without_sections_to_single_answers(fake_llm, local_snapshot):
+    import faq_engine
+    items = [("How do I bridge XTM to wXTM?", local_snapshot), ("xyzzy plugh", local_snapshot)]
+
+    assert asyncio.run(faq_engine.answer_faq_batch(items)) == [None, None]
+    assert fake_llm.state.counts['completions'] == 0
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests for single-flight coalescing of identical in-flight calls
+"""
+
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Upstream:
+    """A slow upstream call that counts how often it runs"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+        self.release = None
+
+    def call(self, key):
+        async def run():
+            self.calls.append(key)
+            await self.release.wait()
+            if self.error is not None:
+                raise self.error
+            return f"answer {key}"
+        return run
+
+
+async def fan_out(flight, upstream, keys):
+    upstream.release = asyncio.Event()
+    waiters = [asyncio.ensure_future(flight.do(key, upstream.call(key))) for key in keys]
+    await asyncio.sleep(0)
+    upstream.release.set()
+    return await asyncio.gather(*waiters, return_exceptions=True)
+
+
+def test_identical_keys_share_one_upstream_call():
+    flight, upstream = SingleFlight("test"), Upstream()
+
+    results = asyncio.run(fan_out(flight, upstream, ['a', 'a', 'a', 'b']))
+
+    assert results == ['answer a', 'answer a', 'answer a', 'answer b']
+    assert upstream.calls == ['a', 'b']
+    assert flight.stats() == {'in_flight': 0, 'executed': 2, 'coalesced': 2}
+
+
+def test_finished_calls_are_not_reused():
+    flight, upstream = SingleFlight("test"), Upstream()
+
+    async def scenario():
+        await fan_out(flight, upstream, ['a'])
+        await fan_out(flight, upstream, ['a'])
+    asyncio.run(scenario())
+
+    assert upstream.calls == ['a', 'a']
+
+
+def test_every_waiter_gets_the_exception():
+    flight, upstream = SingleFlight("test"), Upstream(error=RuntimeError("upstream down"))
+
+    results = asyncio.run(fan_out(flight, upstream, ['a', 'a']))
+
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+    assert len(upstream.calls) == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    flight, upstream = SingleFlight("test"), Upstream()
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        first = asyncio.ensure_future(flight.do('a', upstream.call('a')))
+        second = asyncio.ensure_future(flight.do('a', upstream.call('a')))
+        await asyncio.sleep(0)
+        first.cancel()
+        upstream.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == 'answer a'
+    assert upstream.calls == ['a']
+
+
+def test_identical_faq_questions_share_one_completion(fake_llm, local_snapshot, monkeypatch):
+    import faq_engine
+    monkeypatch.setattr(faq_engine.faq_corpus, 'current', local_snapshot)
+    question = "How long does a bridge transfer from XTM to wXTM take? (single flight)"
+
+    async def ask_together():
+        return await asyncio.gather(*(faq_engine.find_faq_answer(question) for _ in range(3)))
+
+    answers = asyncio.run(ask_together())
+
+    assert len(set(answers)) == 1 and answers[0]
+    assert fake_llm.state.counts['completions'] == 1
+
+
+def test_request_uses_one_snapshot_across_a_concurrent_swap(local_snapshot, monkeypatch):
+    import faq_engine
+    from faq_snapshot import EMPTY_SNAPSHOT
+    monkeypatch.setattr(faq_engine.faq_corpus, 'current', local_snapshot)
+    monkeypatch.setattr(faq_engine, 'FAQ_BATCHING', False)
+    answered_from = []
+
+    def cache_miss_during_refresh(question):
+        monkeypatch.setattr(faq_engine.faq_corpus, 'current', EMPTY_SNAPSHOT)
+        return None
+
+    async def answer_from_snapshot(question, snapshot, on_text=None):
+        answered_from.append(snapshot)
+        return "answer"
+    monkeypatch.setattr(faq_engine.answer_cache, 'get', cache_miss_during_refresh)
+    monkeypatch.setattr(faq_engine, 'answer_from_snapshot', answer_from_snapshot)
+
+    assert asyncio.run(faq_engine.find_faq_answer("How do I stake XTM? (snapshot swap)")) == "answer"
+    assert answered_from == [local_snapshot]
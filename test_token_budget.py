@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for token counting, budget filling and truncation
+"""
+
+import token_budget
+from token_budget import count_tokens, take_within_budget, truncate_to_budget
+
+
+def test_only_short_texts_are_memoized():
+    before = token_budget.token_stats()['cache_size']
+    short = "How do I set up a Tari wallet? (memo test)"
+    long_text = "line of chat history\n" * (token_budget.TOKEN_COUNT_CACHE_MAX_CHARS // 10)
+
+    assert count_tokens(short) == count_tokens(short) > 0
+    assert count_tokens(long_text) == count_tokens(long_text) > count_tokens(short)
+    assert token_budget.token_stats()['cache_size'] == before + 1
+    assert token_budget.TOKEN_COUNT_CACHE_SIZE <= 4096
+
+
+def test_estimate_errs_high_for_non_ascii_text():
+    assert token_budget.estimate_tokens("abcdefgh") == 2
+    assert token_budget.estimate_tokens("Привет") == 6
+
+
+def test_truncate_to_budget_keeps_the_beginning():
+    text = "word " * 500
+
+    cut = truncate_to_budget(text, 50)
+
+    assert text.startswith(cut)
+    assert count_tokens(cut) <= 50 < count_tokens(text)
+    assert truncate_to_budget("short", 50) == "short"
+
+
+def test_truncate_to_budget_in_estimate_mode(monkeypatch):
+    monkeypatch.setattr(token_budget, '_get_encoding', lambda: None)
+    text = "Привет мир " * 100
+
+    cut = truncate_to_budget(text, 40)
+
+    assert text.startswith(cut)
+    assert token_budget.estimate_tokens(cut) <= 40 < token_budget.estimate_tokens(cut + text[len(cut)])
+
+
+def test_take_within_budget_stops_at_the_first_item_that_does_not_fit():
+    items = ["one two three", "four", "five six seven eight nine ten", "eleven"]
+    budget = count_tokens(items[0]) + 1 + count_tokens(items[1])
+
+    taken, used = take_within_budget(items, budget, separator_tokens=1)
+
+    assert taken == items[:2]
+    assert used == budget
+    assert take_within_budget(items, 0) == ([], 0)
+
+
+def test_chat_truncation_keeps_the_most_recent_messages_within_budget(telethon_import):
+    analysis_job = telethon_import('customer_analysis_job')
+    lines = [f"Channel: tari | User: user{i} | Message: wallet sync issue number {i}" for i in range(400)]
+    chat = "\n".join(lines)
+
+    truncated = analysis_job.truncate_chat_content(chat, max_tokens=500)
+
+    assert count_tokens(truncated) <= 500
+    header, kept = truncated.split("\n\n", 1)
+    kept_lines = kept.split("\n")
+    assert kept_lines == lines[-len(kept_lines):]
+    assert header == f"[TRUNCATED: Showing most recent {len(kept_lines)} messages out of 400 total messages]"
+    assert analysis_job.truncate_chat_content(chat, max_tokens=10 ** 6) == chat
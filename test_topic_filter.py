@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Tests for the banned-topic pre-filter: banned questions are caught, support questions are not
+"""
+
+import os
+
+import pytest
+
+from topic_filter import TopicFilter
+
+AVOIDANCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'avoidance_faq_prompt.txt')
+
+
+@pytest.fixture(scope='module')
+def topic_filter():
+    with open(AVOIDANCE_FILE, 'r', encoding='utf-8') as f:
+        return TopicFilter(f.read())
+
+
+@pytest.mark.parametrize('question, topic', [
+    ("What is the price of XTM?", "The money value of XTM or tXTM or gems"),
+    ("How much is XTM worth in USD?", "The money value of XTM or tXTM or gems"),
+    ("Are my gems worth anything?", "The money value of XTM or tXTM or gems"),
+    ("What's the market cap of tXTM?", "The money value of XTM or tXTM or gems"),
+    ("Will mining damage my GPU?", "Damage to computer equipment"),
+    ("Can Tari Universe fry my laptop?", "Damage to computer equipment"),
+    ("Is mining harmful for my PC?", "Damage to computer equipment"),
+])
+def test_banned_questions_match(topic_filter, question, topic):
+    assert topic_filter.match(question) == topic
+
+
+@pytest.mark.parametrize('question', [
+    "My wallet is broken on my mac, how do I fix it?",
+    "Tari Universe app broke after update on my PC",
+    "How to fix broken device detection",
+    "What value should I put in the gpu config for XTM mining?",
+    "How much XTM do I need to pay the transaction fee cost?",
+    "How do I convert XTM to wXTM?",
+    "My CPU hashrate is 0, what should I do?",
+    "How do I earn gems?",
+])
+def test_support_questions_pass_through(topic_filter, question):
+    assert topic_filter.match(question) is None
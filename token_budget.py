@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Token Budgeting
+Counts tokens with the model's real tokenizer (tiktoken) so prompts can be filled to
+an exact budget instead of guessing from character counts. Counts of short texts are
+memoized, so FAQ sections and repeated chat lines are only tokenized once; whole
+documents (chat transcripts, full prompts) are counted without being kept alive.
+
+The encoding file is baked into the Docker image at build time (TIKTOKEN_CACHE_DIR),
+so counting works offline. If tiktoken or its encoding is unavailable, a conservative
+script-aware estimate is used instead.
+"""
+
+import logging
+import os
+import re
+from functools import lru_cache
+
+# Tokenizer settings
+TOKEN_ENCODING = os.getenv('TOKEN_ENCODING', 'o200k_base')   # Encoding used by gpt-4o
+TOKEN_COUNT_CACHE_SIZE = 2048                                # Memoized texts (FAQ sections, chat lines)
+TOKEN_COUNT_CACHE_MAX_CHARS = 4096                           # Longer texts are counted but not memoized
+
+_ASCII_RUN = re.compile(r'[\x00-\x7f]+')
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            _encoding_failed = True
+            logging.warning(f"Tokenizer '{TOKEN_ENCODING}' unavailable ({type(e).__name__}: {e}), "
+                            f"falling back to estimated token counts")
+    return _encoding
+
+
+def estimate_tokens(text):
+    """
+    Tokenizer-free estimate: ~4 chars per token for ASCII, one token per non-ASCII
+    character (Cyrillic, CJK, emoji usually cost one or more tokens each). Errs high
+    for non-English chat, which is what the old chars/4 guess got badly wrong.
+    """
+    ascii_chars = sum(len(run) for run in _ASCII_RUN.findall(text))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _count_tokens(text):
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+_count_short_tokens = lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)(_count_tokens)
+
+
+def count_tokens(text):
+    """Number of tokens in text (memoized up to TOKEN_COUNT_CACHE_MAX_CHARS characters)"""
+    if text and len(text) > TOKEN_COUNT_CACHE_MAX_CHARS:
+        return _count_tokens(text)
+    return _count_short_tokens(text)
+
+
+def truncate_to_budget(text, max_tokens):
+    """Cut text to at most max_tokens tokens, keeping the beginning"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    # Estimated mode: shrink until the estimate fits
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def take_within_budget(items, max_tokens, separator_tokens=0):
+    """
+    Take items (strings) in the given order while their total token count fits
+    in max_tokens. separator_tokens is charged between items.
+    Returns (taken_items, tokens_used).
+    """
+    taken = []
+    used = 0
+    for item in items:
+        cost = count_tokens(item) + (separator_tokens if taken else 0)
+        if used + cost > max_tokens:
+            break
+        taken.append(item)
+        used += cost
+    return taken, used
+
+
+def token_stats():
+    """Tokenizer mode and memoization stats"""
+    info = _count_short_tokens.cache_info()
+    return {
+        'encoding': TOKEN_ENCODING if _get_encoding() is not None else 'estimate',
+        'cache_hits': info.hits,
+        'cache_misses': info.misses,
+        'cache_size': info.currsize,
+    }
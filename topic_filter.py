@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Banned-topic Pre-filter
+Matches questions against the topics in avoidance_faq_prompt.txt locally, so a
+question about a banned topic gets a canned reply instead of a completion.
+Each topic line is split into concepts ("Damage to computer equipment" ->
+damage AND computer equipment; "XTM or tXTM or gems" is one concept with three
+alternatives), each concept is expanded into the terms users actually write,
+and all terms go into one Aho-Corasick automaton so a question is scanned once
+whatever the number of terms. A topic matches when every one of its concepts does.
+"""
+
+from collections import deque
+
+from answer_cache import normalize_question
+
+# Words that separate concepts in a topic line
+TOPIC_STOPWORDS = frozenset("a an the of to for in on about with and any".split())
+
+# How users phrase each concept; concepts (or words) without an entry match literally.
+# A match returns a canned refusal without asking the LLM, so only unambiguous terms
+# belong here: words common in ordinary support questions ('value', 'cost', 'broken',
+# 'pc', 'device', ...) are left out or only used inside a phrase.
+TERM_EXPANSIONS = {
+    'money value': ['money value', 'price', 'prices', 'priced', 'usd', 'dollar', 'dollars', 'dollar value',
+                    'usd value', 'fiat value', 'market value', 'market cap', 'marketcap', 'valuation',
+                    'exchange rate', 'xtm worth', 'txtm worth', 'gems worth', 'gem worth', 'tari worth',
+                    'be worth', 'worth anything'],
+    'xtm': ['xtm', 'txtm', 'tari coin', 'tari coins', 'tari token', 'tari tokens'],
+    'gems': ['gem', 'gems'],
+    'damage': ['damage', 'damaged', 'damages', 'damaging', 'fry', 'fried', 'frying', 'harm', 'harmful',
+               'destroy', 'destroyed', 'burn out', 'burned out', 'burnt out', 'wear out', 'wears out'],
+    'computer equipment': ['computer', 'computers', 'laptop', 'laptops', 'macbook', 'gpu', 'gpus', 'cpu', 'cpus',
+                           'graphics card', 'graphics cards', 'hardware', 'equipment', 'motherboard', 'battery',
+                           'my pc', 'my mac'],
+}
+
+AVOIDANCE_REPLY = "Sorry, I can't talk about {topic}. If you need help with something else, just ask!"
+
+
+class AhoCorasick:
+    """Multi-pattern string matcher: finds every occurrence of every pattern in one pass"""
+
+    def __init__(self, patterns):
+        """patterns: iterable of (pattern string, value); values of matching patterns are reported"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._out[state].append(value)
+
+        # Breadth-first: a state's failure link points to the longest proper suffix that is also a prefix
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def values(self, text):
+        """Values of all patterns occurring in text"""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            found.update(self._out[state])
+        return found
+
+
+def topic_concepts(topic):
+    """
+    Concepts of a topic line, each a list of alternative normalized phrases.
+    Stopwords separate concepts and 'or' separates alternatives within one:
+    "The money value of XTM or tXTM" -> [['money value'], ['xtm', 'txtm']]
+    """
+    concepts = []
+    run = []
+    for word in normalize_question(topic).split() + ['of']:
+        if word not in TOPIC_STOPWORDS:
+            run.append(word)
+            continue
+        alternatives = [phrase.strip() for phrase in " ".join(run).split(" or ")]
+        alternatives = [phrase for phrase in alternatives if phrase and phrase != 'or']
+        if alternatives:
+            concepts.append(alternatives)
+        run = []
+    return concepts
+
+
+def expand_concept(alternatives):
+    """Every term that counts as a mention of one concept"""
+    terms = set()
+    for phrase in alternatives:
+        terms.add(phrase)
+        if phrase in TERM_EXPANSIONS:
+            terms.update(TERM_EXPANSIONS[phrase])
+        else:
+            for word in phrase.split():
+                terms.update(TERM_EXPANSIONS.get(word, [word]))
+    return {normalize_question(term) for term in terms if normalize_question(term)}
+
+
+class TopicFilter:
+    """Matches questions against the banned topics of one avoidance text"""
+
+    def __init__(self, avoidance_text):
+        self.topics = [line.strip() for line in avoidance_text.splitlines() if line.strip()]
+        self._concept_counts = []
+        patterns = []
+        for topic_id, topic in enumerate(self.topics):
+            concepts = topic_concepts(topic)
+            self._concept_counts.append(len(concepts))
+            for concept_id, alternatives in enumerate(concepts):
+                for term in expand_concept(alternatives):
+                    # Padded with spaces so terms only match whole words
+                    patterns.append((f" {term} ", (topic_id, concept_id)))
+        self.term_count = len(patterns)
+        self._automaton = AhoCorasick(patterns)
+
+    def match(self, question):
+        """The banned topic the question is about, or None"""
+        if not self.topics:
+            return None
+        hits = {}
+        for topic_id, concept_id in self._automaton.values(f" {normalize_question(question)} "):
+            hits.setdefault(topic_id, set()).add(concept_id)
+        for topic_id, concepts in sorted(hits.items()):
+            if len(concepts) == self._concept_counts[topic_id]:
+                return self.topics[topic_id]
+        return None
+
+
+def avoidance_reply(topic):
+    return AVOIDANCE_REPLY.format(topic=topic[:1].lower() + topic[1:])